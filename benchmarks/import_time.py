@@ -0,0 +1,146 @@
+"""
+Import-time benchmark for the lightweight entry points.
+
+Validating a flowchart and the helper CLIs shouldn't pay for the model stack, so this
+checks that importing them doesn't pull in any of the heavy dependencies, and that
+`main --validate_only` runs within a time budget. Each measurement is made in a fresh
+interpreter, so nothing is already cached in sys.modules.
+
+Run from the repo root:
+    python benchmarks/import_time.py [--budget 1.0] [--repeats 5]
+
+Exits non-zero if a heavy module is imported or anything goes over budget.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+## Modules that should import without any of the heavy dependencies below
+LIGHT_MODULES = [
+    "mirna_curator.main",
+    "mirna_curator.flowchart.curation",
+    "mirna_curator.flowchart.flow_prompts",
+    "mirna_curator.llm_functions.tools",
+    "mirna_curator.visualisation",
+]
+
+HEAVY_MODULES = [
+    "guidance",
+    "llama_cpp",
+    "huggingface_hub",
+    "polars",
+    "epmc_xml.fetch",
+    "requests",
+    "wikipedia",
+    "holoviews",
+    "bokeh",
+    "matplotlib",
+    "plotly",
+    "networkx",
+]
+
+VALIDATE_ARGS = [
+    "--flowchart",
+    "flowcharts/GO_flowchart_2025_production/flowchart.json",
+    "--prompts",
+    "flowcharts/GO_flowchart_2025_production/prompts.json",
+    "--validate_only",
+]
+
+
+def run_python(args, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, *args],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    return proc, time.perf_counter() - start
+
+
+def imported_modules(importtime_output):
+    """
+    Parse the module names out of python -X importtime output
+    """
+    modules = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules[name.strip()] = int(cumulative.strip())
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.0,
+        help="Seconds allowed for each import and for --validate_only",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(REPO_ROOT / "src"), env.get("PYTHONPATH")])
+    )
+
+    failures = []
+    print(f"{'target':45s} {'median (s)':>10s}  heavy imports")
+    for module in LIGHT_MODULES:
+        timings = []
+        heavy = set()
+        for _ in range(args.repeats):
+            proc, _ = run_python(["-X", "importtime", "-c", f"import {module}"], env)
+            if proc.returncode != 0:
+                missing = proc.stderr.strip().splitlines()[-1]
+                print(f"{module:45s} {'skipped':>10s}  {missing}")
+                break
+            modules = imported_modules(proc.stderr)
+            timings.append(modules.get(module, 0) / 1e6)
+            heavy.update(m for m in HEAVY_MODULES if m in modules)
+        if len(timings) == 0:
+            continue
+        median = statistics.median(timings)
+        print(f"{module:45s} {median:10.3f}  {', '.join(sorted(heavy)) or '-'}")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(sorted(heavy))}")
+        if median > args.budget:
+            failures.append(f"{module} took {median:.3f}s to import")
+
+    timings = []
+    for _ in range(args.repeats):
+        proc, elapsed = run_python(["-m", "mirna_curator.main", *VALIDATE_ARGS], env)
+        if proc.returncode != 0:
+            failures.append(f"--validate_only failed: {proc.stderr.strip()}")
+            break
+        timings.append(elapsed)
+    if timings:
+        median = statistics.median(timings)
+        print(f"{'main --validate_only (wall clock)':45s} {median:10.3f}")
+        if median > args.budget:
+            failures.append(f"--validate_only took {median:.3f}s")
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"\nAll within {args.budget:.2f}s with no heavy imports")
+
+
+if __name__ == "__main__":
+    main()
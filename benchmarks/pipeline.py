@@ -0,0 +1,180 @@
+"""
+CPU-only benchmark of the curation pipeline, with the stub model.
+
+Runs the real flowchart over synthetic papers with `--backend stub` (see
+mirna_curator.model.stub), so everything but the model is measured: section
+loading, prompt assembly, grammar construction and masking, tracing and
+checkpointing. Needs no GGUF, GPU or network; gene annotations from Europe PMC are
+replaced with a fixed list.
+
+Run from the repo root:
+    python benchmarks/pipeline.py [--papers 20] [--rnas_per_paper 1] [--profile]
+
+With zero stub latency (the default) the time per generated token is the Python
+overhead per token. Traces and checkpoints go to a temporary directory.
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+GENES = ["PTEN", "PDCD4", "TPM1", "RECK", "SMAD7", "BCL2", "KRAS", "E2F1"]
+RNAS = ["hsa-mir-21", "hsa-mir-155", "hsa-let-7a", "hsa-mir-34a"]
+SECTIONS = ["introduction", "methods", "results", "conclusions"]
+
+SENTENCES = [
+    "{rna} is up-regulated in tumour samples compared with matched normal tissue",
+    "luciferase reporter assays showed that {rna} binds the 3'UTR of {gene}",
+    "mutation of the seed match abolished the repression of {gene} by {rna}",
+    "transfection of {rna} mimics reduced {gene} protein levels in HeLa cells",
+    "western blots confirmed the decrease of {gene} after {rna} over-expression",
+    "cells were cultured in DMEM with 10% FBS and transfected using Lipofectamine",
+    "statistical significance was assessed with a two-tailed t-test (p < 0.05)",
+    "these results suggest that {rna} promotes proliferation by silencing {gene}",
+]
+
+
+def synthetic_article(paper_index, section_sentences):
+    from epmc_xml.article import Article
+
+    rna = RNAS[paper_index % len(RNAS)]
+    sections = {}
+    for s, section in enumerate(SECTIONS):
+        sentences = [
+            SENTENCES[(paper_index + s + i) % len(SENTENCES)].format(
+                rna=rna, gene=GENES[(paper_index + i) % len(GENES)]
+            )
+            for i in range(section_sentences)
+        ]
+        sections[section] = ". ".join(sentences) + "."
+    return Article(
+        f"Synthetic paper {paper_index}",
+        ["A. Author"],
+        sections["introduction"][:500],
+        "2025-01-01",
+        sections,
+        "research-article",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--papers", type=int, default=20)
+    parser.add_argument("--rnas_per_paper", type=int, default=1)
+    parser.add_argument(
+        "--section_sentences",
+        type=int,
+        default=40,
+        help="Sentences in each synthetic section",
+    )
+    parser.add_argument(
+        "--flowchart",
+        default="flowcharts/GO_flowchart_2025_production/flowchart.json",
+    )
+    parser.add_argument(
+        "--prompts",
+        default="flowcharts/GO_flowchart_2025_production/prompts.json",
+    )
+    parser.add_argument("--evidence_type", default="single-sentence")
+    parser.add_argument("--stub_script", default=None)
+    parser.add_argument(
+        "--prune_reasoning",
+        action="store_true",
+        help="Drop each node's reasoning from the context once it has answered",
+    )
+    parser.add_argument(
+        "--checkpoint_frequency",
+        type=int,
+        default=5,
+        help="Papers between checkpoint shards",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and print the functions with the most cumulative time",
+    )
+    args = parser.parse_args()
+    flowchart_path = (REPO_ROOT / args.flowchart).resolve()
+    prompts_path = (REPO_ROOT / args.prompts).resolve()
+    stub_script = None if args.stub_script is None else str(Path(args.stub_script).resolve())
+
+    ## The tracer writes to the working directory as soon as it's imported
+    work_dir = tempfile.mkdtemp(prefix="goflow_bench_")
+    os.chdir(work_dir)
+
+    from mirna_curator.apis import epmc
+    from mirna_curator.flowchart import curation, flow_prompts
+    from mirna_curator.flowchart.computation_graph import ComputationGraph
+    from mirna_curator.model.llm import get_model
+    from mirna_curator.runner import apply_system_prompt, curate_article
+    from mirna_curator.utils.checkpoint import ShardedCheckpoint
+
+    epmc.get_gene_name_annotations = lambda pmcid: list(GENES)
+
+    cf = curation.CurationFlowchart.model_validate_json(flowchart_path.read_text())
+    prompt_data = flow_prompts.CurationPrompts.model_validate_json(prompts_path.read_text())
+    llm = get_model("stub", chat_template="chatml", backend="stub", stub_script=stub_script)
+    llm = apply_system_prompt(llm, prompt_data)
+    graph = ComputationGraph(
+        cf,
+        run_config={
+            "evidence_mode": args.evidence_type,
+            "deepseek_mode": False,
+            "prune_reasoning": args.prune_reasoning,
+        },
+    )
+    checkpoint = ShardedCheckpoint(os.path.join(work_dir, "results_checkpoint.parquet"))
+    articles = [synthetic_article(i, args.section_sentences) for i in range(args.papers)]
+
+    def run():
+        paper_seconds = []
+        pending = []
+        for i, article in enumerate(articles):
+            rows = [
+                {"PMCID": f"PMC{i:07d}", "rna_id": RNAS[(i + r) % len(RNAS)]}
+                for r in range(args.rnas_per_paper)
+            ]
+            _paper_start = time.perf_counter()
+            pending.extend(curate_article(graph, llm, article, rows, prompt_data))
+            if (i + 1) % args.checkpoint_frequency == 0:
+                checkpoint.flush(pending)
+                pending = []
+            paper_seconds.append(time.perf_counter() - _paper_start)
+        checkpoint.flush(pending)
+        return paper_seconds
+
+    metrics = llm.engine.metrics
+    _start = time.perf_counter()
+    if args.profile:
+        profiler = cProfile.Profile()
+        paper_seconds = profiler.runcall(run)
+    else:
+        paper_seconds = run()
+    total = time.perf_counter() - _start
+
+    output_tokens = metrics.engine_output_tokens
+    print(f"{'papers':30s} {len(paper_seconds):10d}")
+    print(f"{'total (s)':30s} {total:10.2f}")
+    print(f"{'median per paper (s)':30s} {statistics.median(paper_seconds):10.3f}")
+    print(f"{'papers/hour':30s} {len(paper_seconds) / max(total / 3600, 1e-9):10.0f}")
+    print(f"{'prompt tokens':30s} {metrics.engine_input_tokens:10d}")
+    print(f"{'generated tokens':30s} {output_tokens:10d}")
+    print(f"{'ms per generated token':30s} {1000 * total / max(output_tokens, 1):10.3f}")
+    print(f"{'checkpoint rows':30s} {checkpoint.read_all().height:10d}")
+    print(f"\nTraces and checkpoints in {work_dir}")
+    if args.profile:
+        print()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import requests
 from sklearn.model_selection import train_test_split
 from functools import lru_cache
 from pathlib import Path
-from epmc_xml import fetch
+from mirna_curator.apis.article_cache import get_article
 from ratelimit.exception import RateLimitException
 import time
 
@@ -17,15 +17,15 @@ def is_open_access(pmcid):
     return r.status_code == 200
 
 
-@lru_cache
+## Articles persist in the on-disk cache, so only keep a few parsed ones around here
+@lru_cache(maxsize=128)
 def _get_article(pmcid):
     try:
-        art = fetch.article(pmcid)
-        time.sleep(0.1)
+        art = get_article(pmcid)
     except RateLimitException:
         print("Ratelimit exceeded, having a 5 second nap")
         time.sleep(5)
-        art = fetch.article(pmcid)
+        art = get_article(pmcid)
 
     return art
 
@@ -114,7 +114,9 @@ class ParallelController:
         
         # Check input files for each process
         for config in configs:
-            if not Path(config.checkpoint_file).exists():
+            ## Checkpoints are written as shards alongside (or instead of) the named file
+            checkpoint_shards = Path(f"{config.checkpoint_file}.shards")
+            if not Path(config.checkpoint_file).exists() and not checkpoint_shards.exists():
                 self.logger.warning(f"Checkpoint file not found: {config.checkpoint_file}")
             
             if not Path(config.input_data).exists():
@@ -0,0 +1,258 @@
+"""
+A persistent, on-disk cache of EuropePMC articles, shared by every entry point.
+
+Re-runs, A/B comparisons between models and restarts after a crash all want the
+same papers, so there's no reason to hit EuropePMC more than once for any of them.
+
+Layout of the cache directory:
+    index.sqlite            - PMCID -> content digest, blob size and last access time
+    objects/ab/abcdef...gz  - gzipped JSON holding the raw XML and the parsed article
+
+Blobs are addressed by the sha256 of the raw XML, so two PMCIDs resolving to the same
+document share storage. When the total size goes over the limit, the least recently
+used entries are evicted.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+from xml.etree import ElementTree as ET
+
+from epmc_xml.article import Article
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GOFLOW_ARTICLE_CACHE", str(Path.home() / ".cache" / "go_flow_llm" / "articles")
+)
+DEFAULT_MAX_SIZE_GB = 5.0
+
+
+def _parser_version() -> str:
+    """
+    The version of epmc_xml doing the parsing. If this changes, cached parses are
+    rebuilt from the stored XML rather than being fetched again
+    """
+    try:
+        return version("epmc-xml")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def parse_article_xml(raw_xml: bytes) -> Dict[str, Any]:
+    """
+    Parse the raw XML for an article into the fields needed to build an Article.
+
+    This mirrors epmc_xml.fetch.article, but works from bytes we already have.
+    """
+    from epmc_xml import fetch
+
+    xml_article = ET.fromstring(raw_xml)
+    body, figures = fetch.get_body(xml_article)
+    return {
+        "title": fetch.get_title(xml_article),
+        "author_list": fetch.get_author_list(xml_article),
+        "abstract": fetch.get_abstract(xml_article),
+        "date": fetch.get_date(xml_article),
+        "sections": body,
+        "type": fetch.get_type(xml_article),
+        "figures": figures,
+    }
+
+
+def article_from_parsed(parsed: Dict[str, Any]) -> Article:
+    return Article(
+        parsed["title"],
+        parsed["author_list"],
+        parsed["abstract"],
+        parsed["date"],
+        dict(parsed["sections"]),
+        parsed["type"],
+        parsed["figures"],
+    )
+
+
+class ArticleCache:
+    """
+    Read-through cache for EuropePMC articles.
+
+    Safe to share between threads and between processes on the same filesystem;
+    every operation opens its own sqlite connection.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_size_gb: float = DEFAULT_MAX_SIZE_GB,
+    ):
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / "index.sqlite"
+        self.max_size_bytes = int(max_size_gb * 1024**3)
+        self.parser_version = _parser_version()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                "pmcid TEXT PRIMARY KEY, digest TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS articles_last_access ON articles (last_access)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.index_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest}.json.gz"
+
+    def _write_blob(self, digest: str, payload: Dict[str, Any]) -> int:
+        """
+        Write to a temporary file and rename it into place, so a crash or a
+        concurrent reader never sees half a blob
+        """
+        blob_path = self._blob_path(digest)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob_path.with_suffix(f".tmp{os.getpid()}")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, blob_path)
+        return blob_path.stat().st_size
+
+    def get(self, pmcid: str) -> Optional[Article]:
+        """
+        Get an article from the cache, or None if we don't have it
+        """
+        with self._connect() as conn:
+            entry = conn.execute(
+                "SELECT digest FROM articles WHERE pmcid = ?", (pmcid,)
+            ).fetchone()
+            if entry is None:
+                return None
+            digest = entry[0]
+            conn.execute(
+                "UPDATE articles SET last_access = ? WHERE pmcid = ?",
+                (time.time(), pmcid),
+            )
+
+        try:
+            with gzip.open(self._blob_path(digest), "rt", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, EOFError, json.JSONDecodeError) as e:
+            logger.warning("Dropping unreadable cache entry for %s: %s", pmcid, e)
+            with self._connect() as conn:
+                conn.execute("DELETE FROM articles WHERE pmcid = ?", (pmcid,))
+            return None
+
+        if payload.get("parser_version") != self.parser_version:
+            ## The parser changed under us, re-parse the XML we have rather than refetch
+            logger.info("Re-parsing cached XML for %s with new parser version", pmcid)
+            payload["parsed"] = parse_article_xml(payload["raw_xml"].encode("utf-8"))
+            payload["parser_version"] = self.parser_version
+            size = self._write_blob(digest, payload)
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE articles SET size = ? WHERE digest = ?", (size, digest)
+                )
+
+        return article_from_parsed(payload["parsed"])
+
+    def put(self, pmcid: str, raw_xml: bytes) -> Article:
+        """
+        Parse and store the raw XML for an article, returning the parsed article
+        """
+        digest = hashlib.sha256(raw_xml).hexdigest()
+        parsed = parse_article_xml(raw_xml)
+        payload = {
+            "pmcid": pmcid,
+            "parser_version": self.parser_version,
+            "raw_xml": raw_xml.decode("utf-8"),
+            "parsed": parsed,
+        }
+        size = self._write_blob(digest, payload)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO articles (pmcid, digest, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (pmcid, digest, size, time.time()),
+            )
+        self.evict()
+        return article_from_parsed(parsed)
+
+    def evict(self) -> None:
+        """
+        Drop least recently used entries until the cache is back under its size limit
+        """
+        with self._connect() as conn:
+            ## Shared blobs are only counted once
+            total_size = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT DISTINCT digest, size FROM articles)"
+            ).fetchone()[0]
+            if total_size <= self.max_size_bytes:
+                return
+            for pmcid, digest, size in conn.execute(
+                "SELECT pmcid, digest, size FROM articles ORDER BY last_access ASC"
+            ).fetchall():
+                conn.execute("DELETE FROM articles WHERE pmcid = ?", (pmcid,))
+                still_used = conn.execute(
+                    "SELECT 1 FROM articles WHERE digest = ? LIMIT 1", (digest,)
+                ).fetchone()
+                if still_used is None:
+                    self._blob_path(digest).unlink(missing_ok=True)
+                    total_size -= size
+                logger.debug("Evicted %s from the article cache", pmcid)
+                if total_size <= self.max_size_bytes:
+                    break
+
+    def fetch(self, pmcid: str) -> Article:
+        """
+        Get an article, only going to EuropePMC if it isn't already cached
+        """
+        article = self.get(pmcid)
+        if article is not None:
+            logger.debug("Article cache hit for %s", pmcid)
+            return article
+        logger.debug("Article cache miss for %s, fetching", pmcid)
+        from epmc_xml import fetch
+
+        xml_article = fetch.fetch_xml(pmcid)
+        return self.put(pmcid, ET.tostring(xml_article, encoding="utf-8"))
+
+
+_default_cache: Optional[ArticleCache] = None
+
+
+def get_default_cache() -> ArticleCache:
+    """
+    The cache used when an entry point doesn't configure its own
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ArticleCache()
+    return _default_cache
+
+
+def get_article(pmcid: str, cache: Optional[ArticleCache] = None) -> Article:
+    """
+    Drop-in replacement for epmc_xml.fetch.article that reads from the cache first
+    """
+    if cache is None:
+        cache = get_default_cache()
+    return cache.fetch(pmcid)
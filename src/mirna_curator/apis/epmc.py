@@ -1,4 +1,3 @@
-import requests
 from typing import List
 
 annotations_endpoint_url = "https://www.ebi.ac.uk/europepmc/annotations_api/annotationsByArticleIds?articleIds=PMC:{pmcid}&type=Gene_Proteins&provider=Europe PMC"
@@ -11,6 +10,8 @@ def get_gene_name_annotations(pmcid: str) -> List[str]:
 
     This can then be given to guidance to select from
     """
+    import requests
+
     res = requests.get(annotations_endpoint_url.format(pmcid=pmcid))
 
     res.raise_for_status()
@@ -16,7 +16,7 @@ import polars as pl
 import click
 from mirna_curator.model.llm import get_model
 from functools import wraps
-from epmc_xml import fetch
+from mirna_curator.apis.article_cache import get_article
 import json
 from typing import Optional, Callable
 import time
@@ -178,7 +178,7 @@ def main(config: Optional[str] = None,
         try:
             logger.info("Starting curation for paper %s", row["PMCID"])
             _paper_fetch_start = time.time()
-            article = fetch.article(row["PMCID"])
+            article = get_article(row["PMCID"])
             article.add_figures_section()
             _paper_fetch_end = time.time()
         except:
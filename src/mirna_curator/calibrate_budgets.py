@@ -0,0 +1,205 @@
+"""
+Calibrate per-node reasoning budgets from curation traces.
+
+Every reasoning generation used to get the same fixed budget (1024 tokens, 512 for
+choosing a section heading), whatever the node. This reads the reasoning each node
+actually produced in earlier runs (the curation_traces NDJSON), and sets each
+prompt's max_reasoning_tokens to a high percentile of those lengths plus a margin,
+never more than the default budget. Prompts with too few traced visits keep whatever
+budget they already have, hand-tuned or from an earlier calibration.
+
+    mirna_curator calibrate-budgets --traces curation_traces --flowchart ... \\
+        --prompts prompts.json --output prompts_calibrated.json
+
+Reasoning is counted with the model's tokenizer if --model_path is given (only the
+vocabulary is loaded), otherwise estimated from its length in characters.
+"""
+
+import json
+import logging
+import math
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import click
+
+from mirna_curator.flowchart import curation, flow_prompts
+from mirna_curator.llm_functions.reasoning import (
+    DEFAULT_REASONING_TOKENS,
+    DEFAULT_SECTION_CHOICE_TOKENS,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 95.0
+DEFAULT_MARGIN = 1.2
+DEFAULT_MIN_SAMPLES = 20
+## However short the traced reasoning, leave at least this much room
+MIN_BUDGET = 64
+## Rough characters per token, when there's no tokenizer to count with
+CHARS_PER_TOKEN = 4.0
+
+REASONING_EVENTS = {"flowchart_filter", "flowchart_internal", "flowchart_terminal"}
+SECTION_CHOICE_EVENT = "flowchart_section_choice"
+## Key for the section choice lengths, which don't belong to any prompt
+SECTION_CHOICE = "(section choice)"
+
+
+def iter_trace_events(trace_paths: Iterable[str]) -> Iterator[Dict]:
+    """
+    Read the events from trace files, or every .ndjson file in trace directories
+    """
+    for trace_path in map(Path, trace_paths):
+        files = sorted(trace_path.glob("*.ndjson")) if trace_path.is_dir() else [trace_path]
+        for trace_file in files:
+            with open(trace_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def reasoning_lengths(
+    events: Iterable[Dict],
+    flowchart: curation.CurationFlowchart,
+    count_tokens: Callable[[str], int],
+    model_id: Optional[str] = None,
+) -> Dict[str, List[int]]:
+    """
+    The length in tokens of every traced reasoning, by prompt name
+    """
+    node_prompts = {
+        name: node.data.prompt_name or node.data.terminal_name
+        for name, node in flowchart.nodes.items()
+    }
+    lengths: Dict[str, List[int]] = {}
+    for event in events:
+        if model_id is not None and event.get("model_id") != model_id:
+            continue
+        if not event.get("reasoning"):
+            continue
+        if event["type"] == SECTION_CHOICE_EVENT:
+            key = SECTION_CHOICE
+        elif event["type"] in REASONING_EVENTS:
+            key = node_prompts.get(event.get("step"))
+        else:
+            continue
+        if key is not None:
+            lengths.setdefault(key, []).append(count_tokens(event["reasoning"]))
+    return lengths
+
+
+def percentile(values: List[int], q: float) -> int:
+    """
+    Nearest-rank percentile
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def calibrate(
+    lengths: Dict[str, List[int]],
+    q: float = DEFAULT_PERCENTILE,
+    margin: float = DEFAULT_MARGIN,
+    min_samples: int = DEFAULT_MIN_SAMPLES,
+) -> Dict[str, Optional[int]]:
+    """
+    A budget for every prompt with enough traced reasoning, None for the rest, which
+    apply_budgets leaves as they are
+    """
+    budgets = {}
+    for key, values in lengths.items():
+        ceiling = (
+            DEFAULT_SECTION_CHOICE_TOKENS if key == SECTION_CHOICE else DEFAULT_REASONING_TOKENS
+        )
+        if len(values) < min_samples:
+            budgets[key] = None
+            continue
+        budgets[key] = min(max(math.ceil(percentile(values, q) * margin), MIN_BUDGET), ceiling)
+    return budgets
+
+
+def apply_budgets(
+    prompt_data: flow_prompts.CurationPrompts, budgets: Dict[str, Optional[int]]
+) -> flow_prompts.CurationPrompts:
+    """
+    Set the calibrated budgets on a copy of the prompts. Those with too few samples
+    to calibrate (None) keep the budget they have.
+    """
+    prompt_data = prompt_data.model_copy(deep=True)
+    for prompt in prompt_data.prompts:
+        if prompt.name not in budgets:
+            continue
+        if budgets[prompt.name] is None:
+            logger.info(
+                f"Too few samples to calibrate {prompt.name}, keeping its budget of "
+                f"{prompt.max_reasoning_tokens or 'the default'}"
+            )
+            continue
+        prompt.max_reasoning_tokens = budgets[prompt.name]
+    if budgets.get(SECTION_CHOICE) is not None:
+        prompt_data.section_choice_max_reasoning_tokens = budgets[SECTION_CHOICE]
+    elif SECTION_CHOICE in budgets:
+        logger.info(
+            "Too few samples to calibrate the section choice, keeping its budget of "
+            f"{prompt_data.section_choice_max_reasoning_tokens or 'the default'}"
+        )
+    return prompt_data
+
+
+@click.command()
+@click.option(
+    "--traces",
+    help="Trace files, or directories of them, to calibrate from",
+    multiple=True,
+    default=["curation_traces"],
+)
+@click.option("--flowchart", help="The flowchart the traces were made with", required=True)
+@click.option("--prompts", help="The prompts file to calibrate", required=True)
+@click.option("--output", help="Where to write the calibrated prompts", required=True)
+@click.option("--percentile", "q", help="Percentile of traced lengths to use", type=float, default=DEFAULT_PERCENTILE)
+@click.option("--margin", help="Multiply the percentile by this", type=float, default=DEFAULT_MARGIN)
+@click.option("--min_samples", help="Traced visits a prompt needs to be calibrated", type=int, default=DEFAULT_MIN_SAMPLES)
+@click.option("--model_id", help="Only use traces from this model", default=None)
+@click.option("--model_path", help="Count tokens with this model's tokenizer, rather than estimating", default=None)
+@click.option("--quantization", help="Quantization of the model, if the repo has several", default=None)
+def calibrate_budgets(
+    traces, flowchart, prompts, output, q, margin, min_samples, model_id, model_path, quantization
+):
+    """
+    Set each prompt's reasoning budget from the reasoning lengths in earlier traces
+    """
+    cf = curation.CurationFlowchart.model_validate_json(open(flowchart, "r").read())
+    prompt_data = flow_prompts.CurationPrompts.model_validate_json(open(prompts, "r").read())
+
+    if model_path is not None:
+        from mirna_curator.model.llm import get_tokenizer
+
+        tokenizer = get_tokenizer(model_path, quantization=quantization)
+
+        def count_tokens(text):
+            return len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    else:
+
+        def count_tokens(text):
+            return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    lengths = reasoning_lengths(iter_trace_events(traces), cf, count_tokens, model_id=model_id)
+    budgets = calibrate(lengths, q=q, margin=margin, min_samples=min_samples)
+
+    click.echo(f"{'prompt':40s} {'visits':>7s} {'median':>7s} {f'p{q:g}':>7s} {'budget':>7s}")
+    for key, values in sorted(lengths.items()):
+        budget = budgets[key]
+        click.echo(
+            f"{key:40s} {len(values):7d} {percentile(values, 50):7d} {percentile(values, q):7d} "
+            f"{budget if budget is not None else 'kept':>7}"
+        )
+
+    with open(output, "w") as f:
+        f.write(apply_budgets(prompt_data, budgets).model_dump_json(indent=2))
+    click.echo(f"Wrote calibrated prompts to {output}")
+
+
+if __name__ == "__main__":
+    calibrate_budgets()
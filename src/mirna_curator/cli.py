@@ -0,0 +1,29 @@
+"""
+The `mirna_curator` command:
+    mirna_curator curate ...   - a batch curation run (the same as python -m mirna_curator.main)
+    mirna_curator serve ...    - keep the model loaded and curate jobs sent over HTTP
+    mirna_curator serve-model  - load the model once, for curation processes run with --backend server
+    mirna_curator calibrate-budgets - set each prompt's reasoning budget from earlier traces
+"""
+
+import click
+
+from mirna_curator.calibrate_budgets import calibrate_budgets
+from mirna_curator.main import main as curate
+from mirna_curator.model.model_server import serve_model
+from mirna_curator.serve import serve
+
+
+@click.group()
+def cli():
+    pass
+
+
+cli.add_command(curate, name="curate")
+cli.add_command(serve, name="serve")
+cli.add_command(serve_model, name="serve-model")
+cli.add_command(calibrate_budgets, name="calibrate-budgets")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,30 +1,55 @@
 import typing as ty
 from dataclasses import dataclass
 from guidance.models._base._model import Model
-from guidance import user, assistant, select, gen, with_temperature
+from guidance import user, assistant, select
 import guidance
 from epmc_xml.article import Article
 from mirna_curator.utils.tracing import curation_tracer
+from mirna_curator.utils.metrics import NodeTimer
 
 from mirna_curator.flowchart.curation import NodeType, CurationFlowchart
 from mirna_curator.flowchart.flow_prompts import CurationPrompts
+from mirna_curator.flowchart.plan import (
+    NO_ANNOTATION_PROMPT,
+    FlowchartPlan,
+    FlowchartPlanError,
+    NodePlan,
+    compile_plan,
+)
+from mirna_curator.flowchart.section_headings import SectionHeadingMap
 
 from mirna_curator.llm_functions.conditions import (
+    compact_node_record,
+    load_article_sections,
     prompted_flowchart_step_bool,
     prompted_flowchart_terminal,
     prompted_flowchart_step_tool,
     prompted_flowchart_terminal_conditional,
 )
 from mirna_curator.llm_functions.filtering import prompted_filter
-from mirna_curator.model.llm import STOP_TOKENS
+from mirna_curator.llm_functions.prompt_layout import section_token_count
+from mirna_curator.llm_functions.reasoning import (
+    DEFAULT_SECTION_CHOICE_TOKENS,
+    reasoning,
+    reasoning_budget,
+)
+from mirna_curator.llm_functions.section_fitting import (
+    NODE_OVERHEAD_TOKENS,
+    fit_section_text,
+    section_budget,
+)
+from mirna_curator.utils.estimate import resolve_section_name
 from time import time
 from functools import partial
 import logging
+import sys
 
 logger = logging.getLogger(__name__)
 
 
-def find_section_heading(llm, target, possibles):
+def find_section_heading(
+    llm, target, possibles, max_tokens=DEFAULT_SECTION_CHOICE_TOKENS
+):
     """
     Finds the most likely section heading given the ones found in the paper.
 
@@ -57,13 +82,9 @@ def find_section_heading(llm, target, possibles):
             )
             llm += "\nThink about it briefly, then make a selection.\n"
         with assistant():
-            llm += (
-                f"The section heading {target} implies "
-                + with_temperature(
-                    gen("reasoning", max_tokens=512, stop=STOP_TOKENS), 0.6
-                )
-                + " therefore the most likely section heading is: "
-            )
+            llm += f"The section heading {target} implies "
+            llm += reasoning("reasoning", max_tokens=max_tokens, temperature=0.6)
+            llm += " therefore the most likely section heading is: "
             llm += select(possibles, name="target_section_name")
         target_section_name = llm["target_section_name"]
         curation_tracer.log_event(
@@ -76,9 +97,9 @@ def find_section_heading(llm, target, possibles):
             timestamp=time(),
         )
     except Exception as e:
-        print(e)
-        print(llm)
-        exit()
+        logger.error(f"Hit error: {e} while choosing a section heading for {target}")
+        logger.error(f"LLM state: {str(llm)}")
+        raise
     return target_section_name
 
 
@@ -93,11 +114,40 @@ class ComputationNode:
 
 
 class ComputationGraph:
-    def __init__(self, flowchart: CurationFlowchart, run_config: ty.Dict = None):
+    def __init__(
+        self,
+        flowchart: CurationFlowchart,
+        run_config: ty.Dict = None,
+        heading_map: ty.Optional[SectionHeadingMap] = None,
+        exit_on_error: bool = True,
+    ):
+        self.flowchart = flowchart
+        ## A run that can't carry on exits the process, unless something long running
+        ## (the server) owns the graph, when it raises instead, see abort
+        self.exit_on_error = exit_on_error
+        ## Compiled with the prompts on the first run, see use_plan
+        self.plan: ty.Optional[FlowchartPlan] = None
         self.construct_nodes(flowchart)
         self.loaded_sections = []
         self.run_config = run_config
         self.current_node = None
+        self.visit_metrics = []
+        self.sections_loaded = 0
+        ## Sections that had to be cut down to fit the context, as they were loaded
+        self.fitted_sections = {}
+        self.sections_fitted = 0
+        ## The text of each section loaded since the start of the run, and the state
+        ## before any of them, so the context can be rebuilt without stale ones
+        self.section_texts = {}
+        self.context_base = None
+        self.base_sections = []
+        self.sections_evicted = 0
+        self.section_choice_tokens = DEFAULT_SECTION_CHOICE_TOKENS
+        ## Headings learned across papers, which can be shared between graphs, and the
+        ## target -> heading choices made for the current paper
+        self.heading_map = heading_map if heading_map is not None else SectionHeadingMap()
+        self.section_names = {}
+        self.section_names_article = None
 
     def construct_nodes(self, flowchart: CurationFlowchart) -> None:
         """
@@ -163,32 +213,246 @@ class ComputationGraph:
 
         self.start_node = self._nodes[flowchart.startNode]
 
+    def abort(self, message: str) -> ty.NoReturn:
+        """
+        Give up on the run: exit the process, or raise a RuntimeError if the graph
+        shouldn't exit on errors
+        """
+        logger.fatal(message)
+        if self.exit_on_error:
+            sys.exit(1)
+        raise RuntimeError(message)
+
+    def node_config(self, prompt) -> ty.Dict[str, ty.Any]:
+        """
+        The config passed to a node's function: the run config, plus the reasoning
+        budget of the node's prompt
+        """
+        return {
+            **(self.run_config or {}),
+            "max_reasoning_tokens": prompt.max_reasoning_tokens,
+        }
+
+    def use_plan(self, prompts: CurationPrompts) -> FlowchartPlan:
+        """
+        Compile the flowchart with these prompts, unless it already has been, and take
+        the section choice reasoning budget from them. Raises FlowchartPlanError if
+        the prompts don't match the flowchart.
+        """
+        if self.plan is None or self.plan.prompts is not prompts:
+            self.plan = compile_plan(self.flowchart, prompts)
+        self.section_choice_tokens = (
+            self.plan.section_choice_max_reasoning_tokens or DEFAULT_SECTION_CHOICE_TOKENS
+        )
+        return self.plan
+
+    def current_node_plan(self) -> NodePlan:
+        """
+        The plan for the current node, raising FlowchartPlanError if it can't be run
+        """
+        node_plan = self.plan[self.current_node.name]
+        if len(node_plan.problems) > 0:
+            raise FlowchartPlanError(list(node_plan.problems))
+        return node_plan
+
+    def node_reserve(self, node_plan: NodePlan) -> int:
+        """
+        The context a node needs for its own turns, besides its section
+        """
+        return max(len(node_plan.questions), 1) * (
+            reasoning_budget(self.node_config(node_plan.prompt)) + NODE_OVERHEAD_TOKENS
+        )
+
+    def path_reserve(self) -> int:
+        """
+        The context the nodes on the most demanding path through the flowchart need
+        for their own turns, besides their sections. Filters' turns aren't kept, so
+        a filter only needs its own reserve while it runs.
+        """
+        reserves = {}
+
+        def reserve_from(node, visiting):
+            if node.name in reserves:
+                return reserves[node.name]
+            ## A cycle back to a node on the path adds nothing new
+            if node.name in visiting:
+                return 0
+            node_plan = self.plan[node.name]
+            own = 0
+            if node_plan.prompt is not None and node_plan.prompt.name != NO_ANNOTATION_PROMPT:
+                own = self.node_reserve(node_plan)
+            after = max(
+                (reserve_from(n, visiting | {node.name}) for n in node.transitions.values()),
+                default=0,
+            )
+            reserves[node.name] = max(own, after) if node.node_type == "filter" else own + after
+            return reserves[node.name]
+
+        return reserve_from(self.start_node, frozenset())
+
+    def needed_sections(self, article) -> ty.Optional[ty.Set[str]]:
+        """
+        The sections the current node, or any node reachable from it, can use. None
+        if that can't be told without asking the LLM to match a section heading.
+        """
+        needed = set()
+        for target_section in self.plan[self.current_node.name].downstream_sections:
+            section_name = self.section_names.get(target_section) or resolve_section_name(
+                target_section, article, self.heading_map
+            )
+            if section_name is None:
+                return None
+            needed.add(section_name)
+        return needed
+
+    def mark_loaded(self, section_name, section_text) -> None:
+        self.loaded_sections.append(section_name)
+        self.section_texts[section_name] = section_text
+
+    def evict_stale_sections(self, llm, article, section_name, section_text, reserve):
+        """
+        If a section about to be loaded won't fit in what's left of the context, rebuild
+        the LLM state without the sections no node still to come can use.
+
+        The state goes back to how it was at the start of the run, and the sections
+        still needed are loaded again in one turn, so the earlier node turns are
+        dropped too. Preloaded sections are part of that starting state, so are
+        never evicted. Returns the LLM state to carry on with.
+        """
+        if section_name in self.loaded_sections or self.context_base is None:
+            return llm
+        budget = section_budget(llm, reserve)
+        if budget is None or section_token_count(llm, section_text) <= budget:
+            return llm
+        needed = self.needed_sections(article)
+        if needed is None:
+            return llm
+        evictable = [n for n in self.loaded_sections if n not in self.base_sections]
+        stale = [n for n in evictable if n not in needed]
+        if len(stale) == 0:
+            return llm
+
+        kept = [n for n in evictable if n in needed]
+        logger.info(
+            f"Evicting sections {stale} from the context to make room for {section_name}, keeping {kept}"
+        )
+        llm = self.context_base
+        if len(kept) > 0:
+            llm += load_article_sections([self.section_texts[n] for n in kept])
+        for name in stale:
+            self.section_texts.pop(name, None)
+            self.fitted_sections.pop(name, None)
+        self.loaded_sections = self.base_sections + kept
+        self.sections_evicted += len(stale)
+        return llm
+
+    def fit_section(self, llm, section_name, section_text, node_plan, rna_id, keep=True):
+        """
+        The text of a section to give a node. A section already in the context is
+        given as it was loaded. Otherwise, if it won't fit in what's left of the
+        context, leaving room for the node's questions, it is cut down to fit (see
+        llm_functions.section_fitting). With keep, the cut down text is remembered for
+        the nodes after this one, which will find it already loaded.
+        """
+        if section_name in self.fitted_sections:
+            return self.fitted_sections[section_name]
+        if section_name in self.loaded_sections:
+            return section_text
+        budget = section_budget(llm, self.node_reserve(node_plan))
+        if budget is None:
+            return section_text
+        fitted = fit_section_text(llm, section_text, budget, node_plan.query, rna_id)
+        if keep and fitted is not section_text:
+            self.fitted_sections[section_name] = fitted
+        return fitted
+
     def infer_target_section_name(self, llm, prompt, article):
         """
-        Check the dsection names in the dictionary first, then fall back to asking the LLM
-        for help if there's no direct match
+        Match the section names in the paper first (see section_headings), then fall
+        back to asking the LLM for help if there's no match. Either way the choice is
+        kept for the rest of the paper.
 
         This is used in a few places, so makes sense to factor out
         """
-        ## sometimes, the section we want is named differently, so need to use the LLM to figure it out
-        if not prompt.target_section in article.sections.keys():
-            check_subtitles = [
-                prompt.target_section in section_name
-                for section_name in article.sections.keys()
-            ]
-            if not any(check_subtitles):
+        if article is not self.section_names_article:
+            self.section_names = {}
+            self.section_names_article = article
+        if prompt.target_section in self.section_names:
+            return self.section_names[prompt.target_section]
+
+        headings = list(article.sections.keys())
+        target_section_name = self.heading_map.match(prompt.target_section, headings)
+        if target_section_name is None:
+            ## sometimes, the section we want is named differently, so need to use the LLM to figure it out
+            try:
                 target_section_name = find_section_heading(
-                    llm, prompt.target_section, list(article.sections.keys())
+                    llm,
+                    prompt.target_section,
+                    headings,
+                    max_tokens=self.section_choice_tokens,
                 )
-            else:
-                target_section_name = list(article.sections.keys())[
-                    check_subtitles.index(True)
-                ]
-        else:
-            target_section_name = prompt.target_section
+            except Exception as e:
+                self.abort(f"Couldn't choose a section heading for {prompt.target_section}: {e}")
+            self.heading_map.learn(prompt.target_section, target_section_name, headings)
+        elif target_section_name != prompt.target_section:
+            logger.info(
+                f"Matched section {prompt.target_section} to heading {target_section_name}"
+            )
 
+        self.section_names[prompt.target_section] = target_section_name
         return target_section_name
 
+    def preload_sections(self, llm, article, prompts):
+        """
+        Load every section any node in the flowchart targets into the context up front.
+
+        This is for curating several RNAs from one paper: the returned state has all
+        the shared text in it, so each RNA can branch from it and only the node turns
+        differ. Prefix reuse in the KV cache means the text is only evaluated once.
+
+        Returns the new LLM state, and the names of the sections now loaded, which
+        should be passed to execute_graph.
+        """
+        plan = self.use_plan(prompts)
+        self.fitted_sections = {}
+        section_names = []
+        section_questions = {}
+        for node_plan in plan.nodes.values():
+            if node_plan.prompt is None or node_plan.target_section is None:
+                continue
+            target_section_name = self.infer_target_section_name(
+                llm, node_plan.prompt, article
+            )
+            if target_section_name not in section_names:
+                section_names.append(target_section_name)
+            section_questions.setdefault(target_section_name, []).append(node_plan.query)
+
+        section_texts = [
+            article.get_section(
+                section_name, include_figures=True, figures_placement="end"
+            )
+            for section_name in section_names
+        ]
+        ## Preloaded sections are never evicted, so leave room for every node on the
+        ## longest path. If they won't all fit, cut each down in proportion to its size
+        budget = section_budget(llm, self.path_reserve())
+        section_tokens = [section_token_count(llm, text) for text in section_texts]
+        if budget is not None and sum(section_tokens) > budget:
+            for i, section_name in enumerate(section_names):
+                fitted = fit_section_text(
+                    llm,
+                    section_texts[i],
+                    budget * section_tokens[i] // sum(section_tokens),
+                    " ".join(section_questions[section_name]),
+                )
+                if fitted is not section_texts[i]:
+                    self.fitted_sections[section_name] = fitted
+                    section_texts[i] = fitted
+
+        logger.info(f"Preloading sections {section_names} into context")
+        llm += load_article_sections(section_texts)
+        return llm, section_names
+
     def run_filters(self, llm, article, prompts, rna_id):
         """
         Run filters in the flowchart
@@ -200,13 +464,11 @@ class ComputationGraph:
         while self.current_node.node_type == "filter":
             logger.info(f"Applying filter node {self.current_node.name}")
             self.visited_nodes.append(self.current_node.name)
+            node_timer = NodeTimer(llm, self.current_node.name)
 
-            ## Have to filter to get the prompt named by the flowchart node
-            prompt = list(
-                filter(
-                    lambda p: p.name == self.current_node.prompt_name, prompts.prompts
-                )
-            )[0]
+            node_plan = self.current_node_plan()
+            prompt = node_plan.prompt
+            filter_decision, filter_reasoning = None, None
 
             try:
                 ## Find and load the relevant article section
@@ -214,17 +476,26 @@ class ComputationGraph:
                     llm, prompt, article
                 )
 
+                ## Filters don't persist anything, so only skip loading if the section was preloaded
                 filter_decision, filter_reasoning = self.current_node.function(
                     llm,
-                    article.get_section(
+                    self.fit_section(
+                        llm,
                         target_section_name,
-                        include_figures=True,
-                        figures_placement="end",
+                        article.get_section(
+                            target_section_name,
+                            include_figures=True,
+                            figures_placement="end",
+                        ),
+                        node_plan,
+                        rna_id,
+                        keep=False,
                     ),
-                    True,
+                    target_section_name not in self.loaded_sections,
                     prompt.prompt,
                     rna_id,
-                    config=self.run_config,
+                    config=self.node_config(prompt),
+                    question=node_plan.rendered_questions[0],
                 )
 
                 node_result = filter_decision
@@ -244,6 +515,7 @@ class ComputationGraph:
                 self.visit_results.append(node_result)
                 self.visit_evidences.append(node_evidence)
                 self.visit_reasonings.append(node_reasoning)
+                self.visit_metrics.append(node_timer.finish(llm))
 
                 ## Only move to next node after updating everything else
                 self.current_node = self.current_node.transitions[node_result == "yes"]
@@ -261,67 +533,92 @@ class ComputationGraph:
                 logger.error(f"LLM state: {str(llm)}")
                 logger.error(filter_decision)
                 logger.error(filter_reasoning)
-                exit(1)
+                self.abort(f"Filter {self.current_node.name} failed: {e}")
 
     @guidance
-    def run_nodes(self, llm, article, prompts, rna_id):
+    def run_nodes(self, llm, article, prompts, rna_id, prune_reasoning=False):
         """
         Runs the core logic of the flowchart
         This will just keep advancing the state until it hits a terminal node
         Therefore, it doesn't return anything
+
+        With prune_reasoning, each node's reasoning is dropped from the context once
+        it has answered, leaving its question, answer and evidence for the nodes
+        after it. The full reasoning is still traced and recorded.
         """
         error_count = 0
         while self.current_node.node_type == "internal":
-            print(self.current_node.name)
-            ## Have to filter to get the prompt named by the flowchart node
-            prompt = list(
-                filter(
-                    lambda p: p.name == self.current_node.prompt_name, prompts.prompts
-                )
-            )[0]
+            logger.debug(f"Visiting node {self.current_node.name}")
+            node_plan = self.current_node_plan()
+            prompt = node_plan.prompt
 
             self.visited_nodes.append(self.current_node.name)
             logger.info(f"Processing node {self.current_node.name}")
+            node_timer = NodeTimer(llm, self.current_node.name)
 
+            ## The heading is only matched once per paper, later nodes reuse it
+            target_section_name = self.infer_target_section_name(llm, prompt, article)
             ## see if we already have the target section loaded - this should speed things up provided we can reuse the context
-            if not prompt.target_section in self.loaded_sections:
-                logger.info(f"Loading section {prompt.target_section} into context")
-                ## sometimes, the section we want is named differently, so need to use the LLM to figure it out
-                target_section_name = self.infer_target_section_name(
-                    llm, prompt, article
-                )
-            else:
-                target_section_name = prompt.target_section
+            if target_section_name not in self.loaded_sections:
+                logger.info(f"Loading section {target_section_name} into context")
 
             try:
+                ## A section that doesn't fit in what's left of the context first makes
+                ## room by evicting stale sections, then is cut down if it still won't fit
+                section_text = article.get_section(
+                    target_section_name,
+                    include_figures=True,
+                    figures_placement="end",
+                )
+                llm = self.evict_stale_sections(
+                    llm,
+                    article,
+                    target_section_name,
+                    section_text,
+                    self.node_reserve(node_plan),
+                )
+                section_text = self.fit_section(
+                    llm, target_section_name, section_text, node_plan, rna_id
+                )
+                node_start = llm
+                load_section = target_section_name not in self.loaded_sections
                 ## Now we load a section to the context only once, we have to get the node result here.
-                if target_section_name in self.loaded_sections:
+                if not load_section:
                     logger.info("Running condition function, not loading context")
                     llm += self.current_node.function(
-                        article.get_section(
-                            target_section_name,
-                            include_figures=True,
-                            figures_placement="end",
-                        ),
+                        section_text,
                         False,
                         prompt.prompt,
                         rna_id,
-                        config=self.run_config,
+                        config=self.node_config(prompt),
+                        question=node_plan.rendered_questions[0],
                     )
                 else:
                     logger.info("Running condition function, loading context")
                     llm += self.current_node.function(
-                        article.get_section(
-                            target_section_name,
-                            include_figures=True,
-                            figures_placement="end",
-                        ),
+                        section_text,
                         True,
                         prompt.prompt,
                         rna_id,
-                        config=self.run_config,
+                        config=self.node_config(prompt),
+                        question=node_plan.rendered_questions[0],
+                    )
+                    self.mark_loaded(target_section_name, section_text)
+
+                if prune_reasoning:
+                    ## The record asks the question the node asked, so the prefix
+                    ## up to the end of its user turn is shared and only the rest of
+                    ## the record is evaluated again
+                    llm = node_start + compact_node_record(
+                        section_text,
+                        load_section,
+                        prompt.prompt,
+                        rna_id,
+                        llm["answer"],
+                        llm["evidence"],
+                        llm["reasoning"],
+                        question=node_plan.rendered_questions[0],
                     )
-                    self.loaded_sections.append(target_section_name)
 
             ## TODO: improve specificity of exception handling here
             except Exception as e:
@@ -329,9 +626,7 @@ class ComputationGraph:
                 logger.error(f"Exception: {e}")
                 error_count += 1
                 if error_count > 3:
-                    print("Too many errors, exiting")
-                    logger.fatal("Too many errors, exiting")
-                    exit()
+                    self.abort("Too many errors, exiting")
                 continue
 
             node_result = llm["answer"].lower().replace("*", "") == "yes"
@@ -351,6 +646,7 @@ class ComputationGraph:
             self.visit_results.append(node_result)
             self.visit_evidences.append(node_evidence)
             self.visit_reasonings.append(node_reasoning)
+            self.visit_metrics.append(node_timer.finish(llm))
 
             ## Move to the next node...
             if self.current_node.transitions.get(node_result, None) is not None:
@@ -381,16 +677,9 @@ class ComputationGraph:
         annotation = None
         if "terminal" in self.current_node.node_type:
             self.visited_nodes.append(self.current_node.name)
-            if self.current_node.prompt_name is None:
-                prompt = None
-            else:
-                prompt = list(
-                    filter(
-                        lambda p: p.name == self.current_node.prompt_name,
-                        prompts.prompts,
-                    )
-                )[0]
-
+            node_timer = NodeTimer(llm, self.current_node.name)
+            node_plan = self.current_node_plan()
+            prompt = node_plan.prompt
 
             if prompt is None:
                 annotation = None
@@ -410,29 +699,43 @@ class ComputationGraph:
                 )
                 if self.current_node.node_type == "terminal_full":
                     annotation = prompt.annotation
-                    detector = list(
-                        filter(lambda d: d.name == prompt.detector, prompts.detectors)
-                    )[0]
+                    detector = node_plan.detector
+                    llm = self.evict_stale_sections(
+                        llm,
+                        article,
+                        target_section_name,
+                        article.sections[target_section_name],
+                        self.node_reserve(node_plan),
+                    )
+                    section_text = self.fit_section(
+                        llm,
+                        target_section_name,
+                        article.sections[target_section_name],
+                        node_plan,
+                        rna_id,
+                    )
                     ## Now we load a section to the context only once, we have to get the node result here.
                     if target_section_name in self.loaded_sections:
                         llm += self.current_node.function(
-                            article.sections[target_section_name],
+                            section_text,
                             False,
                             detector.prompt,
                             rna_id,
                             paper_id,
-                            config=self.run_config,
+                            config=self.node_config(prompt),
+                            question=node_plan.rendered_questions[-1],
                         )
                     else:
                         llm += self.current_node.function(
-                            article.sections[target_section_name],
+                            section_text,
                             True,
                             detector.prompt,
                             rna_id,
                             paper_id,
-                            config=self.run_config,
+                            config=self.node_config(prompt),
+                            question=node_plan.rendered_questions[-1],
                         )
-                        self.loaded_sections.append(target_section_name)
+                        self.mark_loaded(target_section_name, section_text)
 
                     ## extract results from the LLM
                     ## handle multiple targets
@@ -446,32 +749,48 @@ class ComputationGraph:
                     node_evidence = llm["evidence"]
                 else: ## conditional terminal annotation - quite rare!
                     annotations = prompt.annotation ## This will be a dictionary now
-                    detector = list(
-                        filter(lambda d: d.name == prompt.detector, prompts.detectors)
-                    )[0]
+                    detector = node_plan.detector
                     conditional_prompts = prompt.prompt ## This is a list of N questions
+                    llm = self.evict_stale_sections(
+                        llm,
+                        article,
+                        target_section_name,
+                        article.sections[target_section_name],
+                        self.node_reserve(node_plan),
+                    )
+                    section_text = self.fit_section(
+                        llm,
+                        target_section_name,
+                        article.sections[target_section_name],
+                        node_plan,
+                        rna_id,
+                    )
                     decisions = ""
-                    for p in conditional_prompts:
+                    for p, question in zip(
+                        conditional_prompts, node_plan.rendered_questions
+                    ):
                         ## Now we load a section to the context only once, we have to get the node result here.
                         if target_section_name in self.loaded_sections:
                             llm += self.current_node.function(
-                                article.sections[target_section_name],
+                                section_text,
                                 False,
                                 p,
                                 rna_id,
                                 paper_id,
-                                config=self.run_config,
+                                config=self.node_config(prompt),
+                                question=question,
                             )
                         else:
                             llm += self.current_node.function(
-                                article.sections[target_section_name],
+                                section_text,
                                 True,
                                 p,
                                 rna_id,
                                 paper_id,
-                                config=self.run_config,
+                                config=self.node_config(prompt),
+                                question=question,
                             )
-                            self.loaded_sections.append(target_section_name)
+                            self.mark_loaded(target_section_name, section_text)
                         decisions += "y" if llm['answer'] == "yes" else "n"
 
                     ## Use decisions string to lookup the right annotation
@@ -480,25 +799,27 @@ class ComputationGraph:
                     ## Now get the target
                     if target_section_name in self.loaded_sections:
                         llm += self.current_node.function(
-                            article.sections[target_section_name],
+                            section_text,
                             False,
                             detector.prompt,
                             rna_id,
                             paper_id,
-                            config=self.run_config,
-                            detector=True
+                            config=self.node_config(prompt),
+                            detector=True,
+                            question=node_plan.rendered_questions[-1],
                         )
                     else:
                         llm += self.current_node.function(
-                            article.sections[target_section_name],
+                            section_text,
                             True,
                             detector.prompt,
                             rna_id,
                             paper_id,
-                            config=self.run_config,
-                            detector=True
+                            config=self.node_config(prompt),
+                            detector=True,
+                            question=node_plan.rendered_questions[-1],
                         )
-                        self.loaded_sections.append(target_section_name)
+                        self.mark_loaded(target_section_name, section_text)
 
                     ## extract results from the LLM
                     ## handle multiple targets
@@ -515,6 +836,7 @@ class ComputationGraph:
             self.visit_results.append(target_name)
             self.visit_evidences.append(node_evidence)
             self.visit_reasonings.append(node_reasoning)
+            self.visit_metrics.append(node_timer.finish(llm))
 
             curation_tracer.log_event(
                 "flowchart_terminal",
@@ -536,8 +858,32 @@ class ComputationGraph:
         article: Article,
         rna_id: str,
         prompts: CurationPrompts,
+        loaded_sections: ty.Optional[ty.List[str]] = None,
     ):
+        """
+        Run the whole flowchart for one RNA in one paper.
+
+        If the LLM state already has some sections in its context (see preload_sections)
+        their names should be given in loaded_sections so they aren't loaded again.
+
+        Timings and token counts for each node visited are left in visit_metrics, and
+        the number of sections loaded in sections_loaded (of those cut down to fit the
+        context in sections_fitted, and evicted to make room in sections_evicted),
+        until the next run.
+        """
         curation_tracer.set_paper_id(paper_id)
+        self.use_plan(prompts)
+        self.loaded_sections = list(loaded_sections or [])
+        self.context_base = llm
+        self.base_sections = list(self.loaded_sections)
+        self.section_texts = {}
+        self.sections_evicted = 0
+        ## Keep the cut down text of any preloaded sections, forget the rest
+        self.fitted_sections = {
+            name: text
+            for name, text in self.fitted_sections.items()
+            if name in self.loaded_sections
+        }
         self.current_node = self._nodes[self.start_node.name]
 
         curation_tracer.log_event(
@@ -555,6 +901,7 @@ class ComputationGraph:
         self.visit_results = []
         self.visit_evidences = []
         self.visit_reasonings = []
+        self.visit_metrics = []
         self.error_count = 0
 
         self.run_filters(llm, article, prompts, rna_id)
@@ -564,7 +911,12 @@ class ComputationGraph:
         )
         if annotation is None and self.current_node.node_type != "terminal":
             ## means the filtering steps did not end on a terminal node, so continue curation
-            llm += self.run_nodes(article, prompts, rna_id)
+            llm += self.run_nodes(
+                article,
+                prompts,
+                rna_id,
+                prune_reasoning=(self.run_config or {}).get("prune_reasoning", False),
+            )
             ## Once this is done, we should have hit a terminal node, so we can update the annotation and aes
             annotation, aes = self.terminal_node_check(
                 llm, article, prompts, rna_id, paper_id
@@ -594,5 +946,8 @@ class ComputationGraph:
             result[f"{visited}_reasoning"] = visit_reasoning
         result.update({"annotation": annotation, "aes": aes})
         trace = str(llm)
+        self.sections_loaded = len(self.loaded_sections)
+        self.sections_fitted = len(self.fitted_sections)
         self.loaded_sections = []
+        self.context_base = None
         return trace, result
@@ -19,6 +19,8 @@ class Prompt(BaseModel):
     detector: Optional[str] = None
     annotation: Optional[Dict[str, Dict]] = None
     legacy_annotation: Optional[str] = None
+    ## Calibrated from traces with `mirna_curator calibrate-budgets`, None for the default
+    max_reasoning_tokens: Optional[int] = None
 
 
 class Detector(BaseModel):
@@ -30,3 +32,4 @@ class Detector(BaseModel):
 class CurationPrompts(BaseModel):
     prompts: List[Prompt]
     detectors: List[Detector]
+    section_choice_max_reasoning_tokens: Optional[int] = None
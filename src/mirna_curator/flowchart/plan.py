@@ -0,0 +1,259 @@
+"""
+The flowchart and its prompts, joined once into a plan the graph runs from.
+
+Every node gets its prompt and detector resolved up front, along with the section
+it targets, the questions it asks (rendered into the node's layout, all but the RNA)
+and the sections any node reachable from it can target. The graph then finds
+everything for a node with one dictionary lookup, rather than scanning the prompt
+list on every visit, and a prompt or detector that doesn't exist is reported, with
+every other problem, before anything runs rather than as an IndexError part way
+through a paper.
+
+A node whose prompt is there but incomplete (no detector, no target section) is
+only warned about, so the rest of the flowchart can still run; a paper that reaches
+the node fails with the problem rather than part way through it.
+"""
+
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import FrozenSet, List, Mapping, Optional, Tuple
+
+from mirna_curator.flowchart.curation import CurationFlowchart, NodeType
+from mirna_curator.flowchart.flow_prompts import CurationPrompts, Detector, Prompt
+from mirna_curator.llm_functions.prompt_layout import (
+    QuestionText,
+    filter_question_text,
+    target_question_text,
+    tool_question_text,
+    yes_no_question_text,
+)
+
+logger = logging.getLogger(__name__)
+
+## These nodes read a section of the paper, so their prompt has to say which
+SECTION_NODE_TYPES = {
+    NodeType.filter,
+    NodeType.decision,
+    NodeType.decision_tool,
+    NodeType.terminal,
+    NodeType.terminal_conditional,
+}
+## Terminal prompts that record no annotation, so need no detector or section
+NO_ANNOTATION_PROMPT = "no_annotation"
+
+
+class FlowchartPlanError(ValueError):
+    """
+    The flowchart and prompts don't fit together; the message lists every problem
+    """
+
+    def __init__(self, problems: List[str]):
+        self.problems = problems
+        super().__init__(
+            "The flowchart and prompts don't match:\n"
+            + "\n".join(f"    - {problem}" for problem in problems)
+        )
+
+
+@dataclass(frozen=True)
+class NodePlan:
+    name: str
+    node_type: NodeType
+    prompt: Optional[Prompt]
+    detector: Optional[Detector]
+    ## As named in the prompt, which may differ from the paper's heading
+    target_section: Optional[str]
+    ## The node's questions in the order they're asked, the detector's last
+    questions: Tuple[str, ...]
+    ## Everything asked of the section, for ranking its paragraphs when fitting it
+    query: str
+    ## The text of each question the node asks, in order, waiting for the RNA. A
+    ## conditional terminal has one per condition, then the detector's.
+    rendered_questions: Tuple[QuestionText, ...]
+    ## Target sections of this node and every node reachable from it
+    downstream_sections: FrozenSet[str]
+    ## Why the node can't be run, empty if it can
+    problems: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class FlowchartPlan:
+    start_node: str
+    nodes: Mapping[str, NodePlan]
+    section_choice_max_reasoning_tokens: Optional[int]
+    ## The prompts the plan was compiled from
+    prompts: CurationPrompts
+
+    def __getitem__(self, node_name: str) -> NodePlan:
+        return self.nodes[node_name]
+
+
+def _node_questions(
+    node_type: NodeType, prompt: Optional[Prompt], detector: Optional[Detector]
+) -> Tuple[str, ...]:
+    if prompt is None:
+        return ()
+    ## A full terminal only asks its detector's question
+    if node_type == NodeType.terminal:
+        questions = []
+    elif isinstance(prompt.prompt, str):
+        questions = [prompt.prompt]
+    else:
+        questions = list(prompt.prompt)
+    if detector is not None:
+        questions.append(detector.prompt)
+    return tuple(q for q in questions if q)
+
+
+def _rendered_questions(
+    node_type: NodeType, prompt: Optional[Prompt], detector: Optional[Detector]
+) -> Tuple[QuestionText, ...]:
+    if prompt is None:
+        return ()
+    if node_type == NodeType.filter:
+        return (filter_question_text(prompt.prompt),)
+    if node_type == NodeType.decision:
+        return (yes_no_question_text(prompt.prompt),)
+    if node_type == NodeType.decision_tool:
+        return (tool_question_text(prompt.prompt),)
+    rendered = []
+    if node_type == NodeType.terminal_conditional and not isinstance(prompt.prompt, str):
+        rendered = [target_question_text(p) for p in prompt.prompt]
+    if detector is not None:
+        rendered.append(target_question_text(detector.prompt))
+    return tuple(rendered)
+
+
+def compile_plan(flowchart: CurationFlowchart, prompts: CurationPrompts) -> FlowchartPlan:
+    """
+    Join the flowchart and prompts into a plan, raising FlowchartPlanError listing
+    every missing or inconsistent reference if they don't fit together. Nodes that
+    can't be run are logged as warnings, and have their problems in the plan.
+    """
+    problems = []
+    node_problems = {}
+    prompt_lookup = {}
+    for prompt in prompts.prompts:
+        if prompt.name in prompt_lookup:
+            problems.append(f"prompt '{prompt.name}' is defined more than once")
+        prompt_lookup[prompt.name] = prompt
+    detector_lookup = {}
+    for detector in prompts.detectors:
+        if detector.name in detector_lookup:
+            problems.append(f"detector '{detector.name}' is defined more than once")
+        detector_lookup[detector.name] = detector
+
+    if flowchart.startNode not in flowchart.nodes:
+        problems.append(f"start node '{flowchart.startNode}' is not in the flowchart")
+
+    resolved = {}
+    for name, node in flowchart.nodes.items():
+        prompt_name = node.data.prompt_name or node.data.terminal_name
+        prompt = None
+        if prompt_name is not None:
+            prompt = prompt_lookup.get(prompt_name)
+            if prompt is None:
+                problems.append(
+                    f"node '{name}' uses prompt '{prompt_name}', which isn't defined"
+                )
+        elif node.type != NodeType.terminal_short_circuit:
+            problems.append(f"node '{name}' has no prompt")
+
+        detector = None
+        unrunnable = node_problems.setdefault(name, [])
+        needs_annotation = prompt is not None and prompt.name != NO_ANNOTATION_PROMPT
+        if needs_annotation and node.type in (
+            NodeType.terminal,
+            NodeType.terminal_conditional,
+        ):
+            if prompt.detector is None:
+                unrunnable.append(f"prompt '{prompt.name}' (node '{name}') has no detector")
+            else:
+                detector = detector_lookup.get(prompt.detector)
+                if detector is None:
+                    problems.append(
+                        f"node '{name}' uses detector '{prompt.detector}' (from prompt "
+                        f"'{prompt.name}'), which isn't defined"
+                    )
+        if (
+            needs_annotation
+            and node.type in SECTION_NODE_TYPES
+            and prompt.target_section is None
+        ):
+            unrunnable.append(
+                f"prompt '{prompt.name}' (node '{name}') has no target_section"
+            )
+        if (
+            prompt is not None
+            and node.type == NodeType.terminal_conditional
+            and isinstance(prompt.prompt, str)
+        ):
+            unrunnable.append(
+                f"prompt '{prompt.name}' (node '{name}') should be a list of questions"
+            )
+
+        ## The graph's nodes hold the transitions themselves, these are only for
+        ## checking and for finding the downstream sections
+        next_nodes = []
+        if node.transitions is not None:
+            for target in (
+                node.transitions.true,
+                node.transitions.false,
+                node.transitions.next,
+            ):
+                if target is None:
+                    continue
+                if target not in flowchart.nodes:
+                    problems.append(
+                        f"node '{name}' transitions to '{target}', which isn't in "
+                        "the flowchart"
+                    )
+                    continue
+                next_nodes.append(target)
+        resolved[name] = (node.type, prompt, detector, next_nodes)
+
+    if problems:
+        raise FlowchartPlanError(problems)
+    for name, unrunnable in node_problems.items():
+        for problem in unrunnable:
+            logger.warning(
+                f"Node '{name}' can't be run, papers reaching it will fail: {problem}"
+            )
+
+    def downstream_sections(start: str) -> FrozenSet[str]:
+        sections = set()
+        seen = set()
+        to_visit = [start]
+        while to_visit:
+            name = to_visit.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            _, prompt, _, next_nodes = resolved[name]
+            if prompt is not None and prompt.target_section is not None:
+                sections.add(prompt.target_section)
+            to_visit.extend(next_nodes)
+        return frozenset(sections)
+
+    nodes = {}
+    for name, (node_type, prompt, detector, _) in resolved.items():
+        questions = _node_questions(node_type, prompt, detector)
+        nodes[name] = NodePlan(
+            name=name,
+            node_type=node_type,
+            prompt=prompt,
+            detector=detector,
+            target_section=None if prompt is None else prompt.target_section,
+            questions=questions,
+            query=" ".join(questions),
+            rendered_questions=_rendered_questions(node_type, prompt, detector),
+            downstream_sections=downstream_sections(name),
+            problems=tuple(node_problems[name]),
+        )
+    return FlowchartPlan(
+        start_node=flowchart.startNode,
+        nodes=MappingProxyType(nodes),
+        section_choice_max_reasoning_tokens=prompts.section_choice_max_reasoning_tokens,
+        prompts=prompts,
+    )
@@ -0,0 +1,258 @@
+"""
+Matching the sections prompts target ("methods", "results", "conclusions") to the
+headings papers actually use.
+
+Asking the LLM which heading to use costs a reasoning generation (up to 512 tokens)
+every time a paper's headings don't contain the target, and the same handful of
+headings ("Materials and Methods", "Experimental Procedures", "Discussion", ...)
+come up again and again. So before asking, headings are matched:
+    - exactly, or with the target as a substring, as before
+    - lexically: headings are normalised (case, numbering like "2." or "II.",
+      punctuation, "&", plurals) and compared to known names for the target, and
+      fuzzily to catch typos and variants
+    - against headings the LLM has chosen for the target in earlier papers
+
+Only a paper with none of these goes to the LLM, and its choice is remembered,
+unless it can't be right: a heading the paper doesn't have, one that is never a
+target's section ("Introduction", "References", ...), or a known name of another
+target. A learned heading is only used once the LLM has chosen it for the target
+MIN_LEARNED_COUNT times, so one bad choice isn't applied to every later paper. The
+learned headings are kept in a small JSON file, so they carry over between runs:
+~/.cache/go_flow_llm/section_headings.json by default, or $GOFLOW_SECTION_HEADINGS,
+or the section_heading_map option. Several processes can share the file (e.g. the
+workers of parallel_controller.py): each save takes a lock on it and adds this
+process's new counts to what's there.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECTION_HEADING_MAP = os.environ.get(
+    "GOFLOW_SECTION_HEADINGS",
+    str(Path.home() / ".cache" / "go_flow_llm" / "section_headings.json"),
+)
+
+## Names a paper might use for each target, best first
+HEADING_ALIASES = {
+    "methods": [
+        "methods",
+        "materials and methods",
+        "methods and materials",
+        "experimental procedures",
+        "experimental section",
+        "materials and experimental procedures",
+        "patients and methods",
+        "subjects and methods",
+        "methodology",
+        "experimental",
+        "materials",
+    ],
+    "results": [
+        "results",
+        "results and discussion",
+        "findings",
+        "experimental results",
+    ],
+    "conclusions": [
+        "conclusions",
+        "conclusion",
+        "concluding remarks",
+        "discussion and conclusions",
+        "conclusions and perspectives",
+        "discussion",
+        "summary",
+        "results and discussion",
+    ],
+}
+## A fuzzy match has to be at least this close to a known name
+FUZZY_THRESHOLD = 0.85
+## Headings that are never the section a target means, so aren't learned
+NEVER_LEARNED = [
+    "abstract",
+    "introduction",
+    "background",
+    "references",
+    "acknowledgements",
+    "funding",
+    "author contributions",
+    "conflict of interest",
+    "competing interests",
+    "supplementary material",
+    "abbreviations",
+]
+## Times the LLM has to choose a heading for a target before it's used without asking
+MIN_LEARNED_COUNT = 3
+
+NUMBERING = re.compile(r"^\s*((\d+(\.\d+)*)|([ivxlc]+)|[a-z])[.):]\s*|^\s*\d+(\.\d+)*\s+")
+
+
+def normalise_heading(heading: str) -> str:
+    """
+    Lower case, without numbering, punctuation or plurals
+    """
+    heading = NUMBERING.sub("", heading.lower()).replace("&", " and ")
+    words = re.findall(r"[a-z0-9]+", heading)
+    return " ".join(w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words)
+
+
+def heading_score(target: str, heading: str) -> float:
+    """
+    How well a heading matches the target, 0 if it doesn't. Exact matches to one of
+    the target's names score highest, earlier names beating later ones.
+    """
+    normalised = normalise_heading(heading)
+    if not normalised:
+        return 0.0
+    aliases = [normalise_heading(a) for a in HEADING_ALIASES.get(target, [target])]
+    best = 0.0
+    for rank, alias in enumerate(aliases):
+        penalty = rank / 100
+        if normalised == alias:
+            best = max(best, 1.0 - penalty)
+        ## e.g. "materials and methods for cell culture"
+        elif normalised.startswith(alias + " "):
+            best = max(best, 0.9 - penalty)
+        else:
+            ratio = SequenceMatcher(None, normalised, alias).ratio()
+            if ratio >= FUZZY_THRESHOLD:
+                best = max(best, ratio * 0.8 - penalty)
+    return best
+
+
+def lexical_match(target: str, headings: List[str]) -> Optional[str]:
+    """
+    The heading that best matches the target, None if none do
+    """
+    scores = [(heading_score(target, heading), heading) for heading in headings]
+    best_score = max((score for score, _ in scores), default=0.0)
+    if best_score <= 0.0:
+        return None
+    ## Ties go to the earlier heading
+    return next(heading for score, heading in scores if score == best_score)
+
+
+def match_section_heading(target: str, headings: List[str]) -> Optional[str]:
+    """
+    The heading for the target by name alone: exact, substring, then lexical. None
+    if there isn't one.
+    """
+    if target in headings:
+        return target
+    for heading in headings:
+        if target in heading:
+            return heading
+    return lexical_match(target, headings)
+
+
+class SectionHeadingMap:
+    """
+    Headings chosen by the LLM for each target, learned across papers, see the module
+    docstring. With no path, they're only kept for this process.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = None if path is None else Path(path)
+        self._lock = threading.Lock()
+        ## target -> normalised heading -> times the LLM chose it
+        self.learned: Dict[str, Dict[str, int]] = {}
+        ## The same, for choices not saved yet
+        self.unsaved: Dict[str, Dict[str, int]] = {}
+        if self.path is not None and self.path.exists():
+            self.learned = self._read()
+            logger.info(f"Loaded learned section headings from {self.path}")
+
+    def _read(self) -> Dict[str, Dict[str, int]]:
+        """
+        The learned headings in the file, empty if it can't be read
+        """
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't read learned section headings from {self.path}: {e}")
+            return {}
+
+    def _save(self) -> None:
+        """
+        Add the unsaved choices to the file, under a lock so other processes' saves
+        aren't lost, and pick up theirs
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            learned = self._read()
+            for target, counts in self.unsaved.items():
+                target_headings = learned.setdefault(target, {})
+                for normalised, count in counts.items():
+                    target_headings[normalised] = target_headings.get(normalised, 0) + count
+            temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            temp_path.write_text(json.dumps(learned, indent=2, sort_keys=True))
+            os.replace(temp_path, self.path)
+        self.learned = learned
+        self.unsaved = {}
+
+    def learned_match(self, target: str, headings: List[str]) -> Optional[str]:
+        """
+        The heading the LLM has most often chosen for the target, None if it hasn't
+        chosen any of these at least MIN_LEARNED_COUNT times
+        """
+        with self._lock:
+            counts = dict(self.learned.get(target, {}))
+        best_count, best_heading = MIN_LEARNED_COUNT - 1, None
+        for heading in headings:
+            count = counts.get(normalise_heading(heading), 0)
+            if count > best_count:
+                best_count, best_heading = count, heading
+        return best_heading
+
+    def match(self, target: str, headings: List[str]) -> Optional[str]:
+        """
+        Everything short of asking the LLM, None if it has to be asked
+        """
+        return match_section_heading(target, headings) or self.learned_match(
+            target, headings
+        )
+
+    def learn(self, target: str, heading: str, headings: Optional[List[str]] = None) -> None:
+        """
+        Remember the LLM chose this heading, from the paper's headings if given, for
+        the target, saving the map if it has a path. Choices that can't be right
+        aren't remembered, see the module docstring.
+        """
+        normalised = normalise_heading(heading)
+        if not normalised:
+            return
+        problem = None
+        if headings is not None and heading not in headings:
+            problem = "isn't one of the paper's headings"
+        elif normalised in {normalise_heading(h) for h in NEVER_LEARNED}:
+            problem = "is never a target's section"
+        elif heading_score(target, heading) <= 0.0 and any(
+            heading_score(other, heading) > 0.0 for other in HEADING_ALIASES if other != target
+        ):
+            problem = "is a name for another section"
+        if problem is not None:
+            logger.info(f"Not learning heading {heading} for {target}, it {problem}")
+            return
+        with self._lock:
+            target_headings = self.learned.setdefault(target, {})
+            target_headings[normalised] = target_headings.get(normalised, 0) + 1
+            if self.path is None:
+                return
+            target_headings = self.unsaved.setdefault(target, {})
+            target_headings[normalised] = target_headings.get(normalised, 0) + 1
+            try:
+                self._save()
+            except OSError as e:
+                ## The choice stays unsaved, to go in with the next one
+                logger.warning(f"Couldn't save learned section headings to {self.path}: {e}")
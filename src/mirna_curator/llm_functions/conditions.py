@@ -9,8 +9,21 @@ from guidance import gen, select, system, user, assistant, with_temperature, sub
 
 from mirna_curator.llm_functions.evidence import extract_evidence
 from mirna_curator.apis import epmc
-from mirna_curator.model.llm import STOP_TOKENS
 from mirna_curator.llm_functions.tools import safe_import
+from mirna_curator.llm_functions.reasoning import reasoning, reasoning_budget
+from mirna_curator.llm_functions.prompt_layout import (
+    SECTION_ALREADY_LOADED,
+    SECTION_PREAMBLE,
+    QuestionText,
+    candidate_target_question,
+    node_record,
+    record_section_load,
+    section_context,
+    section_text_block,
+    target_question_text,
+    tool_question_text,
+    yes_no_question_text,
+)
 import typing as ty
 
 import logging
@@ -19,6 +32,28 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@guidance
+def load_article_sections(
+    llm: guidance.models.Model,
+    section_texts: ty.List[str],
+) -> guidance.models.Model:
+    """
+    Load several article sections into the context in one go, ahead of running any
+    nodes. Nodes run afterwards can then be told the text is already included above.
+
+    Used when curating several RNAs from the same paper, so the shared text is only
+    put into the context (and KV cache) once, and each RNA branches from that state.
+    """
+    with user():
+        llm += SECTION_PREAMBLE
+        for section_text in section_texts:
+            record_section_load(llm, section_text, "preloaded section")
+            llm += section_text_block(section_text)
+    with assistant():
+        llm += "I have read the text, and am ready to answer questions about it.\n"
+    return llm
+
+
 @guidance
 def prompted_flowchart_step_bool(
     llm: guidance.models.Model,
@@ -29,24 +64,17 @@ def prompted_flowchart_step_bool(
     config: ty.Optional[ty.Dict[str, ty.Any]] = {},
     temperature_reasoning: ty.Optional[float] = 0.6,
     temperature_selection: ty.Optional[float] = 0.4,
+    question: ty.Optional[QuestionText] = None,
 ) -> guidance.models.Model:
     """
     Use the given prompt on the article text to answer a yes/no question,
-    returning a boolean
+    returning a boolean. The question is rendered from step_prompt, unless the
+    flowchart plan gives it.
     """
-
+    question = question or yes_no_question_text(step_prompt)
     with user():
-        llm += f"You will be asked a yes/no question. The answer could be in following text, or it could be in some text you have already seen.\n"
-        if load_article_text:
-            logger.info(
-                f"Appending {len(llm.engine.tokenizer.encode(article_text.encode('utf-8')))} tokens (internal node)"
-            )
-            llm += f"Text to consider: \n{article_text}\n\n"
-        else:
-            llm += "Text to consider is included above\n\n"
-        llm += f"Question: {step_prompt}\nRestrict your considerations to {rna_id} if there are multiple RNAs mentioned\n"
-
-        llm += "Explain your reasoning step-by-step. Be concise\n"
+        llm += section_context(llm, article_text, load_article_text, "internal node")
+        llm += question.render(rna_id)
 
     logger.info(f"LLM input tokens: {llm.engine.metrics.engine_input_tokens}")
     logger.info(f"LLM generated tokens: {llm.engine.metrics.engine_output_tokens}")
@@ -57,17 +85,13 @@ def prompted_flowchart_step_bool(
         llm += "Reasoning:\n"
         if config["deepseek_mode"]:
             llm += "<think>\n"
-        llm += (
-            with_temperature(
-                gen(
-                    "reasoning",
-                    max_tokens=1024,
-                    stop=STOP_TOKENS,
-                ),
-                temperature_reasoning,
-            )
-            + "\n"
+        llm += reasoning(
+            "reasoning",
+            max_tokens=reasoning_budget(config),
+            temperature=temperature_reasoning,
+            stop_early=True,
         )
+        llm += "\n"
         logger.info("Generated reasoning ok")
 
     with assistant():
@@ -84,6 +108,41 @@ def prompted_flowchart_step_bool(
     return llm
 
 
+@guidance
+def compact_node_record(
+    llm: guidance.models.Model,
+    article_text: str,
+    load_article_text: bool,
+    step_prompt: str,
+    rna_id: str,
+    answer: str,
+    evidence: ty.Union[str, ty.List[str]],
+    reasoning_text: str,
+    question: ty.Optional[QuestionText] = None,
+) -> guidance.models.Model:
+    """
+    An internal node's turns without its reasoning: the same user turn, so the
+    section text stays in the context, then only the answer and evidence. The
+    answer, evidence and reasoning captures are set as the full node would leave them.
+
+    question has to be the one the node asked (a tool node doesn't ask the yes/no
+    question), or the user turn won't match; it's the yes/no question if not given.
+    """
+    question = question or yes_no_question_text(step_prompt)
+    with user():
+        if load_article_text:
+            llm += SECTION_PREAMBLE + section_text_block(article_text)
+        else:
+            llm += SECTION_ALREADY_LOADED
+        llm += question.render(rna_id)
+    with assistant():
+        llm += node_record(answer, evidence)
+    llm = llm.set("answer", answer)
+    llm = llm.set("evidence", evidence)
+    llm = llm.set("reasoning", reasoning_text)
+    return llm
+
+
 @guidance
 def prompted_flowchart_step_tool(
     llm: guidance.models.Model,
@@ -95,6 +154,7 @@ def prompted_flowchart_step_tool(
     tools: ty.Optional[ty.List[str]] = [],
     temperature_reasoning: ty.Optional[float] = 0.6,
     temperature_selection: ty.Optional[float] = 0.4,
+    question: ty.Optional[QuestionText] = None,
 ) -> guidance.models.Model:
     """
     Use the given prompt on the article text to answer a yes/no question,
@@ -109,7 +169,9 @@ def prompted_flowchart_step_tool(
         tools: ty.Optional[ty.List[str]] = []: A list of tools for the LLM to use
         temperature_reasoning: ty.Optional[float] = 0.6: The reasoning temperature (0.6 is R1 reccomended)
         temperature_selection: ty.Optional[float] = 0.4: The yes/no selection temperature
+        question: ty.Optional[QuestionText] = None: The question as rendered by the flowchart plan, rendered from step_prompt if not given
     """
+    question = question or tool_question_text(step_prompt)
 
     ## build the tool description string.
     tool_dict = safe_import(tools)
@@ -135,15 +197,8 @@ def prompted_flowchart_step_tool(
     _tools = tools
     _tools.append("finish")
     with user():
-        if load_article_text:
-            logger.info(
-                f"Appending {len(llm.engine.tokenizer.encode(article_text.encode('utf-8')))} tokens (internal node)"
-            )
-            llm += f"You will be asked a yes/no question. The answer could be in following text, or it could be in some text you have already seen: \n{article_text}\n\n"
-        else:
-            llm += "\n\n"
-
-        llm += f"Question: {step_prompt}\n"
+        llm += section_context(llm, article_text, load_article_text, "internal node")
+        llm += question.render(rna_id)
 
     ## Make a tiny little ReAct agent loop
     i = 0
@@ -174,17 +229,13 @@ def prompted_flowchart_step_tool(
         llm += "Reasoning:\n"
         if config["deepseek_mode"]:
             llm += "<think>\n"
-        llm += (
-            with_temperature(
-                gen(
-                    "reasoning",
-                    max_tokens=1024,
-                    stop=STOP_TOKENS,
-                ),
-                temperature_reasoning,
-            )
-            + "\n"
+        llm += reasoning(
+            "reasoning",
+            max_tokens=reasoning_budget(config),
+            temperature=temperature_reasoning,
+            stop_early=True,
         )
+        llm += "\n"
 
     with assistant():
         llm += f"The final answer, based on my reasoning above is: " + with_temperature(
@@ -209,31 +260,18 @@ def prompted_flowchart_terminal(
     config: ty.Optional[ty.Dict[str, ty.Any]] = {},
     temperature_reasoning: ty.Optional[float] = 0.6,
     temperature_selection: ty.Optional[float] = 0.1,
-    detector=True
+    detector=True,
+    question: ty.Optional[QuestionText] = None,
 ):
     """
     Use the LLM to find the targets and AEs for the GO annotation
 
     """
+    question = question or target_question_text(detector_prompt)
     epmc_annotated_genes = epmc.get_gene_name_annotations(paper_id)
     with user():
-        llm += (
-            f"You will be asked a question which you must answer using text you have been given. "
-            "The answer could be in the text you have already seen, or in the new text below. "
-            "If no new text is given, refer to the text you have already seen.\n"
-        )
-        if load_article_text:
-            logger.info(
-                f"Appending {len(llm.engine.tokenizer.encode(article_text.encode('utf-8')))} tokens (terminal node)"
-            )
-            llm += f"New text: \n{article_text}\n\n"
-        else:
-            llm += "\n\n"
-        llm += (
-            f"Question: {detector_prompt}. Restrict your answer to the target(s) of {rna_id}.\n"
-            f"Select targets from the following list: {','.join(epmc_annotated_genes)}\n"
-            "Ignore targets which do not appear in this list."
-        )
+        llm += section_context(llm, article_text, load_article_text, "terminal node")
+        llm += candidate_target_question(question, rna_id, epmc_annotated_genes)
     logger.info(f"LLM input tokens: {llm.engine.metrics.engine_input_tokens}")
     logger.info(f"LLM generated tokens: {llm.engine.metrics.engine_output_tokens}")
     logger.info(
@@ -243,17 +281,13 @@ def prompted_flowchart_terminal(
         llm += "Reasoning:\n"
         if config["deepseek_mode"]:
             llm += "<think>\n"
-        llm += (
-            with_temperature(
-                gen(
-                    "detector_reasoning",
-                    max_tokens=1024,
-                    stop=STOP_TOKENS,
-                ),
-                temperature_reasoning,
-            )
-            + "\n"
+        llm += reasoning(
+            "detector_reasoning",
+            max_tokens=reasoning_budget(config),
+            temperature=temperature_reasoning,
+            stop_early=False,
         )
+        llm += "\n"
     with assistant():
         llm += "Protein name(s): "
         while True:
@@ -288,53 +322,34 @@ def prompted_flowchart_terminal_conditional(
     temperature_reasoning: ty.Optional[float] = 0.6,
     temperature_selection: ty.Optional[float] = 0.1,
     detector=False,
+    question: ty.Optional[QuestionText] = None,
 ):
     """
     Use the LLM to find the targets and AEs for the GO annotation
 
     """
+    question = question or target_question_text(prompt)
     epmc_annotated_genes = epmc.get_gene_name_annotations(paper_id)
     with user():
-        llm += (
-            f"You will be asked a series of questions which you must answer using text you have been given. "
-            "The answer could be in the text you have already seen, or in the new text below. "
-            "If no new text is given, refer to the text you have already seen.\n"
+        llm += section_context(
+            llm, article_text, load_article_text, "terminal conditional node"
+        )
+        llm += candidate_target_question(
+            question, rna_id, epmc_annotated_genes if detector else None
         )
-        if load_article_text:
-            logger.info(
-                f"Appending {len(llm.engine.tokenizer.encode(article_text.encode('utf-8')))} tokens (terminal conditional node)"
-            )
-            llm += f"New text: \n{article_text}\n\n"
-        else:
-            llm += "\n\n"
-
-        if detector:
-            llm += (
-            f"Question: {prompt}. Restrict your answer to the target(s) of {rna_id}.\n"
-            f"Select targets from the following list: {','.join(epmc_annotated_genes)}\n"
-            "Ignore targets which do not appear in this list."
-            )
-        else:
-            llm += (
-                f"Question: {prompt}. Restrict your answer to the target(s) of {rna_id}.\n"
-            )
     
     with assistant():
         if detector:
             llm += "Reasoning:\n"
             if config["deepseek_mode"]:
                 llm += "<think>\n"
-            llm += (
-                with_temperature(
-                    gen(
-                        "detector_reasoning",
-                        max_tokens=1024,
-                        stop=STOP_TOKENS,
-                    ),
-                    temperature_reasoning,
-                )
-                + "\n"
+            llm += reasoning(
+                "detector_reasoning",
+                max_tokens=reasoning_budget(config),
+                temperature=temperature_reasoning,
+                stop_early=False,
             )
+            llm += "\n"
             llm += "Protein name(s): "
             while True:
                 llm += select(epmc_annotated_genes, name='protein_name', list_append=True)
@@ -347,17 +362,13 @@ def prompted_flowchart_terminal_conditional(
             llm += "Reasoning:\n"
             if config["deepseek_mode"]:
                 llm += "<think>\n"
-            llm += (
-                with_temperature(
-                    gen(
-                        "reasoning",
-                        max_tokens=1024,
-                        stop=STOP_TOKENS,
-                    ),
-                    temperature_reasoning,
-                )
-                + "\n"
+            llm += reasoning(
+                "reasoning",
+                max_tokens=reasoning_budget(config),
+                temperature=temperature_reasoning,
+                stop_early=True,
             )
+            llm += "\n"
             llm += f"The final answer, based on my reasoning above is: " + with_temperature(
             select(["yes", "no"], name="answer"), temperature_selection)
             logger.info("Selected answer ok")
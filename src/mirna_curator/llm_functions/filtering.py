@@ -1,7 +1,12 @@
 import guidance
-from guidance import user, assistant, gen, select, with_temperature
+from guidance import user, assistant, select, with_temperature
 import typing as ty
-from mirna_curator.model.llm import STOP_TOKENS
+from mirna_curator.llm_functions.prompt_layout import (
+    QuestionText,
+    filter_question_text,
+    section_context,
+)
+from mirna_curator.llm_functions.reasoning import reasoning, reasoning_budget
 
 import logging
 
@@ -12,41 +17,38 @@ logger = logging.getLogger(__name__)
 def prompted_filter(
     llm: guidance.models.Model,
     article_text: str,
-    _load_article_text: bool,  ## Always load it, but keep this argument for signature compatibility
+    load_article_text: bool,
     filter_prompt: str,
     rna_id: str,
     config: ty.Optional[ty.Dict[str, ty.Any]] = {},
     temperature_reasoning: ty.Optional[float] = 0.6,
     temperature_selection: ty.Optional[float] = 0.1,
+    question: ty.Optional[QuestionText] = None,
 ) -> str:
     """
     This is not a guidance function, so the results of this do not get persisted in model state
 
+    The text is always loaded, unless it was preloaded into the context ahead of time.
+    The question is rendered from filter_prompt, unless the flowchart plan gives it.
     """
+    question = question or filter_question_text(filter_prompt)
     with user():
-        logger.info(
-            f"Appending {len(llm.engine.tokenizer.encode(article_text.encode('utf-8')))} tokens (filter node)"
-        )
-        llm += f"You will be asked a question about the following text: \n{article_text}\n\n"
-        llm += f"Question: {filter_prompt}. Restrict your answer to the target of {rna_id}. "
+        llm += section_context(llm, article_text, load_article_text, "filter node")
+        llm += question.render(rna_id)
     logger.info(f"LLM input tokens: {llm.engine.metrics.engine_input_tokens}")
     logger.info(f"LLM generated tokens: {llm.engine.metrics.engine_output_tokens}")
     logger.info(
         f"LLM total tokens: {llm.engine.metrics.engine_input_tokens + llm.engine.metrics.engine_output_tokens}"
     )
     with assistant():
-        llm += (
-            "Reasoning: "
-            + with_temperature(
-                gen(
-                    "reasoning",
-                    max_tokens=1024,
-                    stop=STOP_TOKENS,
-                ),
-                temperature_reasoning,
-            )
-            + "\n"
+        llm += "Reasoning: "
+        llm += reasoning(
+            "reasoning",
+            max_tokens=reasoning_budget(config),
+            temperature=temperature_reasoning,
+            stop_early=True,
         )
+        llm += "\n"
         llm += f"The final answer, based on my reasoning above is: " + with_temperature(
             select(["yes", "no"], name="answer"), temperature_selection
         )
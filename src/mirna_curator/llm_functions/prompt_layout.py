@@ -0,0 +1,165 @@
+"""
+How the user turn for each node is laid out.
+
+llama.cpp only reuses the KV cache up to the first token that differs from what it
+evaluated last. So every kind of node (filter, internal, tool, terminal) opens its
+turn with the same fixed text, then the article section, and only then anything
+specific to the node. A filter and an internal node reading the same section then
+share everything up to the question, and the section is only evaluated once.
+
+Section token counts are only needed for logging, budgets and metrics, so each
+section is tokenized once per model and the count remembered, rather than on every
+node that uses it.
+"""
+
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+## Enough for every section of the papers in flight
+TOKEN_COUNT_CACHE_SIZE = 256
+
+## Section text -> token count, for each tokenizer
+_token_counts = weakref.WeakKeyDictionary()
+_token_counts_lock = threading.Lock()
+
+SECTION_PREAMBLE = (
+    "You will be asked a question about some text. The answer could be in the "
+    "following text, or it could be in some text you have already seen.\n"
+)
+SECTION_ALREADY_LOADED = "The text to consider is included above.\n\n"
+
+
+def section_text_block(section_text: str) -> str:
+    return f"Text to consider: \n{section_text}\n\n"
+
+
+def section_token_count(llm, section_text: str) -> int:
+    """
+    How many tokens the section text is, tokenizing each text only once per model
+    """
+    tokenizer = llm.engine.tokenizer
+    with _token_counts_lock:
+        counts = _token_counts.setdefault(tokenizer, OrderedDict())
+        count = counts.get(section_text)
+        if count is not None:
+            counts.move_to_end(section_text)
+            return count
+    count = len(tokenizer.encode(section_text.encode("utf-8")))
+    with _token_counts_lock:
+        counts[section_text] = count
+        if len(counts) > TOKEN_COUNT_CACHE_SIZE:
+            counts.popitem(last=False)
+    return count
+
+
+def record_section_load(llm, section_text: str, node_kind: str) -> int:
+    """
+    Log a section being put into the context, and add its tokens to the engine's
+    section_tokens counter for the metrics
+    """
+    count = section_token_count(llm, section_text)
+    logger.info(f"Appending {count} tokens ({node_kind})")
+    engine = llm.engine
+    engine.section_tokens = getattr(engine, "section_tokens", 0) + count
+    return count
+
+
+def section_context(llm, article_text: str, load_article_text: bool, node_kind: str) -> str:
+    """
+    The start of every node's user turn: the shared preamble and the section text, or
+    a pointer back to it if it is already in the context
+    """
+    if not load_article_text:
+        return SECTION_ALREADY_LOADED
+    record_section_load(llm, article_text, node_kind)
+    return SECTION_PREAMBLE + section_text_block(article_text)
+
+
+@dataclass(frozen=True)
+class QuestionText:
+    """
+    A node's question with everything but the RNA filled in. The flowchart plan
+    renders these once, so a visit only has to put the RNA in the gaps.
+    """
+
+    parts: Tuple[str, ...]
+
+    def render(self, rna_id: str) -> str:
+        return rna_id.join(self.parts)
+
+
+def yes_no_question_text(step_prompt: str) -> QuestionText:
+    return QuestionText(
+        (
+            f"Question: {step_prompt}\n"
+            "This is a yes/no question. Restrict your considerations to ",
+            " if there are multiple RNAs mentioned\n"
+            "Explain your reasoning step-by-step. Be concise\n",
+        )
+    )
+
+
+def yes_no_question(step_prompt: str, rna_id: str) -> str:
+    return yes_no_question_text(step_prompt).render(rna_id)
+
+
+def tool_question_text(step_prompt: str) -> QuestionText:
+    ## Tool nodes leave the RNA out of the question
+    return QuestionText((f"Question: {step_prompt}\n",))
+
+
+def node_record(answer: str, evidence) -> str:
+    """
+    An internal node's answer and evidence, standing in for its reasoning when that
+    is pruned from the context
+    """
+    if isinstance(evidence, list):
+        evidence = " ".join(evidence)
+    return f"The final answer is: {answer}\nThe supporting evidence is: '{evidence}'\n"
+
+
+def filter_question_text(filter_prompt: str) -> QuestionText:
+    return QuestionText(
+        (f"Question: {filter_prompt}. Restrict your answer to the target of ", ". ")
+    )
+
+
+def filter_question(filter_prompt: str, rna_id: str) -> str:
+    return filter_question_text(filter_prompt).render(rna_id)
+
+
+def target_question_text(detector_prompt: str) -> QuestionText:
+    return QuestionText(
+        (
+            "Answer using the text you have been given.\n"
+            f"Question: {detector_prompt}. Restrict your answer to the target(s) of ",
+            ".\n",
+        )
+    )
+
+
+def target_question(detector_prompt: str, rna_id: str, candidate_targets=None) -> str:
+    return candidate_target_question(
+        target_question_text(detector_prompt), rna_id, candidate_targets
+    )
+
+
+def candidate_target_question(
+    question_text: QuestionText, rna_id: str, candidate_targets=None
+) -> str:
+    """
+    A rendered target question, with the paper's candidate targets if there are any
+    """
+    question = question_text.render(rna_id)
+    if candidate_targets is not None:
+        question += (
+            f"Select targets from the following list: {','.join(candidate_targets)}\n"
+            "Ignore targets which do not appear in this list."
+        )
+    return question
@@ -0,0 +1,76 @@
+"""
+Reasoning generation with a per-node token budget.
+
+Budgets come from the prompts file (max_reasoning_tokens on each prompt, and
+section_choice_max_reasoning_tokens for choosing a section heading), calibrated
+from earlier traces with `mirna_curator calibrate-budgets`. Prompts without one
+get the old fixed budgets.
+
+For yes/no questions, reasoning can also stop early, as soon as the model says
+what its answer is ("... so the answer is yes."), rather than carrying on to the
+budget. The commitment is kept, both in the context and in the reasoning capture,
+so the answer selection that follows sees the same text either way.
+"""
+
+import logging
+import re
+
+import guidance
+from guidance import gen, with_temperature
+
+from mirna_curator.model.llm import STOP_TOKENS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REASONING_TOKENS = 1024
+DEFAULT_SECTION_CHOICE_TOKENS = 512
+
+## llguidance regexes can't use \b, so a commitment has to end in punctuation or a newline
+COMMITMENT_PATTERNS = [
+    r"[Tt]he (final )?answer (is|would be|should be):? \**([Yy]es|[Nn]o)\**[.!\n]",
+    r"\*\*[Aa]nswer:?\*\*:? ([Yy]es|[Nn]o)[.!\n]",
+]
+_commitment = re.compile("|".join(COMMITMENT_PATTERNS))
+
+
+def reasoning_budget(config, default: int = DEFAULT_REASONING_TOKENS) -> int:
+    """
+    The reasoning budget for a node, from the config the graph passes to its function
+    """
+    return (config or {}).get("max_reasoning_tokens") or default
+
+
+@guidance
+def reasoning(
+    llm,
+    name: str,
+    max_tokens: int = DEFAULT_REASONING_TOKENS,
+    temperature: float = 0.6,
+    stop_early: bool = False,
+):
+    """
+    Generate free text reasoning into the named capture, up to max_tokens. With
+    stop_early, stop once the model commits to a yes/no answer.
+    """
+    if not stop_early:
+        llm += with_temperature(
+            gen(name, max_tokens=max_tokens, stop=STOP_TOKENS), temperature
+        )
+        return llm
+
+    stop_name = f"{name}_stop"
+    llm += with_temperature(
+        gen(
+            name,
+            max_tokens=max_tokens,
+            stop_regex=[re.escape(s) for s in STOP_TOKENS] + COMMITMENT_PATTERNS,
+            save_stop_text=stop_name,
+        ),
+        temperature,
+    )
+    stop_text = llm.get(stop_name) or ""
+    if _commitment.fullmatch(stop_text):
+        logger.info(f"Reasoning stopped early on '{stop_text.strip()}'")
+        llm += stop_text
+        llm = llm.set(name, llm[name] + stop_text)
+    return llm
@@ -0,0 +1,255 @@
+"""
+Fitting article sections into what's left of the context.
+
+A paper whose sections don't fit used to overflow the context part way through the
+flowchart, after the GPU time had been spent, and be skipped. Now the graph checks
+the remaining budget before a section goes into the context, and a section that
+doesn't fit is cut down until it does:
+    - paragraphs that look like references, funding or competing interest
+      statements are dropped
+    - the remaining paragraphs are ranked by how many of the question's words (and
+      mentions of the RNA) they contain, and the best are kept, in their original
+      order, with a marker where text was left out. Paragraphs too long to keep
+      whole are ranked sentence by sentence.
+    - figure captions are only kept if the kept text still refers to the figure
+
+Sections that fit are passed through untouched, so this costs one (cached) token
+count per section load when there's room. The context itself isn't tokenized again
+for every check: each count starts from the last counted state the context extends,
+and only the text added since is tokenized. A node that then overflows while
+generating still fails as before; the budget only reserves room for the node
+loading the section.
+"""
+
+import logging
+import math
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from mirna_curator.llm_functions.prompt_layout import (
+    SECTION_PREAMBLE,
+    section_text_block,
+    section_token_count,
+)
+
+logger = logging.getLogger(__name__)
+
+## Role tags, answer selection, evidence and the fixed instructions around each node
+NODE_OVERHEAD_TOKENS = 192
+## Below this there's no point loading a section at all, but we try anyway
+MIN_SECTION_TOKENS = 256
+OMITTED_MARKER = "[...]"
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+FIGURES_START = "--- FIGURES ---"
+FIGURE_START = "--- FIGURE ---"
+FIGURE_END = "--- END FIGURE ---"
+
+REFERENCE_PATTERNS = [
+    ## Journal, year;volume(issue):pages
+    re.compile(r"(19|20)\d{2}\s*;\s*\d+(\(\d+\))?\s*:\s*\d+"),
+    re.compile(r"doi:?\s*10\.\d{4,}/", re.IGNORECASE),
+    re.compile(r"PMID:?\s*\d+"),
+    ## "12. Smith J, Jones K" or "[12] Smith J, ..."
+    re.compile(r"^\s*\[?\d{1,3}[\].]\s+[A-Z][\w'-]+,? [A-Z]{1,3}[,.]"),
+]
+BOILERPLATE_PATTERNS = [
+    re.compile(r"^(This|The) (work|study|research) was (supported|funded)", re.IGNORECASE),
+    re.compile(r"(declare|have) no (competing|conflicts? of) interests?", re.IGNORECASE),
+    re.compile(r"^(Acknowledg(e)?ments?|Funding|Conflicts? of interest)\b", re.IGNORECASE),
+]
+
+## Recent context texts and their token counts, for each tokenizer. A few states are
+## enough, since checks follow the context as it grows (or branch from a recent state)
+CONTEXT_COUNT_CACHE_SIZE = 16
+_context_counts = weakref.WeakKeyDictionary()
+_context_counts_lock = threading.Lock()
+
+STOPWORDS = {
+    "the", "and", "for", "are", "was", "were", "with", "that", "this", "from",
+    "there", "which", "what", "does", "have", "has", "any", "its", "their", "into",
+    "text", "paper", "article", "question", "answer", "restrict", "target", "targets",
+    "yes", "not", "been", "being", "can", "could", "should", "would", "other", "than",
+}
+
+
+def context_token_count(llm) -> int:
+    """
+    How many tokens the model's context holds in this state. Only the text added
+    since the longest earlier counted state this one starts with is tokenized, so the
+    count can be a token out where the two join; NODE_OVERHEAD_TOKENS covers that.
+    """
+    tokenizer = llm.engine.tokenizer
+    text = str(llm)
+    base_text, base_count = "", 0
+    with _context_counts_lock:
+        counts = _context_counts.setdefault(tokenizer, OrderedDict())
+        for counted_text, count in counts.items():
+            if len(counted_text) > len(base_text) and text.startswith(counted_text):
+                base_text, base_count = counted_text, count
+        if base_text:
+            counts.move_to_end(base_text)
+    count = base_count
+    if len(text) > len(base_text):
+        count += len(tokenizer.encode(text[len(base_text) :].encode("utf-8")))
+    with _context_counts_lock:
+        counts[text] = count
+        if len(counts) > CONTEXT_COUNT_CACHE_SIZE:
+            counts.popitem(last=False)
+    return count
+
+
+def context_limit(llm) -> Optional[int]:
+    """
+    The context length of the model (or of its slot), None if it isn't known
+    """
+    return getattr(llm.engine, "context_length", None)
+
+
+def section_budget(llm, reserve_tokens: int) -> Optional[int]:
+    """
+    How many tokens of section text can go into the context now, leaving
+    reserve_tokens for the node to generate. None if the context length isn't known.
+    """
+    limit = context_limit(llm)
+    if limit is None:
+        return None
+    ## The preamble and text block wrapper go in with the section
+    wrapper_tokens = section_token_count(llm, SECTION_PREAMBLE + section_text_block(""))
+    return limit - context_token_count(llm) - wrapper_tokens - reserve_tokens
+
+
+def looks_like_reference(paragraph: str) -> bool:
+    return any(p.search(paragraph) for p in REFERENCE_PATTERNS + BOILERPLATE_PATTERNS)
+
+
+def split_section(section_text: str) -> Tuple[List[str], List[str]]:
+    """
+    Split a section, as given by Article.get_section, into paragraphs and figure
+    captions
+    """
+    body, _, figures_text = section_text.partition(FIGURES_START)
+    paragraphs = [p for p in body.split("\n") if p.strip()]
+    figures = [
+        f"{FIGURE_START}\n{figure.split(FIGURE_END)[0].strip()}\n{FIGURE_END}"
+        for figure in figures_text.split(FIGURE_START)[1:]
+    ]
+    return paragraphs, figures
+
+
+def figure_references(figure: str) -> List[str]:
+    for line in figure.split("\n"):
+        if line.startswith("Referenced as: "):
+            return [r.strip() for r in line[len("Referenced as: ") :].split(",") if r.strip()]
+    return []
+
+
+def query_terms(query: str) -> set:
+    return {
+        word
+        for word in re.findall(r"[a-z0-9][a-z0-9-]+", query.lower())
+        if len(word) > 2 and word not in STOPWORDS
+    }
+
+
+def rna_pattern(rna_id: str) -> re.Pattern:
+    """
+    Matches the ways a paper might write the RNA: hsa-mir-21 as miR-21, mir21, ...
+    """
+    name = re.sub(r"^[a-z]{3,4}-", "", rna_id.lower())
+    parts = [re.escape(part) for part in re.split(r"[-\s]+", name) if part]
+    return re.compile(r"[-\s]?".join(parts), re.IGNORECASE)
+
+
+def relevance(paragraph: str, terms: set, rna: Optional[re.Pattern]) -> float:
+    """
+    Query words in the paragraph, with mentions of the RNA counting extra
+    """
+    words = set(re.findall(r"[a-z0-9][a-z0-9-]+", paragraph.lower()))
+    score = len(terms & words)
+    if rna is not None and rna.search(paragraph):
+        score += 3
+    ## Don't favour long paragraphs just for having more words
+    return score / math.sqrt(max(len(words), 1))
+
+
+def fit_section_text(
+    llm, section_text: str, budget: int, query: str, rna_id: Optional[str] = None
+) -> str:
+    """
+    Cut a section down to fit in budget tokens, see the module docstring. The
+    section is returned as it was if it already fits.
+    """
+    total = section_token_count(llm, section_text)
+    if total <= budget:
+        return section_text
+    budget = max(budget, MIN_SECTION_TOKENS)
+    tokenizer = llm.engine.tokenizer
+
+    def count(text: str) -> int:
+        return len(tokenizer.encode(text.encode("utf-8")))
+
+    paragraphs, figures = split_section(section_text)
+    ## Article.get_section starts with the section title, which is always kept
+    title = paragraphs[:1] if paragraphs and len(paragraphs[0].split()) <= 12 else []
+    paragraphs = paragraphs[len(title) :]
+    kept = [p for p in paragraphs if not looks_like_reference(p)]
+    dropped_references = len(paragraphs) - len(kept)
+
+    ## Paragraphs too long to keep whole are ranked sentence by sentence instead
+    terms = query_terms(query)
+    rna = rna_pattern(rna_id) if rna_id else None
+    units = []
+    for p_index, paragraph in enumerate(kept):
+        if count(paragraph) > budget // 4:
+            units += [(s, p_index) for s in SENTENCE_BOUNDARY.split(paragraph) if s.strip()]
+        else:
+            units.append((paragraph, p_index))
+
+    ## Every kept piece may need a marker after it, so count one with each
+    marker_tokens = count(OMITTED_MARKER) + 1
+    remaining = budget - sum(count(t) for t in title) - marker_tokens
+    chosen = set()
+    for index in sorted(
+        range(len(units)), key=lambda i: relevance(units[i][0], terms, rna), reverse=True
+    ):
+        tokens = count(units[index][0]) + 1 + marker_tokens
+        if tokens <= remaining:
+            chosen.add(index)
+            remaining -= tokens
+
+    ## Rebuild in the original order, with a marker wherever text was left out
+    lines = list(title)
+    last_paragraph = None
+    for index, (text, p_index) in enumerate(units):
+        if index not in chosen:
+            if lines[-1:] != [OMITTED_MARKER]:
+                lines.append(OMITTED_MARKER)
+            last_paragraph = None
+        elif p_index == last_paragraph:
+            lines[-1] += " " + text
+        else:
+            lines.append(text)
+            last_paragraph = p_index
+    fitted = "\n".join(lines) + "\n"
+
+    ## Then the figures the kept text refers to, as many as still fit
+    kept_figures = []
+    for figure in figures:
+        tokens = count(figure) + 2
+        if tokens <= remaining and any(ref in fitted for ref in figure_references(figure)):
+            kept_figures.append(figure)
+            remaining -= tokens
+    if kept_figures:
+        fitted += f"\n{FIGURES_START}\n\n" + "\n\n".join(kept_figures) + "\n"
+
+    logger.warning(
+        f"Section '{title[0] if title else ''}' is {total} tokens, over its budget of {budget}. "
+        f"Fitted it to {section_token_count(llm, fitted)} tokens, dropping {dropped_references} "
+        f"reference-like paragraphs, {len(units) - len(chosen)} other paragraphs or sentences "
+        f"and {len(figures) - len(kept_figures)} figures"
+    )
+    return fitted
@@ -1,6 +1,4 @@
-import wikipedia
 import logging
-import requests
 import sys
 import re
 from typing import List, Dict, Any, Optional, Set
@@ -54,6 +52,9 @@ def search_wikipedia(term: str):
     Args:
         term: A string representing the page title to search for
     """
+    ## Tools are only used by some flowcharts, so don't import their clients until needed
+    import wikipedia
+
     search_hits = wikipedia.search(term)
     if len(search_hits) == 0:
         logger.warning(
@@ -114,6 +115,8 @@ class CellosaurusAPI:
         endpoint = f"{self.BASE_URL}/release-info"
         params = {"format": format}
 
+        import requests
+
         response = requests.get(endpoint, params=params)
         response.raise_for_status()
 
@@ -143,6 +146,8 @@ class CellosaurusAPI:
         if fields:
             params["fields"] = ",".join(fields)
 
+        import requests
+
         response = requests.get(endpoint, params=params)
         response.raise_for_status()
 
@@ -187,6 +192,8 @@ class CellosaurusAPI:
         if sort:
             params["sort"] = sort
 
+        import requests
+
         response = requests.get(endpoint, params=params)
         response.raise_for_status()
 
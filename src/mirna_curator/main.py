@@ -1,18 +1,21 @@
 # from mirna_curator.apis import litscan
-from mirna_curator.model.llm import get_model
-from mirna_curator.llm_functions.abstract_filtering import assess_abstract
+## Only lightweight imports up here. The model stack (guidance, llama.cpp, polars etc.)
+## is imported inside main once we know we're actually going to curate something, so
+## validation and --help stay fast
 from mirna_curator.flowchart import curation, flow_prompts
-from mirna_curator.flowchart.computation_graph import ComputationGraph
+from mirna_curator.flowchart.plan import FlowchartPlanError, compile_plan
 from pydantic import ValidationError
 import click
-from epmc_xml import fetch
 import logging
-from functools import wraps
+from functools import partial, wraps
 from typing import Optional, Callable
 import json
-import polars as pl
 from mirna_curator.utils.tracing import curation_tracer
-from guidance import system, user
+from mirna_curator.utils.estimate import (
+    DEFAULT_DECODE_TOKENS_PER_SECOND,
+    DEFAULT_PREFILL_TOKENS_PER_SECOND,
+)
+from mirna_curator.apis.article_cache import DEFAULT_MAX_SIZE_GB
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,12 +29,24 @@ from pathlib import Path
 import os
 
 curation_output = []
+checkpoint = None
+metrics_output = []
+metrics_checkpoint = None
 
 
 def save_handler(signum, frame):
     if curation_output:
-        curation_output_df = pl.DataFrame(curation_output)
-        curation_output_df.write_parquet("curation_results_partial.parquet")
+        if checkpoint is not None:
+            checkpoint.flush(curation_output)
+            curation_output.clear()
+        else:
+            import polars as pl
+
+            curation_output_df = pl.DataFrame(curation_output)
+            curation_output_df.write_parquet("curation_results_partial.parquet")
+    if metrics_output and metrics_checkpoint is not None:
+        metrics_checkpoint.flush(metrics_output)
+        metrics_output.clear()
     if signum == signal.SIGTERM:
         sys.exit(0)
 
@@ -142,15 +157,157 @@ def mutually_exclusive_with_config(config_option: str = "config") -> Callable:
     is_flag=True,
     default=False,
 )
+@click.option(
+    "--prune_reasoning",
+    help="Drop each node's reasoning from the context once it has answered, keeping its question, answer and evidence",
+    is_flag=True,
+    default=False,
+)
 @click.option(
     "--checkpoint_frequency", help="How often to write a results checkpoint", default=-1
 )
 @click.option(
     "--checkpoint_file_path", help="Name of the file to checkpoint into", default="curation_results_checkpoint.parquet"
 )
+@click.option(
+    "--metrics_file_path",
+    help="Where to write per-paper performance metrics. Defaults to <output_data>_metrics.parquet",
+    default=None,
+)
 @click.option(
     "--gpu", help="Which gpu ID to run on, if there are several available", default='0'
 )
+@click.option(
+    "--prefetch_depth",
+    help="How many upcoming papers to fetch and parse in the background. 0 disables prefetching",
+    default=4,
+    type=int,
+)
+@click.option(
+    "--article_cache_dir",
+    help="Directory for the on-disk article cache. Defaults to $GOFLOW_ARTICLE_CACHE or ~/.cache/go_flow_llm/articles",
+    default=None,
+)
+@click.option(
+    "--article_cache_size_gb",
+    help="Size limit for the article cache, least recently used articles are evicted beyond this",
+    default=DEFAULT_MAX_SIZE_GB,
+    type=float,
+)
+@click.option(
+    "--section_heading_map",
+    help="JSON file of section headings learned across runs. Defaults to $GOFLOW_SECTION_HEADINGS or ~/.cache/go_flow_llm/section_headings.json",
+    default=None,
+)
+@click.option(
+    "--stream_input",
+    help="Stream the input data in batches rather than loading it all up front",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--input_batch_size",
+    help="Number of input rows to read at a time when streaming",
+    default=10_000,
+    type=int,
+)
+@click.option(
+    "--group_by_pmcid",
+    help="Curate all the RNAs for a paper together, loading the paper into context once",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--estimate",
+    help=(
+        "Don't curate, just tokenize the input papers and predict context usage and "
+        "GPU time. The per-paper estimates are written to the output file"
+    ),
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--estimate_prefill_tps",
+    help="Prompt processing speed (tokens/s) to assume when estimating",
+    type=float,
+    default=DEFAULT_PREFILL_TOKENS_PER_SECOND,
+)
+@click.option(
+    "--estimate_decode_tps",
+    help="Generation speed (tokens/s) to assume when estimating",
+    type=float,
+    default=DEFAULT_DECODE_TOKENS_PER_SECOND,
+)
+@click.option(
+    "--offline",
+    help="Resolve the model from the local manifest and cache only, never contacting huggingface",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--stage_model_dir",
+    help="Copy the model files to this directory (e.g. node-local scratch) and load them from there",
+    default=None,
+)
+@click.option(
+    "--prompt_state_dir",
+    help="Where to keep the saved system prompt state, defaults to ~/.cache/go_flow_llm/prompt_state",
+    default=None,
+)
+@click.option(
+    "--no_prompt_state_cache",
+    help="Always evaluate the system prompt, rather than restoring a saved state",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--draft_model_path",
+    help="A small model sharing the main model's tokenizer, to speed up generation with speculative decoding",
+    default=None,
+)
+@click.option(
+    "--draft_quantization",
+    help="Quantization of the draft model, if it's a huggingface repo with several",
+    default=None,
+)
+@click.option(
+    "--n_draft",
+    help="How many tokens are proposed at a time when speculating",
+    type=int,
+    default=8,
+)
+@click.option(
+    "--prompt_lookup",
+    help="Speculate by looking up text already in the context, which speeds up copying evidence",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--parallel_slots",
+    help="Curate this many papers at once, as parallel sequences batched together in one copy of the model",
+    type=int,
+    default=1,
+)
+@click.option(
+    "--backend",
+    help=(
+        "Run the model in this process (llama_cpp), on a shared model server started "
+        "with serve-model (server), or use a stub with made up replies, for running "
+        "without a GPU (stub)"
+    ),
+    type=click.Choice(["llama_cpp", "server", "stub"]),
+    default="llama_cpp",
+)
+@click.option(
+    "--server_url",
+    help="Address of the model server for --backend server, http://host:port or unix:///path/to.sock",
+    default=None,
+)
+@click.option(
+    "--stub_script",
+    help="JSON file with the replies, latency and seed for --backend stub",
+    default=None,
+)
 @mutually_exclusive_with_config()
 def main(
     config: Optional[str] = None,
@@ -167,16 +324,42 @@ def main(
     validate_only: Optional[bool] = None,
     evidence_type: Optional[str] = "single-sentence",
     deepseek_mode: Optional[bool] = False,
+    prune_reasoning: Optional[bool] = False,
     checkpoint_frequency: Optional[int] = -1,
     checkpoint_file_path: Optional[str] = None,
+    metrics_file_path: Optional[str] = None,
     gpu: Optional[str] = None,
+    prefetch_depth: Optional[int] = 4,
+    article_cache_dir: Optional[str] = None,
+    article_cache_size_gb: Optional[float] = DEFAULT_MAX_SIZE_GB,
+    section_heading_map: Optional[str] = None,
+    stream_input: Optional[bool] = False,
+    input_batch_size: Optional[int] = 10_000,
+    group_by_pmcid: Optional[bool] = False,
+    estimate: Optional[bool] = False,
+    estimate_prefill_tps: Optional[float] = DEFAULT_PREFILL_TOKENS_PER_SECOND,
+    estimate_decode_tps: Optional[float] = DEFAULT_DECODE_TOKENS_PER_SECOND,
+    offline: Optional[bool] = False,
+    stage_model_dir: Optional[str] = None,
+    prompt_state_dir: Optional[str] = None,
+    no_prompt_state_cache: Optional[bool] = False,
+    draft_model_path: Optional[str] = None,
+    draft_quantization: Optional[str] = None,
+    n_draft: Optional[int] = 8,
+    prompt_lookup: Optional[bool] = False,
+    parallel_slots: Optional[int] = 1,
+    backend: Optional[str] = "llama_cpp",
+    server_url: Optional[str] = None,
+    stub_script: Optional[str] = None,
 ):
+    global checkpoint, metrics_checkpoint
     curation_tracer.set_model_name(model_path)
 
     ## Build the run config options dict from things in the config
     run_config_options = {
         "evidence_mode": evidence_type,
         "deepseek_mode": deepseek_mode,
+        "prune_reasoning": prune_reasoning,
     }
     _flowchart_load_start = time.time()
     try:
@@ -185,7 +368,7 @@ def main(
     except ValidationError as e:
         logger.fatal(e)
         logger.fatal("Error loading flowchart, aborting")
-        exit()
+        sys.exit(1)
     _flowchart_load_end = time.time()
     logger.info(f"Loaded flowchart from {flowchart}")
     logger.info(
@@ -199,18 +382,26 @@ def main(
     except ValidationError as e:
         logger.fatal(e)
         logger.fatal("Error loading prompts, aborting")
-        exit()
+        sys.exit(1)
     _prompt_load_end = time.time()
     logger.info(f"Loaded prompts from {prompts}")
     logger.info(f"Prompts loaded in {_prompt_load_end - _prompt_load_start:.2f}")
 
+    ## Check every node's prompt, detector and transitions exist before doing any work
+    try:
+        compile_plan(cf, prompt_data)
+    except FlowchartPlanError as e:
+        logger.fatal(e)
+        logger.fatal("Flowchart and prompts don't match, aborting")
+        sys.exit(1)
+
     if validate_only:
         logger.info("Validation only, exiting now")
         return 0
     
     ## Validate arguments - exit if something required is set to None
     if any([
-        model_path is None,
+        model_path is None and backend == "llama_cpp",
         flowchart is None,
         prompts is None,
         input_data is None,
@@ -220,153 +411,287 @@ def main(
         logger.error("A required argument is se to None, check your config!")
         return 1
 
+    import polars as pl
+    from mirna_curator.apis.article_cache import ArticleCache
+    from mirna_curator.flowchart.computation_graph import ComputationGraph
+    from mirna_curator.flowchart.section_headings import (
+        DEFAULT_SECTION_HEADING_MAP,
+        SectionHeadingMap,
+    )
+    from mirna_curator.model.llm import get_batched_models, get_model, get_tokenizer
+    from mirna_curator.utils.checkpoint import ShardedCheckpoint
+    from mirna_curator.utils.estimate import estimate_run
+    from mirna_curator.utils.input_data import (
+        build_curation_query,
+        group_by_paper,
+        iter_curation_rows,
+    )
+    from mirna_curator.utils.prefetch import ArticlePrefetcher, fetch_and_parse
+    from mirna_curator.model.prompt_state import PromptStateCache
+    from mirna_curator.runner import (
+        apply_system_prompt,
+        curate_article,
+        curate_concurrently,
+    )
+
+    ## Get the curation input data and resume if there's a valid checkpoint
+    checkpoint = ShardedCheckpoint(checkpoint_file_path)
+    ## Metrics are checkpointed alongside the results, so they survive a restart too
+    metrics_checkpoint = ShardedCheckpoint(
+        f"{Path(checkpoint_file_path).with_suffix('')}_metrics.parquet"
+    )
+    done = checkpoint.scan_done()
+    if done is not None:
+        logger.info("Resuming from checkpoint %s", checkpoint_file_path)
+
+    if annot_class is not None:
+        logger.info(f"Restricting processing to annotation class {annot_class}")
+
+    try:
+        curation_query = build_curation_query(
+            input_data, done=done, annot_class=annot_class, max_papers=max_papers
+        )
+    except ValueError:
+        logger.error("Unsupported input data format for %s", input_data)
+        return 1
+
+    article_cache = ArticleCache(article_cache_dir, max_size_gb=article_cache_size_gb)
+    ## Shared by every slot, so a heading the LLM matched in one paper isn't asked about again
+    heading_map = SectionHeadingMap(section_heading_map or DEFAULT_SECTION_HEADING_MAP)
+    if estimate:
+        ## Only the vocabulary is loaded, so this is cheap and doesn't need a GPU
+        tokenizer = get_tokenizer(
+            model_path, quantization=quantization, offline=offline or None
+        )
+        estimate_df = estimate_run(
+            iter_curation_rows(curation_query, batch_size=input_batch_size),
+            partial(fetch_and_parse, cache=article_cache),
+            cf,
+            prompt_data,
+            lambda text: len(
+                tokenizer.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+            ),
+            int(context_length),
+            prefill_tps=estimate_prefill_tps,
+            decode_tps=estimate_decode_tps,
+            prefetch_depth=prefetch_depth,
+            heading_map=heading_map,
+        )
+        estimate_df.write_parquet(output_data)
+        logger.info(f"Wrote per-paper estimates to {output_data}")
+        return 0
+
+    if group_by_pmcid:
+        logger.info("Grouping input rows by PMCID")
+        curation_query = group_by_paper(curation_query)
 
     if gpu is not None:
         ## Set which GPU to use
         logger.info("Selecting %s gpu for this process", gpu)
         os.environ['CUDA_VISIBLE_DEVICES'] = gpu
     _model_load_start = time.time()
-    llm = get_model(
-        model_path,
-        chat_template=chat_template,
-        quantization=quantization,
-        context_length=context_length,
-    )
+    if backend != "llama_cpp":
+        ## Each slot gets its own model; a server gives each its own sequence, and
+        ## does the batching itself
+        slot_llms = [
+            get_model(
+                model_path,
+                chat_template=chat_template,
+                backend=backend,
+                server_url=server_url,
+                stub_script=stub_script,
+                draft_model=draft_model_path,
+                prompt_lookup=prompt_lookup,
+            )
+            for _ in range(parallel_slots)
+        ]
+    elif parallel_slots > 1:
+        if draft_model_path is not None or prompt_lookup:
+            logger.warning(
+                "Speculative decoding isn't supported with parallel slots, ignoring it"
+            )
+        slot_llms = get_batched_models(
+            model_path,
+            parallel_slots,
+            chat_template=chat_template,
+            quantization=quantization,
+            context_length=context_length,
+            offline=offline or None,
+            staging_dir=stage_model_dir,
+        )
+    else:
+        slot_llms = [
+            get_model(
+                model_path,
+                chat_template=chat_template,
+                quantization=quantization,
+                context_length=context_length,
+                offline=offline or None,
+                staging_dir=stage_model_dir,
+                draft_model=draft_model_path,
+                draft_quantization=draft_quantization,
+                n_draft=int(n_draft),
+                prompt_lookup=prompt_lookup,
+            )
+        ]
     _model_load_end = time.time()
     logger.info(f"Loaded model from {model_path}")
     logger.info(f"Model loaded in {_model_load_end - _model_load_start:.2f} seconds")
 
     _system_prompt_start = time.time()
-    ## Look for a system prompt in the prompts, and apply it if found
-    for prompt in prompt_data.prompts:
-        if prompt.type == "system":
-            logger.info("Found system prompt, applying...")
-            try:
-                with system():
-                    llm += prompt.prompt
-            except Exception as e:
-                logger.warning(
-                    "Selected model does not have a system prompt mode, forward as user instead"
-                )
-                with user():
-                    llm += prompt.prompt
-
-            break
+    ## The saved state covers the whole context, so can't be restored into one slot,
+    ## and only an in-process model has a llama.cpp context to save
+    slot_llms = [
+        apply_system_prompt(
+            llm,
+            prompt_data,
+            state_cache=(
+                None
+                if no_prompt_state_cache or parallel_slots > 1 or backend != "llama_cpp"
+                else PromptStateCache(prompt_state_dir)
+            ),
+        )
+        for llm in slot_llms
+    ]
     _system_prompt_end = time.time()
     logger.info(
         f"System prompt (if present) applied in {_system_prompt_end - _system_prompt_start:.2f} seconds"
     )
 
     _graph_construction_start = time.time()
-    graph = ComputationGraph(cf, run_config=run_config_options)
+    ## Graphs keep the state of the run in progress, so each slot needs its own
+    slots = [
+        (ComputationGraph(cf, run_config=run_config_options, heading_map=heading_map), llm)
+        for llm in slot_llms
+    ]
     _graph_construction_end = time.time()
     logger.info("Constructed computation graph")
     logger.info(
         f"Graph constructed in {_graph_construction_end - _graph_construction_start:.2f} seconds"
     )
 
-    ## Get the curation input data and resume if there's a valid checkpoint
-    if input_data.endswith("parquet") or input_data.endswith("pq"):
-        curation_input = pl.read_parquet(input_data)
-    elif input_data.endswith("csv"):
-        curation_input = pl.read_csv(input_data)
-    else:
-        logger.error("Unsupported input data format for %s", input_data)
-        return 1
 
-
-    if Path(checkpoint_file_path).exists():
-        logger.info("Resuming from checkpoint %s", checkpoint_file_path)
-        done = pl.read_parquet(checkpoint_file_path)
-        curation_input = curation_input.join(done, on="PMCID", how="anti")
-        
-    if annot_class is not None:
-        logger.info(f"Restricting processing to annotation class {annot_class}")
-        curation_input = curation_input.filter(pl.col("class") == annot_class)
-
-    logger.info(f"Loaded input data from {input_data}")
-    logger.info(f"Processing up to {curation_input.height} papers")
+    if stream_input:
+        ## Don't materialise the input, just pull batches of rows as we need them
+        logger.info(
+            f"Streaming input data from {input_data} in batches of {input_batch_size} rows"
+        )
+        curation_rows = iter_curation_rows(curation_query, batch_size=input_batch_size)
+    else:
+        curation_input = curation_query.collect()
+        logger.info(f"Loaded input data from {input_data}")
+        logger.info(f"Processing up to {curation_input.height} papers")
+        curation_rows = curation_input.iter_rows(named=True)
 
     ## This is where we start riunning the curation graph for all the papers, one by one.
     _bulk_processing_start = time.time()
-    for i, row in enumerate(curation_input.iter_rows(named=True)):
-        if max_papers is not None and i >= max_papers:
-            break
+    papers_curated = 0
+    prefetcher = ArticlePrefetcher(
+        curation_rows,
+        depth=max(prefetch_depth, parallel_slots),
+        fetch_function=partial(fetch_and_parse, cache=article_cache),
+    )
+
+    def rows_for(row):
+        return row["rows"] if group_by_pmcid else [row]
+
+    if parallel_slots > 1:
+        logger.info(f"Curating up to {parallel_slots} papers at once")
+        curated_articles = curate_concurrently(
+            slots, prefetcher, rows_for, prompt_data
+        )
+    else:
+        ## Nothing is curated until the output rows are iterated, after the fetch check
+        graph, llm = slots[0]
+        curated_articles = (
+            (
+                prefetched,
+                curate_article(
+                    graph,
+                    llm,
+                    prefetched.article,
+                    rows_for(prefetched.row),
+                    prompt_data,
+                    fetch_time=prefetched.fetch_time,
+                ),
+            )
+            for prefetched in prefetcher
+        )
+    for i, (prefetched, output_rows) in enumerate(curated_articles):
+        row = prefetched.row
 
         ## See if we need to checkpoint, then write output
         if checkpoint_frequency > 0 and i > 0 and i % checkpoint_frequency == 0:
             logger.info("Checkpointing results")
             logger.info(
-                f"Curation of {len(curation_output)} articles completed in {time.time()-_bulk_processing_start:.2f} seconds"
+                f"Curation of {papers_curated} articles completed in {time.time()-_bulk_processing_start:.2f} seconds"
             )
-            if len(curation_output) > 0:
-                curation_output_df = pl.DataFrame(curation_output)
-                if Path(checkpoint_file_path).exists():
-                    prev = pl.read_parquet(checkpoint_file_path)
-                    pl.concat([curation_output_df, prev], how="diagonal_relaxed")
-                ## Overwrite the checkpoint to save space
-                curation_output_df.write_parquet(checkpoint_file_path)
-
-        try:
-            logger.info("Starting curation for paper %s", row["PMCID"])
-            _paper_fetch_start = time.time()
-            article = fetch.article(row["PMCID"])
-            article.add_figures_section()
-            _paper_fetch_end = time.time()
-        except Exception as e:
-            logger.error(e)
+            ## Each checkpoint is a new shard, so we can drop everything written so far
+            checkpoint.flush(curation_output)
+            curation_output.clear()
+            metrics_checkpoint.flush(metrics_output)
+            metrics_output.clear()
+
+        logger.info("Curating paper %s", row["PMCID"])
+        ## Fetching happens in the background, so errors are handed back with the row
+        if prefetched.error is not None:
+            logger.error(prefetched.error)
             logger.error(f"Failed to fetch/parse {row['PMCID']}, skipping it")
             continue
 
         logger.info(
-            f"Fetched and parsed paper in {_paper_fetch_end - _paper_fetch_start:.2f} seconds"
+            f"Fetched and parsed paper in {prefetched.fetch_time:.2f} seconds"
         )
 
-        _curation_start = time.time()
-        try:
-            llm_trace, curation_result = graph.execute_graph(
-                row["PMCID"],
-                llm,
-                article,
-                row["rna_id"],
-                prompt_data,
+        ## With several RNAs from one paper, the text is loaded once and each RNA branches from it
+        n_results = len(curation_output)
+        for output_row in output_rows:
+            curation_output.append(output_row)
+            metrics_output.append(
+                {
+                    "run_id": curation_tracer.run_id,
+                    "model": model_path,
+                    "model_load_seconds": _model_load_end - _model_load_start,
+                    "parallel_slots": parallel_slots,
+                    **{k: v for k, v in output_row.items() if k != "curation_result"},
+                }
             )
-        except Exception as e:
-            logger.error(e)
-            logger.error("Paper %s has exceeded context limit, skipping", row["PMCID"])
-            faulthandler.dump_traceback(file=sys.stderr, all_threads=True)
-            continue
-        logger.info(
-            f"RNA ID: {row['rna_id']} in {row['PMCID']} - Curation Result: {curation_result}"
-        )
-        # logger.info(
-        #     f"Manual Result - GO term: {row['go_term']}; Protein target: {row['protein_id']}"
-        # )
-        _curation_end = time.time()
-        logger.info(
-            f"Ran curation graph in {_curation_end - _curation_start:.2f} seconds"
-        )
-        curation_output.append(
-            {
-                "PMCID": row["PMCID"],
-                "rna_id": row["rna_id"],
-                "curation_result": curation_result,
-            }
-        )
+        if len(curation_output) > n_results:
+            papers_curated += 1
         # with open(f"{row['PMCID']}_{row['rna_id']}_llm_trace.txt", "w") as f:
         #     f.write(llm_trace)
     _bulk_processing_end = time.time()
     _bulk_processing_total = _bulk_processing_end - _bulk_processing_start
-    _bulk_processing_average = _bulk_processing_total / len(curation_output)
+    _bulk_processing_average = _bulk_processing_total / max(papers_curated, 1)
     logger.info(
-        f"Curation of {len(curation_output)} articles completed in {_bulk_processing_total:.2f} seconds"
+        f"Curation of {papers_curated} articles completed in {_bulk_processing_total:.2f} seconds"
     )
     logger.info(
         f"Average time to curate one paper: {_bulk_processing_average:.2f} seconds"
     )
-    curation_output_df = pl.DataFrame(curation_output)
+    logger.info(
+        f"Throughput with {parallel_slots} slot(s): {papers_curated / max(_bulk_processing_total / 3600, 1e-9):.1f} papers/hour"
+    )
+    if checkpoint_frequency > 0 or checkpoint.exists():
+        ## Results are spread over the checkpoint shards, including any from earlier runs
+        checkpoint.flush(curation_output)
+        curation_output.clear()
+        curation_output_df = checkpoint.read_all()
+    else:
+        curation_output_df = pl.DataFrame(curation_output)
     curation_output_df.write_parquet(output_data)
 
+    if metrics_file_path is None:
+        metrics_file_path = f"{Path(output_data).with_suffix('')}_metrics.parquet"
+    if checkpoint_frequency > 0 or metrics_checkpoint.exists():
+        metrics_checkpoint.flush(metrics_output)
+        metrics_output.clear()
+        metrics_df = metrics_checkpoint.read_all()
+    else:
+        metrics_df = pl.DataFrame(metrics_output)
+    metrics_df.write_parquet(metrics_file_path)
+    logger.info(f"Wrote performance metrics to {metrics_file_path}")
+
 
 if __name__ == "__main__":
     main()
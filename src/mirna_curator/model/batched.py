@@ -0,0 +1,233 @@
+"""
+Run several curations at once on one GPU, as independent sequences in one model.
+
+Decoding one sequence at a time leaves most of a large GPU idle, since each step is
+limited by reading the weights rather than by compute. Here one llama.cpp context
+holds a KV cache for several slots (sequences), and a single scheduler thread
+batches whatever the slots are waiting for into each llama_decode call: one token
+for each slot that's generating, with the rest of the batch filled by chunks of any
+new prompt text. Slots join and leave the batch as they need to (continuous
+batching), so a long prefill in one slot doesn't hold up generation in the others.
+
+Each slot is a normal guidance LlamaCpp model whose get_logits goes through the
+scheduler, so the computation graph drives it exactly as it drives a single model;
+run one graph per slot, each in its own thread.
+"""
+
+import logging
+import operator
+import threading
+from itertools import takewhile
+from typing import Dict, List, Optional, Tuple
+
+import llama_cpp
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_TOKENS = 2048
+## How often a waiting request checks the decode thread is still running, in seconds
+DECODE_THREAD_CHECK_INTERVAL = 5.0
+
+
+class _LogitsRequest:
+    def __init__(self, token_ids: List[int]):
+        self.token_ids = token_ids
+        self.position: Optional[int] = None
+        self.evaluated = 0
+        self.logits: Optional[np.ndarray] = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class BatchedContext:
+    """
+    A llama.cpp context with one sequence per slot, and the thread that decodes
+    for all of them
+    """
+
+    def __init__(
+        self,
+        model_obj: llama_cpp.Llama,
+        n_slots: int,
+        slot_context_length: int,
+        n_batch: int = DEFAULT_BATCH_TOKENS,
+    ):
+        self.n_slots = n_slots
+        self.slot_context_length = slot_context_length
+        self.n_batch = n_batch
+        self._n_vocab = model_obj.n_vocab()
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_slots * slot_context_length
+        params.n_batch = n_batch
+        params.n_ubatch = min(n_batch, 512)
+        params.n_seq_max = n_slots
+        params.n_threads = model_obj.n_threads
+        params.n_threads_batch = model_obj.n_threads_batch
+        params.flash_attn = True
+        self.ctx = llama_cpp.llama_new_context_with_model(model_obj.model, params)
+        if self.ctx is None:
+            raise RuntimeError(
+                f"Couldn't create a context for {n_slots} slots of {slot_context_length} tokens"
+            )
+        self._batch = llama_cpp.llama_batch_init(n_batch, 0, 1)
+
+        ## The tokens currently in each slot's KV cache
+        self._cached_tokens: List[List[int]] = [[] for _ in range(n_slots)]
+        self._pending: Dict[int, _LogitsRequest] = {}
+        self._condition = threading.Condition()
+        self.stats = {"decode_calls": 0, "batched_tokens": 0, "batched_sequences": 0}
+
+        self._thread = threading.Thread(
+            target=self._run, name="batched_decode", daemon=True
+        )
+        self._thread.start()
+
+    def get_logits(self, slot: int, token_ids: List[int]) -> Tuple[np.ndarray, int]:
+        """
+        Get the logits after token_ids in a slot, waiting for a decode step to
+        include them. Also returns how many tokens had to be evaluated.
+        """
+        if len(token_ids) == 0:
+            raise ValueError("token_ids must contain some tokens.")
+        if self.slot_context_length <= len(token_ids):
+            raise Exception(
+                f"Attempted to use a context length of {len(token_ids)} tokens, but each slot is only configured to support up to {self.slot_context_length}!"
+            )
+        ## llama.cpp doesn't check token ids, a bad one can take the whole process down
+        bad_tokens = [t for t in token_ids if not 0 <= t < self._n_vocab]
+        if len(bad_tokens) > 0:
+            raise ValueError(f"Token ids {bad_tokens[:5]} aren't in the vocabulary")
+        request = _LogitsRequest(list(token_ids))
+        with self._condition:
+            self._pending[slot] = request
+            self._condition.notify()
+        while not request.done.wait(DECODE_THREAD_CHECK_INTERVAL):
+            if not self._thread.is_alive():
+                raise RuntimeError("The batched decode thread has stopped")
+        if request.error is not None:
+            raise request.error
+        return request.logits, request.evaluated
+
+    def _start(self, slot: int, request: _LogitsRequest) -> None:
+        """
+        Drop whatever the slot's KV cache has past the prefix shared with the request
+        """
+        cached = self._cached_tokens[slot]
+        num_cached = sum(
+            takewhile(operator.truth, map(operator.eq, request.token_ids, cached))
+        )
+        ## llama.cpp needs at least one token to produce logits, so re-input the last
+        if num_cached == len(request.token_ids):
+            num_cached -= 1
+        llama_cpp.llama_kv_cache_seq_rm(self.ctx, slot, num_cached, -1)
+        self._cached_tokens[slot] = cached[:num_cached]
+        request.position = num_cached
+
+    def _finish(self, slot: int, request: _LogitsRequest) -> None:
+        with self._condition:
+            if self._pending.get(slot) is request:
+                del self._pending[slot]
+        request.done.set()
+
+    def _fail(self, requests: Dict[int, _LogitsRequest], error: Exception) -> None:
+        """
+        Fail every request still waiting after a decode step went wrong, and empty
+        their slots, whose KV cache may no longer match what's recorded
+        """
+        for slot, request in requests.items():
+            if request.done.is_set():
+                continue
+            request.error = error
+            self._cached_tokens[slot] = []
+            try:
+                llama_cpp.llama_kv_cache_seq_rm(self.ctx, slot, 0, -1)
+            except Exception:
+                logger.exception(f"Couldn't clear the KV cache of slot {slot}")
+            self._finish(slot, request)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+                requests = dict(self._pending)
+            ## Anything going wrong fails this step's requests, not the thread, which
+            ## every slot is waiting on
+            try:
+                self._step(requests)
+            except Exception as e:
+                logger.exception("Batched decode step failed")
+                self._fail(requests, e)
+
+    def _step(self, requests: Dict[int, _LogitsRequest]) -> None:
+        """
+        Start any new requests, and decode one batch for all of them
+        """
+        batch = self._batch
+        for slot, request in requests.items():
+            if request.position is None:
+                self._start(slot, request)
+
+        ## Generating slots first, so they're never starved by a long prefill
+        scheduled = []
+        n_tokens = 0
+        for slot, request in sorted(
+            requests.items(),
+            key=lambda item: len(item[1].token_ids) - item[1].position,
+        ):
+            take = min(len(request.token_ids) - request.position, self.n_batch - n_tokens)
+            if take <= 0:
+                break
+            for k in range(take):
+                position = request.position + k
+                batch.token[n_tokens] = request.token_ids[position]
+                batch.pos[n_tokens] = position
+                batch.seq_id[n_tokens][0] = slot
+                batch.n_seq_id[n_tokens] = 1
+                batch.logits[n_tokens] = position == len(request.token_ids) - 1
+                n_tokens += 1
+            scheduled.append((slot, request, take, n_tokens - 1))
+        batch.n_tokens = n_tokens
+
+        ret = llama_cpp.llama_decode(self.ctx, batch)
+        self.stats["decode_calls"] += 1
+        self.stats["batched_tokens"] += n_tokens
+        self.stats["batched_sequences"] += len(scheduled)
+        for slot, request, take, last_index in scheduled:
+            if ret != 0:
+                request.error = Exception(f"Call to llama_cpp.llama_decode returned {ret}.")
+                llama_cpp.llama_kv_cache_seq_rm(self.ctx, slot, request.position, -1)
+            else:
+                self._cached_tokens[slot].extend(
+                    request.token_ids[request.position : request.position + take]
+                )
+                request.position += take
+                request.evaluated += take
+                if request.position < len(request.token_ids):
+                    continue
+                request.logits = np.ctypeslib.as_array(
+                    llama_cpp.llama_get_logits_ith(self.ctx, last_index),
+                    shape=(self._n_vocab,),
+                ).copy()
+            self._finish(slot, request)
+
+
+def attach_slot(llm, context: BatchedContext, slot: int) -> None:
+    """
+    Send the logits requests of a guidance LlamaCpp model to one slot of the batched
+    context, keeping the engine's token counters and cache record up to date
+    """
+    engine = llm.engine
+
+    def get_logits(token_ids):
+        logits, evaluated = context.get_logits(slot, token_ids)
+        engine._cache_token_ids = list(token_ids)
+        engine._cached_logits = logits
+        engine.metrics.engine_input_tokens += evaluated
+        engine.metrics.engine_output_tokens += 1
+        return logits
+
+    engine.get_logits = get_logits
+    engine.context_length = context.slot_context_length
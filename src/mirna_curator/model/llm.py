@@ -1,4 +1,5 @@
 from guidance.models import LlamaCpp
+from llama_cpp import Llama
 
 from guidance.chat import (
     ChatMLTemplate,
@@ -22,116 +23,301 @@ TEMPLATE_LOOKUP = {
     "qwen": Qwen2dot5ChatTemplate,
 }
 
-from huggingface_hub import HfFileSystem, hf_hub_download
+from huggingface_hub import HfApi, HfFileSystem, hf_hub_download, snapshot_download
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import os
 import re
+import shutil
+import time
 import logging
 
+from mirna_curator.utils.metrics import track_prefix_reuse
+from mirna_curator.model.batched import BatchedContext, attach_slot
+from mirna_curator.model.remote import DEFAULT_SERVER_URL, RemoteModel
+from mirna_curator.model.stub import StubModel, load_stub_script
+from mirna_curator.model.speculative import (
+    DEFAULT_N_DRAFT,
+    enable_speculative_decoding,
+)
+from mirna_curator.model.manifest import (
+    ModelManifest,
+    file_sha256,
+    offline_mode_requested,
+)
+
 logger = logging.getLogger(__name__)
 
 
 STOP_TOKENS = ["<|end|>", "<|eot_id|>", "<|eom_id|>", "</think>", "<|im_end|>"]
 
 
-def download_split_file(repo_id, filenames):
+SHARD_PATTERN = re.compile(r"^(?P<stem>.*)-(?P<index>\d+)-of-(?P<count>\d+)\.gguf$")
+
+## Enough to fill the link on a node without hammering the Hub
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+## Where the model runs: in this process, on a shared model server, or nowhere
+## (the stub, for running the pipeline without a GPU)
+BACKENDS = ["llama_cpp", "server", "stub"]
+
+
+def hub_checksums(repo_id: str, remote_paths: List[str]) -> Dict[str, str]:
+    """
+    Get the sha256 of each file from its LFS metadata on the Hub, keyed by remote path
+    relative to the repo root
+    """
+    checksums = {}
+    for info in HfApi().get_paths_info(repo_id, remote_paths):
+        if getattr(info, "lfs", None) is not None:
+            checksums[info.path] = info.lfs.sha256
+    return checksums
+
+
+def download_verified(
+    repo_id: str, remote_path: str, expected_sha256: Optional[str] = None
+) -> Tuple[str, Optional[str]]:
     """
-    Large models are split on hf-hub, this downloads and reconsitutes them for loading
+    Download one file from the hub, checking its sha256 if we know what it should be.
 
-    We download each file in turn to a local dir, thenconcatenate it to one big file
-    Each downloaded file will be immediately deleted to save space
+    hf_hub_download resumes from the partial file in the cache if an earlier attempt
+    was interrupted. If the finished file doesn't match the checksum, it's
+    downloaded again from scratch once before giving up.
+
+    Returns the local path and its sha256 (None if we had nothing to check against)
+    """
+    remote_filepath = Path(remote_path)
+    subdir = "/".join(remote_filepath.parts[:-1]) or None
+    for attempt in range(2):
+        local_path = hf_hub_download(
+            repo_id=repo_id,
+            filename=remote_filepath.name,
+            subfolder=subdir,
+            force_download=attempt > 0,
+        )
+        if expected_sha256 is None:
+            return local_path, None
+        local_sha256 = file_sha256(local_path)
+        if local_sha256 == expected_sha256:
+            logger.info(f"Downloaded and verified {remote_filepath.name}")
+            return local_path, local_sha256
+        logger.warning(
+            f"Checksum mismatch for {remote_filepath.name}, downloading it again"
+        )
+    raise ValueError(f"Checksum mismatch for {remote_path} after re-downloading")
+
+
+def download_split_file(repo_id, filenames, max_workers=DEFAULT_DOWNLOAD_WORKERS):
+    """
+    Large models are split on hf-hub, this downloads the shards so llama.cpp can load
+    them from the first one
+
+    Shards are downloaded concurrently, each resuming from any partial download in
+    the cache, and each is checked against the sha256 the Hub has for it.
 
     Parameters
     ----------
     repo_id : str
         The name of the huggingface repo we will be pulling from
     filenames : List[str]
-        The list of chunks to download
+        The list of chunks to download, as returned by HfFileSystem.glob
+    max_workers : int
+        How many shards to download at once
 
     Returns
     -------
     List[str]
-        List of locally downloaded shards
+        List of locally downloaded shards, in shard order
+    Dict[str, str]
+        The verified sha256 of each local shard
 
     Raises
     ------
         ValueError
             When the number of downloaded shards does not match how many shard the
-            filenames claim there should be
+            filenames claim there should be, or a shard fails its checksum
 
     """
     expected_file_count = int(filenames[0].split("-of-")[-1].replace(".gguf", ""))
-    local_filenames = []
-    for remote_filename in filenames:
-        remote_filepath = Path(remote_filename)
-        if len(remote_filepath.parts) > 3:
-            subdir = remote_filepath.parts[-2]
-        else:
-            subdir = None
-        local_path = hf_hub_download(
-            repo_id=repo_id, filename=Path(remote_filename).name, subfolder=subdir
+    ## Glob results start with the repo id, the hub API wants paths within the repo
+    remote_paths = sorted(
+        "/".join(Path(remote_filename).parts[2:]) for remote_filename in filenames
+    )
+    try:
+        expected_checksums = hub_checksums(repo_id, remote_paths)
+    except Exception as e:
+        logger.warning(f"Couldn't get checksums from the hub, shards won't be verified: {e}")
+        expected_checksums = {}
+
+    with ThreadPoolExecutor(
+        max_workers=max(min(max_workers, len(remote_paths)), 1),
+        thread_name_prefix="shard_download",
+    ) as executor:
+        downloads = list(
+            executor.map(
+                lambda remote_path: download_verified(
+                    repo_id, remote_path, expected_checksums.get(remote_path)
+                ),
+                remote_paths,
+            )
         )
-        local_filenames.append(local_path)
+    local_filenames = [local_path for local_path, _ in downloads]
+    checksums = {
+        local_path: sha256 for local_path, sha256 in downloads if sha256 is not None
+    }
 
     if len(local_filenames) != expected_file_count:
         raise ValueError(
             "Number of downloaded shards does not match expected shards based on filename!"
         )
 
-    return local_filenames
+    return local_filenames, checksums
 
 
-def get_model(
+def model_files(model_path: str) -> List[str]:
+    """
+    All the files making up a local model: just the one, or every shard of a split
+    model given the path of any of them
+    """
+    match = SHARD_PATTERN.match(Path(model_path).name)
+    if match is None:
+        return [model_path]
+    count = int(match.group("count"))
+    width = len(match.group("index"))
+    return [
+        str(
+            Path(model_path).with_name(
+                f"{match.group('stem')}-{i:0{width}d}-of-{match.group('count')}.gguf"
+            )
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def stage_model_files(
+    model_path: str, staging_dir: str, max_workers: int = DEFAULT_DOWNLOAD_WORKERS
+) -> str:
+    """
+    Copy a model (every shard of it) onto node-local scratch, and return the path to
+    load from there. Files already staged with the right size are not copied again.
+
+    Loading from shared storage can be much slower than a local disk, and on a fresh
+    node this turns a cold start into one sequential read of the model.
+    """
+    staging_path = Path(staging_dir)
+    staging_path.mkdir(parents=True, exist_ok=True)
+
+    def stage_one(source: str) -> str:
+        ## Names matter, llama.cpp finds the shards of a split model by name
+        target = staging_path / Path(source).name
+        if target.exists() and target.stat().st_size == os.path.getsize(source):
+            return str(target)
+        tmp_target = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        shutil.copyfile(source, tmp_target)
+        os.replace(tmp_target, target)
+        return str(target)
+
+    _stage_start = time.time()
+    sources = model_files(model_path)
+    with ThreadPoolExecutor(
+        max_workers=max(min(max_workers, len(sources)), 1),
+        thread_name_prefix="model_staging",
+    ) as executor:
+        staged = list(executor.map(stage_one, sources))
+    logger.info(
+        f"Staged {len(staged)} model file(s) to {staging_dir} in {time.time() - _stage_start:.2f} seconds"
+    )
+    return staged[0]
+
+
+def find_cached_ggufs(model_name: str, quantization: str = None) -> List[str]:
+    """
+    Look for a model's gguf file(s) in the local huggingface cache, without any network
+    access. Returns an empty list if they aren't there.
+    """
+    try:
+        snapshot_dir = snapshot_download(
+            repo_id=model_name, local_files_only=True, allow_patterns=["*.gguf"]
+        )
+    except Exception as e:
+        logger.debug(f"{model_name} is not in the local huggingface cache: {e}")
+        return []
+    gguf_files = sorted(str(p) for p in Path(snapshot_dir).glob("**/*.gguf"))
+    if quantization is not None:
+        gguf_files = [
+            f for f in gguf_files if quantization.lower() in Path(f).name.lower()
+        ]
+    return gguf_files
+
+
+def resolve_model_path(
     model_name: str,
-    chat_template: str = None,
     quantization: str = None,
-    context_length: int = 16384,
-):
+    offline: bool = None,
+    manifest: ModelManifest = None,
+) -> str:
     """
-    Load a llama.cpp model, either locally or by downloading from huggingface
+    Find the local gguf file for a model, downloading it from huggingface if needed
 
-    Note - this will cache the models, so make sure the HF_HOME environment
-    variable is set appropriately.
+    The local model manifest is checked before going anywhere near the Hub, and every
+    model resolved from the Hub is recorded in it, so later starts are a local lookup.
 
     Parameters:
         model_name: str
             The local filepath, or huggingface hub ID of the model to use
 
-        chat_template (optional): str
-            The chat template to use when formatting interactions with the model.
-            Defaults to chatml. For best results ensure this is set correctly
-
         quantization (optional): str
             What quantization type/level to use. This is required when loading from
             a hf hub repo that contains multiple models.
 
-        context_length (optional): int
-            The context length to use when interacting with the model. Defaults to 16384
+        offline (optional): bool
+            Never contact the Hub; only use the manifest and the local huggingface
+            cache. Defaults to on if GOFLOW_OFFLINE or HF_HUB_OFFLINE is set
+
+        manifest (optional): ModelManifest
+            The manifest to use, defaults to the one at GOFLOW_MODEL_MANIFEST
 
     Returns:
-        model: guidance.LlamaCpp
-            A guidance-wrapped Llama.cpp model instance
+        model_path: str
+            Path to the local gguf file (the first shard, for split models)
 
     Raises:
-        FileNotFoundError:
-            When:
-                - the local file doesn not exist
-                - the model repo on huggingface does not exist
-                - The model repo contains no gguf files
-        ValueError:
-            When:
-                - When no quant type specified for a repo with multiple ggufs
-                - When the requested quant tyoe was not found in the repo
+        See get_model
+    """
+    if Path(model_name).exists():
+        logging.debug("Loading local model from path %s", model_name)
+        # Don't need to do anything really
+        return model_name
 
+    if offline is None:
+        offline = offline_mode_requested()
+    if manifest is None:
+        manifest = ModelManifest()
 
+    model_path = manifest.lookup(model_name, quantization)
+    if model_path is not None:
+        logger.info(f"Resolved {model_name} from the model manifest: {model_path}")
+        return model_path
+
+    if offline:
+        local_filenames = find_cached_ggufs(model_name, quantization)
+        if len(local_filenames) == 0:
+            logging.error(
+                "Offline mode, and %s is not in the model manifest or local cache!",
+                model_name,
+            )
+            raise FileNotFoundError(
+                f"Offline mode, and {model_name} is not in the model manifest or local cache!"
+            )
+        logger.info(f"Resolved {model_name} from the local huggingface cache")
+        manifest.record(model_name, quantization, local_filenames)
+        return local_filenames[0]
 
-    """
     fs = HfFileSystem()
+    checksums = {}
 
-    if Path(model_name).exists():
-        logging.debug("Loading local model from path %s", model_name)
-        # Don't need to do anything really
-        model_path = model_name
-    elif fs.exists(model_name):
+    if fs.exists(model_name):
         logging.debug("Downloading a gguf file from hub, then loading it")
         # Search the repo in hub for gguf files
         gguf_files = fs.glob(f"{model_name}/**/*.gguf")
@@ -145,6 +331,8 @@ def get_model(
         elif len(gguf_files) == 1:
             remote_filename = Path(gguf_files[0]).name
             logging.debug("Only one gguf file in the repo, loading %s", remote_filename)
+            model_path = hf_hub_download(repo_id=model_name, filename=remote_filename)
+            local_filenames = [model_path]
         else:
             if quantization is None:
                 logging.error(
@@ -174,7 +362,9 @@ def get_model(
                 logging.debug(
                     "Right quantisation found, looks like a sharded file. Downloading shards..."
                 )
-                local_filenames = download_split_file(model_name, matching_ggufs)
+                local_filenames, checksums = download_split_file(
+                    model_name, matching_ggufs
+                )
                 ## Giving the first split as local path should work
                 model_path = list(filter(lambda x: "01-of" in x, local_filenames))[0]
             else:
@@ -190,12 +380,142 @@ def get_model(
                 model_path = hf_hub_download(
                     repo_id=model_name, filename=remote_filepath.name
                 )
+                local_filenames = [model_path]
     else:
         logging.error("Local model file does not exist, and is not a huggingface repo!")
         raise FileNotFoundError(
             "Local model file does not exist, and is not a huggingface repo!"
         )
 
+    ## Put the first shard first, that's the one the manifest hands back
+    manifest.record(
+        model_name,
+        quantization,
+        [model_path] + [f for f in local_filenames if f != model_path],
+        checksums=checksums,
+    )
+    return model_path
+
+
+def get_model(
+    model_name: str,
+    chat_template: str = None,
+    quantization: str = None,
+    context_length: int = 16384,
+    offline: bool = None,
+    staging_dir: str = None,
+    draft_model: str = None,
+    draft_quantization: str = None,
+    n_draft: int = DEFAULT_N_DRAFT,
+    prompt_lookup: bool = False,
+    backend: str = "llama_cpp",
+    server_url: str = None,
+    stub_script: str = None,
+):
+    """
+    Load a llama.cpp model, either locally or by downloading from huggingface, or
+    connect to one already loaded by a model server
+
+    Note - this will cache the models, so make sure the HF_HOME environment
+    variable is set appropriately.
+
+    Parameters:
+        model_name: str
+            The local filepath, or huggingface hub ID of the model to use
+
+        chat_template (optional): str
+            The chat template to use when formatting interactions with the model.
+            Defaults to chatml. For best results ensure this is set correctly
+
+        quantization (optional): str
+            What quantization type/level to use. This is required when loading from
+            a hf hub repo that contains multiple models.
+
+        context_length (optional): int
+            The context length to use when interacting with the model. Defaults to 16384
+
+        offline (optional): bool
+            Only use the model manifest and local cache, never the Hub. See
+            resolve_model_path
+
+        staging_dir (optional): str
+            Copy the model files here (e.g. node-local scratch) and load them from
+            there. Files already staged are reused
+
+        draft_model (optional): str
+            The local filepath, or huggingface hub ID of a small model sharing this
+            model's tokenizer, to use for speculative decoding
+
+        draft_quantization (optional): str
+            The quantization of the draft model, as for quantization
+
+        n_draft (optional): int
+            How many tokens are proposed at a time when speculating. Defaults to 8
+
+        prompt_lookup (optional): bool
+            Speculate by looking up the last few tokens earlier in the context,
+            which speeds up copying text such as evidence. Defaults to False
+
+        backend (optional): str
+            "llama_cpp" to load the model in this process, or "server" to use a
+            slot on a shared model server (see mirna_curator.model.model_server),
+            in which case the model options above are the server's business and
+            are ignored. Defaults to "llama_cpp"
+
+        server_url (optional): str
+            The model server's address, http://host:port or unix:///path/to.sock.
+            Defaults to http://127.0.0.1:8090
+
+        stub_script (optional): str
+            For backend="stub", a JSON file with the replies, latency and seed of
+            the stub model. See mirna_curator.model.stub
+
+    Returns:
+        model: guidance.LlamaCpp
+            A guidance-wrapped Llama.cpp model instance, or a RemoteModel for the
+            server backend, or a StubModel
+
+    Raises:
+        FileNotFoundError:
+            When:
+                - the local file doesn not exist
+                - the model repo on huggingface does not exist
+                - The model repo contains no gguf files
+        ValueError:
+            When:
+                - When no quant type specified for a repo with multiple ggufs
+                - When the requested quant tyoe was not found in the repo
+
+
+
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(BACKENDS)}")
+    if backend != "llama_cpp" and (draft_model is not None or prompt_lookup):
+        logger.warning(f"Speculative decoding isn't supported with the {backend} backend, ignoring it")
+    if backend == "server":
+        model = RemoteModel(
+            server_url or DEFAULT_SERVER_URL,
+            echo=False,
+            chat_template=TEMPLATE_LOOKUP.get(chat_template, ChatMLTemplate),
+        )
+        track_prefix_reuse(model)
+        return model
+    if backend == "stub":
+        model = StubModel(
+            load_stub_script(stub_script),
+            echo=False,
+            chat_template=TEMPLATE_LOOKUP.get(chat_template, ChatMLTemplate),
+        )
+        track_prefix_reuse(model)
+        return model
+
+    model_path = resolve_model_path(
+        model_name, quantization=quantization, offline=offline
+    )
+    if staging_dir is not None:
+        model_path = stage_model_files(model_path, staging_dir)
+
     model = LlamaCpp(
         model=model_path,
         echo=False,
@@ -212,5 +532,111 @@ def get_model(
         dry_multiplier=0.5,
         samplers="top_k;top_p;min_p;temperature;dry;typ_p;xtc",
     )
+    draft_model_path = None
+    if draft_model is not None:
+        draft_model_path = resolve_model_path(
+            draft_model, quantization=draft_quantization, offline=offline
+        )
+        if staging_dir is not None:
+            draft_model_path = stage_model_files(draft_model_path, staging_dir)
+    enable_speculative_decoding(
+        model,
+        draft_model_path=draft_model_path,
+        prompt_lookup=prompt_lookup,
+        n_draft=n_draft,
+    )
+    track_prefix_reuse(model)
+    ## For fitting article sections into what's left of the context
+    model.engine.context_length = int(context_length)
 
     return model
+
+
+def get_batched_models(
+    model_name: str,
+    n_slots: int,
+    chat_template: str = None,
+    quantization: str = None,
+    context_length: int = 16384,
+    offline: bool = None,
+    staging_dir: str = None,
+) -> List[LlamaCpp]:
+    """
+    Load one copy of a model's weights, with a context holding n_slots independent
+    sequences, each decoded together with the others in shared batches. See
+    mirna_curator.model.batched
+
+    Parameters:
+        model_name: str
+            The local filepath, or huggingface hub ID of the model to use
+
+        n_slots: int
+            How many sequences to run at once
+
+        chat_template, quantization, offline, staging_dir (optional):
+            As for get_model
+
+        context_length (optional): int
+            The context length of each slot. Defaults to 16384
+
+    Returns:
+        models: List[guidance.LlamaCpp]
+            A guidance-wrapped model for each slot, to be used from separate threads
+    """
+    model_path = resolve_model_path(
+        model_name, quantization=quantization, offline=offline
+    )
+    if staging_dir is not None:
+        model_path = stage_model_files(model_path, staging_dir)
+
+    ## The weights and tokenizer come from here, its own context is left unused
+    model_obj = Llama(
+        model_path=model_path,
+        n_gpu_layers=-1,
+        n_ctx=512,
+        flash_attn=True,
+        verbose=False,
+    )
+    context = BatchedContext(model_obj, n_slots, context_length)
+    logger.info(
+        f"Created a batched context with {n_slots} slots of {context_length} tokens"
+    )
+
+    models = []
+    for slot in range(n_slots):
+        model = LlamaCpp(
+            model=model_obj,
+            echo=False,
+            chat_template=TEMPLATE_LOOKUP.get(chat_template, ChatMLTemplate),
+        )
+        attach_slot(model, context, slot)
+        track_prefix_reuse(model)
+        models.append(model)
+    return models
+
+
+def get_tokenizer(
+    model_name: str, quantization: str = None, offline: bool = None
+) -> Llama:
+    """
+    Load only the vocabulary of a model, for counting tokens without loading any
+    weights or touching the GPU
+
+    Parameters:
+        model_name: str
+            The local filepath, or huggingface hub ID of the model to use
+
+        quantization (optional): str
+            What quantization type/level to use, as for get_model
+
+        offline (optional): bool
+            Only use the model manifest and local cache, as for get_model
+
+    Returns:
+        tokenizer: llama_cpp.Llama
+            A vocab-only llama.cpp model; use its tokenize method
+    """
+    model_path = resolve_model_path(
+        model_name, quantization=quantization, offline=offline
+    )
+    return Llama(model_path=model_path, vocab_only=True, verbose=False)
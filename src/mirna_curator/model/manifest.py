@@ -0,0 +1,138 @@
+"""
+A local manifest of resolved models, so startup doesn't need the Hub.
+
+Resolving a hub ID means listing the repo's files on huggingface, which is slow, and
+impossible on compute nodes with no outbound network. Once a model has been resolved
+and downloaded, the manifest records which local GGUF file(s) it came to, along with
+their sizes and sha256 checksums. The next start is then just a local lookup.
+
+The manifest is a JSON file, by default ~/.cache/go_flow_llm/models.json (set
+GOFLOW_MODEL_MANIFEST to move it, e.g. onto storage shared between nodes):
+
+    {
+        "bartowski/Qwen_QwQ-32B-GGUF::q8_0": {
+            "files": [{"path": "/.../Qwen_QwQ-32B-Q8_0.gguf", "size": 34820882368, "sha256": "..."}],
+            "resolved": 1718000000.0
+        }
+    }
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_PATH = os.environ.get(
+    "GOFLOW_MODEL_MANIFEST",
+    str(Path.home() / ".cache" / "go_flow_llm" / "models.json"),
+)
+
+
+def offline_mode_requested() -> bool:
+    """
+    Respect the huggingface offline switch as well as our own
+    """
+    return any(
+        os.environ.get(var, "").lower() in ("1", "true", "yes")
+        for var in ("GOFLOW_OFFLINE", "HF_HUB_OFFLINE")
+    )
+
+
+def file_sha256(path: str, chunk_size: int = 16 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_key(model_name: str, quantization: Optional[str]) -> str:
+    return f"{model_name}::{(quantization or '').lower()}"
+
+
+class ModelManifest:
+    def __init__(self, manifest_path: Optional[str] = None):
+        self.manifest_path = Path(manifest_path or DEFAULT_MANIFEST_PATH)
+
+    def _load(self) -> Dict[str, Any]:
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable model manifest {self.manifest_path}: {e}")
+            return {}
+
+    def _save(self, entries: Dict[str, Any]) -> None:
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def lookup(
+        self, model_name: str, quantization: Optional[str], verify: bool = False
+    ) -> Optional[str]:
+        """
+        Get the local path for a model, or None if it isn't in the manifest or its
+        files have changed. Sizes are always checked; checksums only if verify is set,
+        since hashing a large model takes a while.
+
+        Returns the first file, which is what llama.cpp wants for split models
+        """
+        entry = self._load().get(_manifest_key(model_name, quantization))
+        if entry is None:
+            return None
+        for file_entry in entry["files"]:
+            path = file_entry["path"]
+            if not os.path.isfile(path) or os.path.getsize(path) != file_entry["size"]:
+                logger.warning(
+                    f"Model manifest entry for {model_name} is stale, {path} is missing or has changed"
+                )
+                return None
+            if verify and file_sha256(path) != file_entry["sha256"]:
+                logger.warning(f"Checksum mismatch for {path}, ignoring manifest entry")
+                return None
+        return entry["files"][0]["path"]
+
+    def record(
+        self,
+        model_name: str,
+        quantization: Optional[str],
+        paths: List[str],
+        checksums: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Record the local files a model resolved to. Checksums are computed for any
+        files they weren't given for.
+        """
+        ## Not resolve(), llama.cpp finds the other shards of a split model by name
+        checksums = {
+            os.path.abspath(path): checksum
+            for path, checksum in (checksums or {}).items()
+        }
+        files = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if path not in checksums:
+                logger.info(f"Computing checksum for {path}")
+            files.append(
+                {
+                    "path": path,
+                    "size": os.path.getsize(path),
+                    "sha256": checksums.get(path) or file_sha256(path),
+                }
+            )
+        entries = self._load()
+        entries[_manifest_key(model_name, quantization)] = {
+            "files": files,
+            "resolved": time.time(),
+        }
+        self._save(entries)
+        logger.info(f"Recorded {model_name} ({quantization}) in the model manifest")
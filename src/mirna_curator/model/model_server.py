@@ -0,0 +1,336 @@
+"""
+Share one loaded model between several curation processes.
+
+Normally every curation process loads its own copy of the weights. Instead, this
+loads them once, with a batched context of several slots (see model/batched.py),
+and serves logits over a local HTTP API, on a TCP port or a Unix socket. Curation
+processes started with `--backend server --server_url ...` lease a slot each, and
+keep guidance (tokenization, grammars and sampling) on their side, so constrained
+decoding works exactly as it does in-process. CPU-side work (fetching, parsing,
+grammar masks) then scales with the number of processes, and GPU memory with the
+number of slots.
+
+llama.cpp's own server doesn't return full logits, which guidance needs to apply
+its grammars, so this is a minimal stand-in with just what the client needs.
+
+Endpoints:
+    GET    /health              - model name, slots and slots free
+    GET    /vocab               - the token byte strings and special token ids
+    POST   /tokenize            - {"text": <base64 bytes>} -> {"tokens": [...]}
+    POST   /slots               - lease a slot -> {"slot": n, "lease": id}
+    DELETE /slots/<n>?lease=id  - give a slot back
+    POST   /slots/<n>/logits    - {"lease": id, "keep": k, "append": [...]} ->
+                                  float32 logits after the first k tokens of the
+                                  slot's last request followed by the appended
+                                  tokens. The X-Evaluated-Tokens header says how
+                                  many tokens had to be evaluated
+
+A slot left unused for too long is leased again with a new id, and requests with
+the old one get a 409, so a client that stalled finds out it lost the slot rather
+than working on another client's tokens.
+
+Run it with:
+    mirna_curator serve-model --model_path ... --slots 4 --socket_path /tmp/goflow_model.sock
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+from mirna_curator.main import mutually_exclusive_with_config
+
+logger = logging.getLogger(__name__)
+
+## Slots a client hasn't used for this long can be handed to a new client, in case
+## the first one died without giving it back
+DEFAULT_LEASE_TIMEOUT = 600.0
+
+
+@dataclass
+class Lease:
+    lease_id: str
+    last_used: float
+
+
+class ModelServer:
+    def __init__(
+        self,
+        model_name: str,
+        model_obj,
+        context,
+        lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+    ):
+        from guidance.models._llama_cpp import LlamaCppTokenizer
+
+        self.model_name = model_name
+        self.model_obj = model_obj
+        self.context = context
+        self.lease_timeout = lease_timeout
+        self.tokenizer = LlamaCppTokenizer(model_obj)
+        self._lock = threading.Lock()
+        self._leases: Dict[int, Lease] = {}
+        self._slot_tokens: Dict[int, List[int]] = {
+            slot: [] for slot in range(context.n_slots)
+        }
+
+    def vocab(self) -> Dict[str, Any]:
+        return {
+            "tokens": [
+                base64.b64encode(bytes(token)).decode("ascii")
+                for token in self.tokenizer.tokens
+            ],
+            "bos_token_id": self.tokenizer.bos_token_id,
+            "eos_token_id": self.tokenizer.eos_token_id,
+            "special_token_ids": list(self.tokenizer.special_token_ids),
+            "slot_context_length": self.context.slot_context_length,
+        }
+
+    def lease(self) -> Optional[Tuple[int, str]]:
+        """
+        A free slot and the id of its lease, None if there are none free
+        """
+        with self._lock:
+            now = time.time()
+            for slot in range(self.context.n_slots):
+                lease = self._leases.get(slot)
+                if lease is None or now - lease.last_used > self.lease_timeout:
+                    if lease is not None:
+                        logger.warning(
+                            f"Reclaiming slot {slot}, unused for {now - lease.last_used:.0f}s"
+                        )
+                    self._leases[slot] = Lease(uuid.uuid4().hex, now)
+                    return slot, self._leases[slot].lease_id
+        return None
+
+    def _check_lease(self, slot: int, lease_id: Optional[str]) -> Lease:
+        lease = self._leases.get(slot)
+        if lease is None or lease.lease_id != lease_id:
+            raise KeyError(f"Slot {slot} is not leased to this client")
+        return lease
+
+    def release(self, slot: int, lease_id: Optional[str]) -> None:
+        with self._lock:
+            self._check_lease(slot, lease_id)
+            del self._leases[slot]
+
+    def free_slots(self) -> int:
+        with self._lock:
+            return self.context.n_slots - len(self._leases)
+
+    def logits(self, slot: int, lease_id: Optional[str], keep: int, append: List[int]):
+        with self._lock:
+            self._check_lease(slot, lease_id).last_used = time.time()
+        token_ids = self._slot_tokens[slot][:keep] + append
+        self._slot_tokens[slot] = token_ids
+        return self.context.get_logits(slot, token_ids)
+
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    ## Keep connections open, clients send one request per token
+    protocol_version = "HTTP/1.1"
+    ## Set on a subclass when the server is built
+    model_server: ModelServer = None
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send(self, status: int, body: bytes, content_type: str, headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _read_json(self) -> Any:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length > 0 else {}
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            self._send_json(
+                200,
+                {
+                    "status": "ok",
+                    "model": self.model_server.model_name,
+                    "slots": self.model_server.context.n_slots,
+                    "free_slots": self.model_server.free_slots(),
+                },
+            )
+        elif path == "/vocab":
+            self._send_json(200, self.model_server.vocab())
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path.rstrip("/").split("/")[1:]
+        try:
+            body = self._read_json()
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        if path == ["tokenize"]:
+            text = base64.b64decode(body["text"])
+            self._send_json(200, {"tokens": self.model_server.tokenizer.encode(text)})
+        elif path == ["slots"]:
+            lease = self.model_server.lease()
+            if lease is None:
+                self._send_json(503, {"error": "All slots are in use"})
+            else:
+                self._send_json(200, {"slot": lease[0], "lease": lease[1]})
+        elif len(path) == 3 and path[0] == "slots" and path[2] == "logits":
+            try:
+                logits, evaluated = self.model_server.logits(
+                    int(path[1]), body.get("lease"), int(body["keep"]), list(body["append"])
+                )
+            except KeyError as e:
+                self._send_json(409, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send(
+                200,
+                logits.astype("float32").tobytes(),
+                "application/octet-stream",
+                {"X-Evaluated-Tokens": str(evaluated)},
+            )
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_DELETE(self) -> None:
+        url = urlparse(self.path)
+        path = url.path.rstrip("/").split("/")[1:]
+        if len(path) == 2 and path[0] == "slots":
+            lease_id = parse_qs(url.query).get("lease", [None])[0]
+            try:
+                self.model_server.release(int(path[1]), lease_id)
+            except KeyError as e:
+                self._send_json(409, {"error": str(e)})
+                return
+            self._send_json(200, {"slot": int(path[1]), "status": "released"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+
+def make_model_server(
+    model_server: ModelServer,
+    host: str = "127.0.0.1",
+    port: int = 8090,
+    socket_path: Optional[str] = None,
+):
+    """
+    Build the HTTP server, on a Unix socket if a path is given, otherwise on host:port
+    """
+    from http.server import ThreadingHTTPServer
+
+    from mirna_curator.serve import ThreadingUnixHTTPServer
+
+    handler = type(
+        "BoundModelRequestHandler",
+        (ModelRequestHandler,),
+        {"model_server": model_server},
+    )
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.option("--config", help="A JSON config file, using the same names as the options")
+@click.option("--model_path", help="The model to serve, a local GGUF or huggingface hub ID")
+@click.option("--quantization", help="Quantization to use, if the repo has several")
+@click.option("--context_length", help="Context length of each slot", type=int, default=16384)
+@click.option("--slots", help="How many clients can use the model at once", type=int, default=4)
+@click.option("--gpu", help="Which GPU to load the model on", default=None)
+@click.option("--host", help="Address to listen on", default="127.0.0.1")
+@click.option("--port", help="Port to listen on", type=int, default=8090)
+@click.option("--socket_path", help="Listen on this Unix socket instead of a port", default=None)
+@click.option(
+    "--offline",
+    help="Resolve the model from the local manifest and cache only, never contacting huggingface",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--stage_model_dir",
+    help="Copy the model files to this directory (e.g. node-local scratch) and load them from there",
+    default=None,
+)
+@mutually_exclusive_with_config()
+def serve_model(
+    config: Optional[str] = None,
+    model_path: Optional[str] = None,
+    quantization: Optional[str] = None,
+    context_length: Optional[int] = 16384,
+    slots: Optional[int] = 4,
+    gpu: Optional[str] = None,
+    host: Optional[str] = "127.0.0.1",
+    port: Optional[int] = 8090,
+    socket_path: Optional[str] = None,
+    offline: Optional[bool] = False,
+    stage_model_dir: Optional[str] = None,
+    **unused_config,
+):
+    """
+    Load a model once and serve logits to curation processes run with --backend server
+    """
+    if gpu is not None:
+        logger.info("Selecting %s gpu for this process", gpu)
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+
+    from llama_cpp import Llama
+
+    from mirna_curator.model.batched import BatchedContext
+    from mirna_curator.model.llm import resolve_model_path, stage_model_files
+
+    _model_load_start = time.time()
+    resolved_path = resolve_model_path(
+        model_path, quantization=quantization, offline=offline or None
+    )
+    if stage_model_dir is not None:
+        resolved_path = stage_model_files(resolved_path, stage_model_dir)
+    model_obj = Llama(
+        model_path=resolved_path, n_gpu_layers=-1, n_ctx=512, flash_attn=True, verbose=False
+    )
+    context = BatchedContext(model_obj, int(slots), int(context_length))
+    model_server = ModelServer(model_path, model_obj, context)
+    logger.info(
+        f"Loaded model from {model_path} with {slots} slots in {time.time() - _model_load_start:.2f} seconds"
+    )
+
+    server = make_model_server(model_server, host=host, port=int(port), socket_path=socket_path)
+    logger.info(f"Serving the model on {socket_path or f'{host}:{port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    serve_model()
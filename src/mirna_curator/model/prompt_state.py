@@ -0,0 +1,148 @@
+"""
+An on-disk cache of the llama.cpp state after the system prompt.
+
+Every process evaluates the same system prompt before it curates anything, and
+parallel_controller.py starts one process per GPU. Once one process has evaluated
+it, the KV state is saved, and later starts (restarts, new workers) load that
+instead of running the prefill again.
+
+States are keyed by the model file, the context length, the chat template and a
+hash of the rendered system prompt, so changing any of them makes a new entry:
+
+    ~/.cache/go_flow_llm/prompt_state/<key>.state
+
+Set GOFLOW_PROMPT_STATE_CACHE or the prompt_state_dir option to move it.
+
+After a restore the engine is told which tokens are in the KV cache, so the first
+call for every paper only evaluates what comes after the system prompt, exactly as
+it does from the second paper on in a single process.
+"""
+
+import ctypes
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = os.environ.get(
+    "GOFLOW_PROMPT_STATE_CACHE",
+    str(Path.home() / ".cache" / "go_flow_llm" / "prompt_state"),
+)
+
+
+def prompt_tokens(llm) -> List[int]:
+    """
+    Tokenize the current model state the way guidance does before running it:
+    the prompt text, with a BOS token in front if the model uses one
+    """
+    tokenizer = llm.engine.tokenizer
+    tokens = tokenizer.encode(str(llm).encode("utf-8"))
+    if tokenizer.bos_token is not None and tokens[:1] != [tokenizer.bos_token_id]:
+        tokens = [tokenizer.bos_token_id] + tokens
+    return tokens
+
+
+class PromptStateCache:
+    def __init__(self, state_dir: Optional[str] = None):
+        self.state_dir = Path(state_dir or DEFAULT_STATE_DIR)
+
+    def state_path(self, llm) -> Path:
+        engine = llm.engine
+        model_file = os.path.abspath(engine.model)
+        model_stat = os.stat(model_file)
+        key = hashlib.sha256(
+            "\n".join(
+                [
+                    model_file,
+                    str(model_stat.st_size),
+                    str(model_stat.st_mtime_ns),
+                    str(engine.model_obj.n_ctx()),
+                    type(llm._client.chat_template).__name__,
+                    hashlib.sha256(str(llm).encode("utf-8")).hexdigest(),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+        return self.state_dir / f"{key}.state"
+
+    def restore(self, llm) -> bool:
+        """
+        Load the saved state for this model and prompt, if there is one. Returns
+        whether it was loaded
+        """
+        import llama_cpp
+
+        path = self.state_path(llm)
+        if not path.exists():
+            return False
+        engine = llm.engine
+        n_ctx = engine.model_obj.n_ctx()
+        tokens = (llama_cpp.llama_token * n_ctx)()
+        n_tokens = ctypes.c_size_t(0)
+        if not llama_cpp.llama_state_load_file(
+            engine.model_obj.ctx,
+            str(path).encode("utf-8"),
+            tokens,
+            n_ctx,
+            ctypes.byref(n_tokens),
+        ):
+            logger.warning(f"Couldn't load system prompt state from {path}, ignoring it")
+            llama_cpp.llama_kv_cache_clear(engine.model_obj.ctx)
+            engine._cache_token_ids = []
+            return False
+        ## Leave the last token out, so guidance always has at least one token to
+        ## evaluate and never asks for logits it didn't compute itself
+        engine._cache_token_ids = list(tokens[: n_tokens.value - 1])
+        logger.info(f"Restored system prompt state ({n_tokens.value} tokens) from {path}")
+        return True
+
+    def save(self, llm) -> Optional[Path]:
+        """
+        Evaluate the system prompt and save the resulting state
+        """
+        import llama_cpp
+
+        tokens = prompt_tokens(llm)
+        if len(tokens) < 2:
+            return None
+        ## The last token can tokenize differently once more text follows it, so
+        ## stop short of it
+        tokens = tokens[:-1]
+        engine = llm.engine
+        engine.get_logits(tokens)
+
+        path = self.state_path(llm)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        if not llama_cpp.llama_state_save_file(
+            engine.model_obj.ctx,
+            str(tmp_path).encode("utf-8"),
+            (llama_cpp.llama_token * len(tokens))(*tokens),
+            len(tokens),
+        ):
+            logger.warning(f"Couldn't save system prompt state to {path}")
+            tmp_path.unlink(missing_ok=True)
+            return None
+        os.replace(tmp_path, path)
+        logger.info(f"Saved system prompt state ({len(tokens)} tokens) to {path}")
+        return path
+
+    def prime(self, llm) -> None:
+        """
+        Get the system prompt into the KV cache, from disk if possible, otherwise by
+        evaluating it and saving the state for next time
+        """
+        _prime_start = time.time()
+        try:
+            if not self.restore(llm):
+                self.save(llm)
+        except Exception as e:
+            ## Only ever an optimisation, the prompt is evaluated as normal otherwise
+            logger.warning(f"System prompt state cache unavailable: {e}")
+            return
+        logger.info(
+            f"System prompt state ready in {time.time() - _prime_start:.2f} seconds"
+        )
@@ -0,0 +1,238 @@
+"""
+A guidance model backed by a shared model server (see model/model_server.py).
+
+Everything guidance does apart from evaluating the model stays in this process:
+tokenization rules, grammars, token masks and sampling. The engine only sends the
+server the tokens that changed since its last request and gets back the logits,
+so constrained decoding works the same as with an in-process LlamaCpp model.
+
+Requests go over one persistent HTTP/1.1 connection per model, to a host:port or
+a Unix socket (server_url "unix:///path/to.sock"), which is reopened if the server
+drops it.
+"""
+
+import atexit
+import base64
+import http.client
+import json
+import logging
+import operator
+import socket
+import threading
+import time
+from functools import lru_cache
+from itertools import takewhile
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+from guidance.models._base import Model
+from guidance.models._engine import Engine, EngineClient, EngineState, Tokenizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERVER_URL = "http://127.0.0.1:8090"
+DEFAULT_TIMEOUT = 600.0
+## How long to keep asking for a slot while the server has none free
+DEFAULT_LEASE_WAIT = 300.0
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = DEFAULT_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServerConnection:
+    """
+    A keep-alive connection to the model server, reopened when it goes stale
+    """
+
+    def __init__(self, server_url: str, timeout: float = DEFAULT_TIMEOUT):
+        self.server_url = server_url
+        self.timeout = timeout
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        url = urlparse(self.server_url)
+        if url.scheme == "unix":
+            return UnixHTTPConnection(url.path, timeout=self.timeout)
+        return http.client.HTTPConnection(
+            url.hostname, url.port or 80, timeout=self.timeout
+        )
+
+    def request(
+        self, method: str, path: str, payload: Any = None
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        ## One retry on a fresh connection, for when the server closed an idle one
+        with self._lock:
+            for attempt in range(2):
+                if self._connection is None:
+                    self._connection = self._connect()
+                try:
+                    self._connection.request(method, path, body=body, headers=headers)
+                    response = self._connection.getresponse()
+                    return response.status, dict(response.getheaders()), response.read()
+                except (http.client.HTTPException, ConnectionError, OSError):
+                    self._connection.close()
+                    self._connection = None
+                    if attempt == 1:
+                        raise
+        raise ConnectionError(f"Couldn't reach the model server at {self.server_url}")
+
+    def request_json(self, method: str, path: str, payload: Any = None) -> Any:
+        status, _, body = self.request(method, path, payload)
+        if status != 200:
+            raise RuntimeError(f"{method} {path} on the model server returned {status}: {body[:200]!r}")
+        return json.loads(body)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class RemoteTokenizer(Tokenizer):
+    def __init__(self, connection: ServerConnection, chat_template=None):
+        self._connection = connection
+        vocab = connection.request_json("GET", "/vocab")
+        self.slot_context_length = vocab["slot_context_length"]
+        ## guidance encodes the whole prompt for every call, so remember recent prompts
+        self._encode = lru_cache(maxsize=32)(self._remote_encode)
+        super().__init__(
+            [base64.b64decode(token) for token in vocab["tokens"]],
+            chat_template,
+            vocab["bos_token_id"],
+            vocab["eos_token_id"],
+            vocab["special_token_ids"],
+        )
+
+    def _remote_encode(self, byte_string: bytes) -> Tuple[int, ...]:
+        response = self._connection.request_json(
+            "POST", "/tokenize", {"text": base64.b64encode(byte_string).decode("ascii")}
+        )
+        return tuple(response["tokens"])
+
+    def encode(self, byte_string: bytes) -> List[int]:
+        return list(self._encode(bytes(byte_string)))
+
+
+class RemoteEngine(Engine):
+    """
+    A guidance engine that gets its logits from one slot on the model server
+    """
+
+    def __init__(
+        self,
+        server_url: str,
+        chat_template=None,
+        lease_wait: float = DEFAULT_LEASE_WAIT,
+        **kwargs,
+    ):
+        self.model = server_url
+        self.lease_wait = lease_wait
+        self._connection = ServerConnection(server_url)
+        self._control = ServerConnection(server_url)
+        self._cache_token_ids: List[int] = []
+        self._cached_logits: Optional[np.ndarray] = None
+        self._slot: Optional[int] = None
+        self._lease_id: Optional[str] = None
+
+        tokenizer = RemoteTokenizer(self._control, chat_template=chat_template)
+        super().__init__(tokenizer, **kwargs)
+        self._n_vocab = len(self.tokenizer.tokens)
+        self.context_length = tokenizer.slot_context_length
+        self._lease()
+        atexit.register(self.release)
+
+    def _lease(self) -> None:
+        _lease_start = time.time()
+        while True:
+            status, _, body = self._connection.request("POST", "/slots", {})
+            if status == 200:
+                lease = json.loads(body)
+                self._slot, self._lease_id = lease["slot"], lease["lease"]
+                break
+            if status != 503 or time.time() - _lease_start > self.lease_wait:
+                raise RuntimeError(f"Couldn't get a slot on the model server: {body[:200]!r}")
+            time.sleep(1.0)
+        ## A new slot starts out empty
+        self._cache_token_ids = []
+        self._cached_logits = None
+        logger.info(f"Using slot {self._slot} on the model server at {self.model}")
+
+    def release(self) -> None:
+        if self._slot is None:
+            return
+        try:
+            self._connection.request("DELETE", f"/slots/{self._slot}?lease={self._lease_id}")
+        except (ConnectionError, OSError, http.client.HTTPException):
+            pass
+        self._slot, self._lease_id = None, None
+        self._connection.close()
+        self._control.close()
+
+    def get_logits(self, token_ids):
+        """
+        Get the logits after token_ids, sending the server only what's changed
+        since the last request. Follows LlamaCppEngine.get_logits.
+        """
+        if len(token_ids) == 0:
+            raise ValueError("token_ids must contain some tokens.")
+        if self._slot is None:
+            self._lease()
+
+        num_cached = sum(
+            takewhile(operator.truth, map(operator.eq, token_ids, self._cache_token_ids))
+        )
+        if num_cached == len(token_ids) and num_cached == len(self._cache_token_ids):
+            return self._cached_logits
+
+        status, headers, body = self._connection.request(
+            "POST",
+            f"/slots/{self._slot}/logits",
+            {
+                "lease": self._lease_id,
+                "keep": num_cached,
+                "append": list(token_ids[num_cached:]),
+            },
+        )
+        if status == 409:
+            ## The server gave the slot to someone else, start again on a new one
+            logger.warning(f"Lost slot {self._slot} on the model server, leasing another")
+            self._lease()
+            status, headers, body = self._connection.request(
+                "POST",
+                f"/slots/{self._slot}/logits",
+                {"lease": self._lease_id, "keep": 0, "append": list(token_ids)},
+            )
+        if status != 200:
+            raise Exception(f"Model server returned {status}: {body[:200]!r}")
+
+        self.metrics.engine_input_tokens += int(headers.get("X-Evaluated-Tokens", 0))
+        self.metrics.engine_output_tokens += 1
+        logits = np.frombuffer(body, dtype=np.float32, count=self._n_vocab).copy()
+        self._cache_token_ids = list(token_ids)
+        self._cached_logits = logits
+        return logits
+
+
+class RemoteModel(Model):
+    def __init__(
+        self,
+        server_url: str = DEFAULT_SERVER_URL,
+        echo=True,
+        chat_template=None,
+        **kwargs,
+    ):
+        """Build a guidance model that runs on a shared model server."""
+        engine = RemoteEngine(server_url, chat_template=chat_template, **kwargs)
+        super().__init__(client=EngineClient(engine), state=EngineState(), echo=echo)
@@ -0,0 +1,263 @@
+"""
+Speculative decoding for guidance's llama.cpp engine, with a small draft model or
+by looking up n-grams in the prompt.
+
+guidance asks the engine for the logits after each token, one token at a time, and
+does its own sampling under the grammar. So rather than sampling from the draft,
+this speculates on what guidance will ask for next: after evaluating a prompt, the
+draft model greedily proposes a few tokens, and the target model evaluates the
+prompt plus the proposal in one batch, keeping the logits at every position. If
+guidance then samples the proposed token, the next logits are already there and no
+decode is needed. Misses cost one batch slightly wider than it would have been.
+
+The logits guidance samples from always come from the target model, so the output
+is the same as without a draft; only the time taken changes. That makes it safe for
+constrained steps too, although it only pays off in free text generation, which is
+where the draft model agrees with the target most.
+
+Proposals come from either or both of:
+    - prompt lookup: find the last few tokens earlier in the context, and propose
+      whatever followed them there. Evidence extraction mostly copies text from the
+      loaded section, so this gets most of a quote in a single batch, for free.
+    - a draft model, which has to share the target's tokenizer, e.g.
+      Qwen2.5-0.5B-Instruct for QwQ-32B.
+With both, prompt lookup is tried first and the draft model only runs when it finds
+nothing.
+"""
+
+import logging
+import operator
+import time
+from itertools import takewhile
+from typing import List, Optional
+
+import llama_cpp
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_N_DRAFT = 8
+DEFAULT_MAX_NGRAM_SIZE = 3
+
+## Text covering plain words, numbers, punctuation and gene-style identifiers
+VOCAB_PROBE = "The hsa-miR-21-5p target PTEN (3'UTR, p < 0.05) was down-regulated in 12 HeLa cells."
+
+
+def _common_prefix_length(a: List[int], b: List[int]) -> int:
+    return sum(takewhile(operator.truth, map(operator.eq, a, b)))
+
+
+class PromptLookupProposer:
+    """
+    Propose the tokens that followed the most recent earlier occurrence of the last
+    few tokens, trying the longest n-gram first
+    """
+
+    def __init__(self, max_ngram_size: int = DEFAULT_MAX_NGRAM_SIZE):
+        self.max_ngram_size = max_ngram_size
+
+    def propose(self, token_ids: List[int], n_draft: int) -> List[int]:
+        tokens = np.asarray(token_ids)
+        for ngram_size in range(min(self.max_ngram_size, len(tokens) - 1), 0, -1):
+            ngram = tokens[-ngram_size:]
+            windows = np.lib.stride_tricks.sliding_window_view(tokens[:-1], ngram_size)
+            matches = np.flatnonzero((windows == ngram).all(axis=1))
+            if len(matches) > 0:
+                start = matches[-1] + ngram_size
+                return tokens[start : start + n_draft].tolist()
+        return []
+
+
+class DraftModelProposer:
+    """
+    Greedily propose the next tokens with a small model
+    """
+
+    def __init__(self, draft_model: llama_cpp.Llama, target_n_vocab: int):
+        self.draft_model = draft_model
+        self._target_n_vocab = target_n_vocab
+        self._n_vocab = draft_model.n_vocab()
+
+    def propose(self, token_ids: List[int], n_draft: int) -> List[int]:
+        draft = self.draft_model
+        n_draft = min(n_draft, draft.n_ctx() - len(token_ids) - 1)
+        if n_draft <= 0:
+            return []
+        ## Reuse whatever the draft already has in its KV cache
+        n_cached = _common_prefix_length(token_ids, draft.input_ids[: draft.n_tokens].tolist())
+        draft.n_tokens = min(n_cached, len(token_ids) - 1)
+        draft.eval(token_ids[draft.n_tokens :])
+
+        proposal = []
+        for _ in range(n_draft):
+            logits = np.ctypeslib.as_array(
+                llama_cpp.llama_get_logits_ith(draft.ctx, -1),
+                shape=(self._n_vocab,),
+            )
+            token = int(np.argmax(logits))
+            if token >= self._target_n_vocab or token == draft.token_eos():
+                break
+            proposal.append(token)
+            draft.eval([token])
+        return proposal
+
+
+class SpeculativeDecoder:
+    """
+    Wraps get_logits on the engine behind a guidance LlamaCpp model to speculate
+    with the given proposers, in order. Use enable_speculative_decoding rather than
+    making one directly.
+    """
+
+    def __init__(self, engine, proposers: List, n_draft: int = DEFAULT_N_DRAFT):
+        self.engine = engine
+        self.proposers = proposers
+        self.n_draft = n_draft
+        self._n_vocab = engine.model_obj.n_vocab()
+
+        ## Tokens the target has evaluated, with the logits after each position from
+        ## _verified_from onwards
+        self._verified_tokens: List[int] = []
+        self._verified_from = 0
+        self._verified_logits: Optional[np.ndarray] = None
+
+        self.stats = {
+            "drafted_tokens": 0,
+            "accepted_tokens": 0,
+            "draft_seconds": 0.0,
+        }
+
+    def _draft(self, token_ids: List[int]) -> List[int]:
+        ## The proposal is evaluated after token_ids, so it has to fit in the context
+        ## too, and near the end there's no room to speculate at all
+        n_draft = min(self.n_draft, self.engine.model_obj.n_ctx() - len(token_ids) - 1)
+        if n_draft <= 0:
+            return []
+        _draft_start = time.time()
+        proposal = []
+        for proposer in self.proposers:
+            proposal = proposer.propose(token_ids, n_draft)[:n_draft]
+            if len(proposal) > 0:
+                break
+        self.stats["draft_seconds"] += time.time() - _draft_start
+        self.stats["drafted_tokens"] += len(proposal)
+        return proposal
+
+    def _evaluate(self, token_ids: List[int], proposal: List[int]) -> np.ndarray:
+        """
+        Evaluate the tokens and the draft proposal with the target model, keeping
+        the logits after the last real token and after each proposed one. Follows
+        LlamaCppEngine.get_logits, which this replaces.
+        """
+        engine = self.engine
+        model_obj = engine.model_obj
+        if model_obj.n_ctx() <= len(token_ids):
+            raise Exception(
+                f"Attempted to use a context length of {len(token_ids)} tokens, but this LlamaCpp model is only configured to support up to {model_obj.n_ctx()}!"
+            )
+        all_tokens = token_ids + proposal
+        num_cached = _common_prefix_length(all_tokens, engine._cache_token_ids)
+        num_cached = min(num_cached, len(token_ids) - 1)
+        llama_cpp.llama_kv_cache_seq_rm(model_obj.ctx, -1, num_cached, -1)
+
+        first_logit = len(token_ids) - 1
+        logits = np.empty((len(all_tokens) - first_logit, self._n_vocab), dtype=np.float32)
+        n_batch = model_obj.n_batch
+        batch = engine._context.batch
+        for i in range(num_cached, len(all_tokens), n_batch):
+            n_tokens = min(i + n_batch, len(all_tokens)) - i
+            batch.n_tokens = n_tokens
+            for j in range(n_tokens):
+                batch.token[j] = all_tokens[i + j]
+                batch.pos[j] = i + j
+                batch.seq_id[j][0] = 0
+                batch.n_seq_id[j] = 1
+                batch.logits[j] = i + j >= first_logit
+
+            ret = llama_cpp.llama_decode(model_obj.ctx, batch)
+            engine.metrics.engine_input_tokens += n_tokens
+            if ret != 0:
+                raise Exception(f"Call to llama_cpp.llama_decode returned {ret}.")
+            for j in range(max(first_logit - i, 0), n_tokens):
+                logits[i + j - first_logit] = np.ctypeslib.as_array(
+                    llama_cpp.llama_get_logits_ith(model_obj.ctx, j),
+                    shape=(self._n_vocab,),
+                )
+
+        engine.metrics.engine_output_tokens += 1
+        engine._cache_token_ids = all_tokens
+        self._verified_tokens = all_tokens
+        self._verified_from = first_logit
+        self._verified_logits = logits
+        return logits[0]
+
+    def get_logits(self, token_ids: List[int]) -> np.ndarray:
+        if len(token_ids) == 0:
+            raise ValueError("token_ids must contain some tokens.")
+
+        ## Is this a position we already have from the last verification?
+        position = len(token_ids) - 1
+        if (
+            self._verified_logits is not None
+            and self._verified_from <= position < len(self._verified_tokens)
+            and token_ids == self._verified_tokens[: len(token_ids)]
+        ):
+            if position > self._verified_from:
+                self.stats["accepted_tokens"] += 1
+                self.engine.metrics.engine_output_tokens += 1
+            logits = self._verified_logits[position - self._verified_from].copy()
+        else:
+            logits = self._evaluate(token_ids, self._draft(token_ids)).copy()
+        self.engine._cached_logits = logits
+        return logits
+
+
+def draft_vocab_matches(target: llama_cpp.Llama, draft: llama_cpp.Llama) -> bool:
+    """
+    Check the draft model tokenizes text the same way as the target
+    """
+    probe = VOCAB_PROBE.encode("utf-8")
+    return target.tokenize(probe, add_bos=False, special=True) == draft.tokenize(
+        probe, add_bos=False, special=True
+    )
+
+
+def enable_speculative_decoding(
+    llm,
+    draft_model_path: Optional[str] = None,
+    prompt_lookup: bool = False,
+    n_draft: int = DEFAULT_N_DRAFT,
+) -> Optional[SpeculativeDecoder]:
+    """
+    Have the guidance model's engine speculate, with prompt lookup and/or a draft
+    model. Returns the decoder, whose stats count drafted and accepted tokens, or
+    None if there is nothing to speculate with.
+    """
+    engine = llm.engine
+    proposers = []
+    if prompt_lookup:
+        proposers.append(PromptLookupProposer())
+    if draft_model_path is not None:
+        draft_model = llama_cpp.Llama(
+            model_path=draft_model_path,
+            n_gpu_layers=-1,
+            n_ctx=engine.model_obj.n_ctx(),
+            n_batch=engine.model_obj.n_batch,
+            flash_attn=True,
+            verbose=False,
+        )
+        if draft_vocab_matches(engine.model_obj, draft_model):
+            proposers.append(DraftModelProposer(draft_model, engine.model_obj.n_vocab()))
+        else:
+            logger.warning(
+                f"Draft model {draft_model_path} doesn't share a tokenizer with the target, not using it"
+            )
+    if len(proposers) == 0:
+        return None
+    decoder = SpeculativeDecoder(engine, proposers, n_draft=n_draft)
+    engine.speculative = decoder
+    engine.get_logits = decoder.get_logits
+    logger.info(
+        f"Speculative decoding with {', '.join(type(p).__name__ for p in proposers)}, drafting {n_draft} tokens"
+    )
+    return decoder
@@ -0,0 +1,296 @@
+"""
+A stand-in model for running the whole pipeline without a GGUF or a GPU.
+
+The stub is a real guidance engine, so everything on the Python side runs as it
+would with a real model: prompt assembly, grammar construction, token masking and
+sampling, captures, tracing and checkpointing. Only the logits are made up. They
+come from a seeded random generator, steered towards a canned reply when the prompt
+ends with one of the cues the curation functions use (e.g. "Reasoning:\n" for the
+reasoning capture, "based on my reasoning above is: " for the answer). Grammars
+still apply, so a canned reply that isn't allowed (an evidence sentence not in the
+section, say) gives way to a random allowed one. Once a reply is finished, or when
+there isn't one, the end of sequence token is preferred, so free text stops as
+soon as it can.
+
+The replies, latency and seed come from a JSON script, all keys optional:
+    {
+        "seed": 0,
+        "order": "random",          # or "scripted", to use the replies in turn
+        "token_latency": 0.0,       # seconds per logits call, i.e. per token
+        "prefill_latency": 0.0,     # seconds per prompt token evaluated
+        "context_length": null,     # tokens, sections are fitted to it if set
+        "captures": {
+            "reasoning": ["The text says ...", ...],
+            "answer": ["yes", "no"],
+            "protein_name": ["PTEN."],
+            "evidence": [...]
+        }
+    }
+Captures with no replies get whatever the grammar allows, chosen at random.
+
+Tokens are bytes, plus one token per word of the canned replies and the chat
+template's special tokens, so token counts are higher than a real model's.
+"""
+
+import json
+import logging
+import operator
+import random
+import re
+import time
+from functools import lru_cache
+from itertools import takewhile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from guidance.models._base import Model
+from guidance.models._engine import Engine, EngineClient, EngineState, Tokenizer
+
+logger = logging.getLogger(__name__)
+
+SPECIAL_TOKENS = [
+    "<|endoftext|>",
+    "<|im_start|>",
+    "<|im_end|>",
+    "<|end|>",
+    "<|eot_id|>",
+    "<|eom_id|>",
+]
+EOS_TOKEN = "<|endoftext|>"
+
+## The text the curation functions put right before each capture
+CUES = [
+    ("Reasoning:\n<think>\n", "reasoning"),
+    ("Reasoning:\n", "reasoning"),
+    ("Reasoning: ", "reasoning"),
+    ("based on my reasoning above is: ", "answer"),
+    ("Protein name(s): ", "protein_name"),
+    ("The most relevant sentence is: ", "evidence"),
+    ("The most relevant paragraph is: ", "evidence"),
+    ("The most relevant sentences are: ", "evidence"),
+    ("The most relevant piece of evidence is: '", "evidence"),
+    (" implies ", "reasoning"),
+    ("the most likely section heading is: ", "target_section_name"),
+    ## The tool loop's free text only ends at a newline or "]", which the end of
+    ## sequence preference never reaches
+    *((f"Thought {i}: ", "thought") for i in range(8)),
+    ("finish[", "finish_argument"),
+]
+## Replies that don't depend on the script
+FIXED_REPLIES = {
+    "thought": ["The section should be enough to answer the question.\n"],
+    "finish_argument": ["]"],
+}
+
+DEFAULT_CAPTURES = {
+    "reasoning": [
+        "The text describes the miRNA and its target, and the experiments support a direct interaction. So the answer is yes.",
+        "The section does not mention the miRNA in this context, and there is no experimental evidence for it. So the answer is no.",
+        "Reporter assays and western blots show the miRNA represses the target. This is enough to answer the question.",
+    ],
+    "answer": ["yes", "no"],
+}
+
+## How far back to look for a cue, in tokens
+CUE_WINDOW = 4096
+## How much of the text before a cue tells it apart from other cues, in bytes
+CUE_KEY_BYTES = 1024
+
+
+def load_stub_script(script_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read a stub script from a JSON file, filling in the defaults
+    """
+    script = {}
+    if script_path is not None:
+        with open(script_path, "r") as f:
+            script = json.load(f)
+    script.setdefault("captures", DEFAULT_CAPTURES)
+    return script
+
+
+class StubTokenizer(Tokenizer):
+    def __init__(self, words: List[str], chat_template=None):
+        tokens = [bytes([b]) for b in range(256)]
+        ## Only the end of sequence token is special, the others have to be plain
+        ## tokens so that generating one matches a stop string
+        tokens += [token.encode("utf-8") for token in SPECIAL_TOKENS]
+        special_token_ids = [tokens.index(EOS_TOKEN.encode("utf-8"))]
+        seen = set(tokens)
+        for word in words:
+            for token in (word.encode("utf-8"), f" {word}".encode("utf-8")):
+                if len(token) > 1 and token not in seen:
+                    seen.add(token)
+                    tokens.append(token)
+        self._ids = {token: i for i, token in enumerate(tokens)}
+        self._max_token_length = max(len(token) for token in tokens)
+        self._encode = lru_cache(maxsize=32)(self._greedy_encode)
+        super().__init__(
+            tokens,
+            chat_template,
+            None,
+            self._ids[EOS_TOKEN.encode("utf-8")],
+            special_token_ids,
+        )
+
+    def longest_token(self, byte_string: bytes, start: int = 0) -> int:
+        """
+        The longest token that byte_string starts with, from start
+        """
+        for length in range(min(self._max_token_length, len(byte_string) - start), 0, -1):
+            token_id = self._ids.get(byte_string[start : start + length])
+            if token_id is not None:
+                return token_id
+        raise ValueError(f"No token for {byte_string[start:start + 1]!r}")
+
+    def _greedy_encode(self, byte_string: bytes) -> Tuple[int, ...]:
+        token_ids = []
+        i = 0
+        while i < len(byte_string):
+            token_id = self.longest_token(byte_string, i)
+            token_ids.append(token_id)
+            i += len(self.tokens[token_id])
+        return tuple(token_ids)
+
+    def encode(self, byte_string: bytes) -> List[int]:
+        return list(self._encode(bytes(byte_string)))
+
+
+class StubEngine(Engine):
+    """
+    A guidance engine that makes up its logits, see the module docstring
+    """
+
+    def __init__(self, script: Dict[str, Any], chat_template=None, **kwargs):
+        self.model = "stub"
+        self.script = script
+        self.token_latency = float(script.get("token_latency", 0.0))
+        self.prefill_latency = float(script.get("prefill_latency", 0.0))
+        ## Unlimited unless the script sets it, for trying out section fitting
+        self.context_length = script.get("context_length")
+        self.scripted = script.get("order", "random") == "scripted"
+        self.captures = {
+            name: list(replies) for name, replies in script.get("captures", {}).items()
+        }
+        self._rng = np.random.default_rng(script.get("seed", 0))
+        self._choices = random.Random(script.get("seed", 0))
+        self._turns = {name: 0 for name in [*self.captures, *FIXED_REPLIES]}
+        self._cues = [
+            (cue.rstrip().encode("utf-8"), cue[len(cue.rstrip()) :].encode("utf-8"), name)
+            for cue, name in CUES
+        ]
+
+        ## The reply being steered towards, and the text before its cue. Positions
+        ## change as the cue window slides, and a rebuilt context can put a new cue
+        ## where an old one was, so the text is what identifies a cue.
+        self._reply: Optional[bytes] = None
+        self._reply_key: Optional[int] = None
+
+        self._cache_token_ids: List[int] = []
+        self._cached_logits: Optional[np.ndarray] = None
+
+        words = {
+            word
+            for replies in self.captures.values()
+            for reply in replies
+            for word in re.findall(r"\w+|[^\w\s]", reply)
+        }
+        super().__init__(StubTokenizer(sorted(words), chat_template=chat_template), **kwargs)
+        self._n_vocab = len(self.tokenizer.tokens)
+        self._stop_ids = [
+            self.tokenizer.encode(token.encode("utf-8"))[0] for token in SPECIAL_TOKENS
+            if token != "<|im_start|>"
+        ]
+        self._newline = self.tokenizer.encode(b"\n")[0]
+
+    def _next_reply(self, name: str) -> Optional[str]:
+        replies = self.captures.get(name) or FIXED_REPLIES.get(name)
+        if not replies:
+            return None
+        if self.scripted:
+            reply = replies[self._turns[name] % len(replies)]
+            self._turns[name] += 1
+            return reply
+        return self._choices.choice(replies)
+
+    def _find_cue(self, text: bytes) -> Tuple[Optional[int], List[bytes], Optional[str]]:
+        """
+        The last cue in the text, as where its reply starts, the whitespace that
+        can follow it, and the capture name. Tokenization may not have added the
+        whitespace yet, in which case several cues can match.
+        """
+        best_end, whitespaces, best_name = -1, [], None
+        for stripped, whitespace, name in self._cues:
+            position = text.rfind(stripped)
+            end = position + len(stripped)
+            if position < 0 or not whitespace.startswith(text[end : end + len(whitespace)]):
+                continue
+            if end > best_end:
+                best_end, whitespaces, best_name = end, [whitespace], name
+            elif end == best_end:
+                whitespaces.append(whitespace)
+        if best_name is None:
+            return None, [], None
+        return best_end, whitespaces, best_name
+
+    def _steer(self, token_ids: List[int]) -> List[int]:
+        """
+        The tokens that continue the canned reply for the current cue, if there is one
+        """
+        window = token_ids[-CUE_WINDOW:]
+        text = b"".join(self.tokenizer.tokens[window])
+        reply_start, whitespaces, name = self._find_cue(text)
+        if reply_start is None:
+            return []
+
+        ## A new cue means a new reply, otherwise carry on with the current one
+        cue_key = hash(text[max(reply_start - CUE_KEY_BYTES, 0) : reply_start])
+        if cue_key != self._reply_key:
+            self._reply_key = cue_key
+            reply = self._next_reply(name)
+            self._reply = None if reply is None else reply.encode("utf-8")
+        if self._reply is None:
+            return []
+
+        generated = text[reply_start:]
+        steer = []
+        for whitespace in whitespaces:
+            reply = whitespace + self._reply
+            if reply.startswith(generated) and len(generated) < len(reply):
+                steer.append(self.tokenizer.longest_token(reply, len(generated)))
+        return steer
+
+    def get_logits(self, token_ids):
+        if len(token_ids) == 0:
+            raise ValueError("token_ids must contain some tokens.")
+        num_cached = sum(
+            takewhile(operator.truth, map(operator.eq, token_ids, self._cache_token_ids))
+        )
+        if num_cached == len(token_ids) and num_cached == len(self._cache_token_ids):
+            return self._cached_logits
+        num_cached = min(num_cached, len(token_ids) - 1)
+        n_evaluated = len(token_ids) - num_cached
+        time.sleep(self.token_latency + self.prefill_latency * n_evaluated)
+
+        logits = self._rng.standard_normal(self._n_vocab).astype(np.float32)
+        steer = self._steer(list(token_ids))
+        if len(steer) > 0:
+            logits[steer] += 50.0
+        else:
+            ## Finish as soon as the grammar allows, with a stop string, or failing
+            ## that the end of a line
+            logits[self._stop_ids] += 50.0
+            logits[self._newline] += 25.0
+
+        self.metrics.engine_input_tokens += n_evaluated
+        self.metrics.engine_output_tokens += 1
+        self._cache_token_ids = list(token_ids)
+        self._cached_logits = logits
+        return logits
+
+
+class StubModel(Model):
+    def __init__(self, script: Optional[Dict[str, Any]] = None, echo=True, chat_template=None, **kwargs):
+        """Build a guidance model with made up replies, for running without a GPU."""
+        engine = StubEngine(script or load_stub_script(), chat_template=chat_template, **kwargs)
+        super().__init__(client=EngineClient(engine), state=EngineState(), echo=echo)
@@ -0,0 +1,190 @@
+"""
+The pieces of a curation run shared by the batch CLI (main.py) and the server
+(serve.py): applying the system prompt to a freshly loaded model, and running the
+computation graph for every RNA of interest in one article, or for several articles
+at once in the slots of a batched model.
+"""
+
+import faulthandler
+import logging
+import queue
+import sys
+import time
+import typing as ty
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from epmc_xml.article import Article
+from guidance import system, user
+
+from mirna_curator.flowchart.computation_graph import ComputationGraph
+from mirna_curator.flowchart.flow_prompts import CurationPrompts
+from mirna_curator.model.prompt_state import PromptStateCache
+from mirna_curator.utils.metrics import summarise_node_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def apply_system_prompt(
+    llm,
+    prompt_data: CurationPrompts,
+    state_cache: ty.Optional[PromptStateCache] = None,
+):
+    """
+    Look for a system prompt in the prompts, and apply it if found.
+
+    With a state cache, the evaluated system prompt is also restored from (or saved
+    to) disk, so it's in the KV cache before the first paper.
+    """
+    for prompt in prompt_data.prompts:
+        if prompt.type == "system":
+            logger.info("Found system prompt, applying...")
+            try:
+                with system():
+                    llm += prompt.prompt
+            except Exception as e:
+                logger.warning(
+                    "Selected model does not have a system prompt mode, forward as user instead"
+                )
+                with user():
+                    llm += prompt.prompt
+
+            if state_cache is not None:
+                state_cache.prime(llm)
+            break
+    return llm
+
+
+def curate_article(
+    graph: ComputationGraph,
+    llm,
+    article: Article,
+    rows: ty.List[ty.Dict[str, ty.Any]],
+    prompt_data: CurationPrompts,
+    fetch_time: float = 0.0,
+) -> ty.Iterator[ty.Dict[str, ty.Any]]:
+    """
+    Run the graph for each row (PMCID and rna_id) in one article, yielding an output
+    row with the curation result and performance metrics as each RNA finishes.
+
+    With several RNAs, the sections are loaded into context once and every RNA
+    branches from that state. RNAs that fail are logged and skipped.
+    """
+    paper_llm = llm
+    preloaded_sections = []
+    _preload_start = time.time()
+    if len(rows) > 1:
+        logger.info(f"Curating {len(rows)} RNAs from {rows[0]['PMCID']} together")
+        try:
+            paper_llm, preloaded_sections = graph.preload_sections(
+                llm, article, prompt_data
+            )
+        except Exception as e:
+            logger.error(e)
+            logger.error(
+                "Paper %s has exceeded context limit, skipping", rows[0]["PMCID"]
+            )
+            return
+    _preload_seconds = time.time() - _preload_start
+
+    for rna_row in rows:
+        _curation_start = time.time()
+        try:
+            llm_trace, curation_result = graph.execute_graph(
+                rna_row["PMCID"],
+                paper_llm,
+                article,
+                rna_row["rna_id"],
+                prompt_data,
+                loaded_sections=preloaded_sections,
+            )
+        except Exception as e:
+            logger.error(e)
+            logger.error(
+                "Paper %s has exceeded context limit, skipping", rna_row["PMCID"]
+            )
+            faulthandler.dump_traceback(file=sys.stderr, all_threads=True)
+            continue
+        logger.info(
+            f"RNA ID: {rna_row['rna_id']} in {rna_row['PMCID']} - Curation Result: {curation_result}"
+        )
+        _curation_end = time.time()
+        logger.info(
+            f"Ran curation graph in {_curation_end - _curation_start:.2f} seconds"
+        )
+        node_summary = summarise_node_metrics(graph.visit_metrics)
+        if node_summary["prefix_reuse_ratio"] is not None:
+            logger.info(
+                f"Prefix reuse for {rna_row['PMCID']}: {node_summary['prefix_reuse_ratio']:.1%} of prompt tokens served from the KV cache"
+            )
+        if node_summary["draft_acceptance_rate"] is not None:
+            logger.info(
+                f"Speculative decoding for {rna_row['PMCID']}: {node_summary['draft_acceptance_rate']:.1%} of drafted tokens accepted, "
+                f"{node_summary['output_tokens_per_second']:.1f} tokens/s generated"
+            )
+        yield {
+            "PMCID": rna_row["PMCID"],
+            "rna_id": rna_row["rna_id"],
+            "curation_result": curation_result,
+            "fetch_seconds": fetch_time,
+            "preload_seconds": _preload_seconds,
+            "graph_seconds": _curation_end - _curation_start,
+            "sections_loaded": graph.sections_loaded,
+            "sections_fitted": graph.sections_fitted,
+            "sections_evicted": graph.sections_evicted,
+            **node_summary,
+            "node_metrics": graph.visit_metrics,
+        }
+
+
+def curate_concurrently(
+    slots: ty.List[ty.Tuple[ComputationGraph, ty.Any]],
+    prefetched_articles: ty.Iterable,
+    rows_for: ty.Callable[[ty.Dict[str, ty.Any]], ty.List[ty.Dict[str, ty.Any]]],
+    prompt_data: CurationPrompts,
+) -> ty.Iterator[ty.Tuple[ty.Any, ty.List[ty.Dict[str, ty.Any]]]]:
+    """
+    Curate articles in parallel, one per slot, where each slot is a graph and the
+    model it drives (see get_batched_models). A new article starts as soon as a
+    slot is free.
+
+    Yields each prefetched article with its output rows as it finishes, so not in
+    input order. Articles that couldn't be fetched are yielded straight away, with
+    no rows.
+    """
+    free_slots = queue.Queue()
+    for slot in slots:
+        free_slots.put(slot)
+
+    def curate_in_slot(prefetched):
+        graph, llm = free_slots.get()
+        try:
+            return list(
+                curate_article(
+                    graph,
+                    llm,
+                    prefetched.article,
+                    rows_for(prefetched.row),
+                    prompt_data,
+                    fetch_time=prefetched.fetch_time,
+                )
+            )
+        finally:
+            free_slots.put((graph, llm))
+
+    in_flight = {}
+    with ThreadPoolExecutor(
+        max_workers=len(slots), thread_name_prefix="curation_slot"
+    ) as executor:
+        for prefetched in prefetched_articles:
+            if prefetched.error is not None:
+                yield prefetched, []
+                continue
+            while len(in_flight) >= len(slots):
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+            in_flight[executor.submit(curate_in_slot, prefetched)] = prefetched
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future.result()
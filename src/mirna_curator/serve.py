@@ -0,0 +1,605 @@
+"""
+Long-lived curation server.
+
+Loading a large GGUF and applying the system prompt can take minutes, which is a lot
+to pay for an ad-hoc request or a small daily batch. In serve mode the model,
+flowchart and prompts are loaded once, and (PMCID, rna_id) jobs are accepted over a
+local HTTP API, on a TCP port or a Unix socket.
+
+Jobs go into a queue and are curated one at a time by a single worker, since the
+model can only do one thing at once. Results are streamed back as newline-delimited
+JSON as each RNA finishes.
+
+Endpoints:
+    GET  /health                 - model name and queue length
+    POST /jobs                   - submit {"items": [{"PMCID": ..., "rna_id": ...}, ...]}
+                                   (or a single {"PMCID": ..., "rna_id": ...}). Streams
+                                   the results back, unless ?stream=false is given, in
+                                   which case the job id is returned straight away
+    GET  /jobs/<job_id>          - status and results so far
+    GET  /jobs/<job_id>/stream   - stream the results, from the start
+
+For example:
+    curl -N localhost:8080/jobs -d '{"PMCID": "PMC1234567", "rna_id": "hsa-mir-21"}'
+    curl -N --unix-socket /tmp/goflow.sock http://localhost/jobs -d @batch.json
+"""
+
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import click
+from pydantic import ValidationError
+
+from mirna_curator.apis.article_cache import DEFAULT_MAX_SIZE_GB
+from mirna_curator.flowchart import curation, flow_prompts
+from mirna_curator.flowchart.plan import FlowchartPlanError, compile_plan
+from mirna_curator.main import mutually_exclusive_with_config
+from mirna_curator.utils.tracing import curation_tracer
+
+logger = logging.getLogger(__name__)
+
+## How many finished jobs to keep around, so their results can still be fetched
+MAX_FINISHED_JOBS = 1000
+
+
+@dataclass
+class CurationJob:
+    job_id: str
+    items: List[Dict[str, str]]
+    status: str = "queued"
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    submitted: float = field(default_factory=time.time)
+    _changed: threading.Condition = field(default_factory=threading.Condition)
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    def set_status(self, status: str) -> None:
+        with self._changed:
+            self.status = status
+            self._changed.notify_all()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._changed:
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "items": len(self.items),
+                "events": list(self.events),
+            }
+
+    def stream(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield each event as it happens, finishing when the job is done
+        """
+        sent = 0
+        while True:
+            with self._changed:
+                while sent == len(self.events) and self.status != "done":
+                    self._changed.wait()
+                new_events = self.events[sent:]
+                finished = self.status == "done"
+            for event in new_events:
+                yield event
+            sent += len(new_events)
+            if finished and sent == len(self.events):
+                return
+
+
+class CurationService:
+    """
+    Owns the warm model and runs queued jobs through the computation graph, one at
+    a time, on a background thread.
+    """
+
+    def __init__(
+        self,
+        llm,
+        graph,
+        prompt_data: flow_prompts.CurationPrompts,
+        fetch_function: Callable[[str], Any],
+        model_name: str,
+        max_queue: int = 0,
+    ):
+        self.llm = llm
+        self.graph = graph
+        self.prompt_data = prompt_data
+        self.fetch_function = fetch_function
+        self.model_name = model_name
+        self.queue: "queue.Queue[CurationJob]" = queue.Queue(maxsize=max_queue)
+        self.jobs: "OrderedDict[str, CurationJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._worker = threading.Thread(
+            target=self._run, name="curation_worker", daemon=True
+        )
+
+    def start(self) -> None:
+        self._worker.start()
+
+    def submit(self, items: List[Dict[str, str]]) -> CurationJob:
+        """
+        Queue a job. Raises queue.Full if the queue has a limit and it's been reached
+        """
+        job = CurationJob(job_id=str(uuid.uuid4()), items=items)
+        with self._jobs_lock:
+            self.jobs[job.job_id] = job
+            self._forget_old_jobs()
+        self.queue.put_nowait(job)
+        logger.info(f"Queued job {job.job_id} with {len(items)} items")
+        return job
+
+    def get(self, job_id: str) -> Optional[CurationJob]:
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self) -> None:
+        finished = [j for j in self.jobs.values() if j.status == "done"]
+        for job in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job.job_id]
+
+    def _run(self) -> None:
+        while True:
+            job = self.queue.get()
+            try:
+                self.run_job(job)
+            ## The graph raises rather than exiting here, but nothing that exits should
+            ## take the worker, and every job queued after it, with it
+            except (Exception, SystemExit) as e:
+                logger.exception(f"Job {job.job_id} failed")
+                job.add_event({"type": "error", "error": str(e)})
+            finally:
+                job.add_event({"type": "done", "job_id": job.job_id})
+                job.set_status("done")
+                self.queue.task_done()
+
+    def run_job(self, job: CurationJob) -> None:
+        from mirna_curator.runner import curate_article
+
+        job.set_status("running")
+        _job_start = time.time()
+        ## Group the items by paper, so each article is only fetched and loaded once
+        papers: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+        for item in job.items:
+            papers.setdefault(item["PMCID"], []).append(item)
+
+        for pmcid, rows in papers.items():
+            _fetch_start = time.time()
+            try:
+                article = self.fetch_function(pmcid)
+            except Exception as e:
+                logger.error(f"Failed to fetch/parse {pmcid}: {e}")
+                for row in rows:
+                    job.add_event(
+                        {"type": "error", **row, "error": f"Failed to fetch: {e}"}
+                    )
+                continue
+            curated = set()
+            for output_row in curate_article(
+                self.graph,
+                self.llm,
+                article,
+                rows,
+                self.prompt_data,
+                fetch_time=time.time() - _fetch_start,
+            ):
+                curated.add(output_row["rna_id"])
+                job.add_event({"type": "result", **output_row})
+            for row in rows:
+                if row["rna_id"] not in curated:
+                    job.add_event({"type": "error", **row, "error": "Curation failed"})
+        logger.info(
+            f"Finished job {job.job_id} in {time.time() - _job_start:.2f} seconds"
+        )
+
+
+def parse_job_items(body: Any) -> List[Dict[str, str]]:
+    """
+    Accept either one item or {"items": [...]}, and check each has a PMCID and rna_id
+
+    Raises:
+        ValueError: If the body isn't a valid job
+    """
+    if isinstance(body, dict) and "items" in body:
+        items = body["items"]
+    else:
+        items = [body]
+    if not isinstance(items, list) or len(items) == 0:
+        raise ValueError("A job needs at least one item")
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict) or not {"PMCID", "rna_id"} <= item.keys():
+            raise ValueError(f"Every item needs a PMCID and rna_id, got {item}")
+        parsed.append({"PMCID": str(item["PMCID"]), "rna_id": str(item["rna_id"])})
+    return parsed
+
+
+class CurationRequestHandler(BaseHTTPRequestHandler):
+    ## Set on a subclass when the server is built
+    service: CurationService = None
+
+    def address_string(self) -> str:
+        ## Unix socket clients don't have an address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, events: Iterator[Dict[str, Any]]) -> None:
+        ## No content length, so the response ends when we close the connection
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for event in events:
+                self.wfile.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            ## The job carries on, its results can still be fetched later
+            logger.info("Client disconnected while streaming results")
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path.rstrip("/").split("/")[1:]
+        if path == ["health"]:
+            self._send_json(
+                200,
+                {
+                    "status": "ok",
+                    "model": self.service.model_name,
+                    "queued": self.service.queue.qsize(),
+                },
+            )
+        elif len(path) in (2, 3) and path[0] == "jobs":
+            job = self.service.get(path[1])
+            if job is None:
+                self._send_json(404, {"error": f"No job {path[1]}"})
+            elif len(path) == 3 and path[2] == "stream":
+                self._stream_events(job.stream())
+            elif len(path) == 2:
+                self._send_json(200, job.summary())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            items = parse_job_items(json.loads(self.rfile.read(length)))
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            job = self.service.submit(items)
+        except queue.Full:
+            self._send_json(503, {"error": "The job queue is full, try again later"})
+            return
+
+        stream = parse_qs(url.query).get("stream", ["true"])[0].lower() != "false"
+        if stream:
+            self._stream_events(
+                _with_header(
+                    {
+                        "type": "queued",
+                        "job_id": job.job_id,
+                        "position": self.service.queue.qsize(),
+                    },
+                    job.stream(),
+                )
+            )
+        else:
+            self._send_json(202, {"job_id": job.job_id, "status": job.status})
+
+
+def _with_header(
+    first: Dict[str, Any], events: Iterator[Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    yield first
+    yield from events
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(
+    service: CurationService,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    socket_path: Optional[str] = None,
+) -> socketserver.BaseServer:
+    """
+    Build the HTTP server, on a Unix socket if a path is given, otherwise on host:port
+    """
+    handler = type(
+        "BoundCurationRequestHandler", (CurationRequestHandler,), {"service": service}
+    )
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.option(
+    "--config",
+    type=click.Path(exists=True),
+    help="Path to a config.json file, the same as for a curation run",
+)
+@click.option("--model_path", help="A huggingface ID or local model path")
+@click.option("--flowchart", help="The flowchart, defined in JSON")
+@click.option("--prompts", help="The prompts, defined in JSON")
+@click.option(
+    "--context_length", help="The context length for the model", default=16384
+)
+@click.option("--quantization", help="The model quantization to use")
+@click.option("--chat_template", help="The chat template to use")
+@click.option(
+    "--evidence_type",
+    help="The type of evidence to extract",
+    default="single-sentence",
+)
+@click.option(
+    "--deepseek_mode",
+    help="Tweak the reasoning generation for deepseek models",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--prune_reasoning",
+    help="Drop each node's reasoning from the context once it has answered, keeping its question, answer and evidence",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--gpu", help="Which gpu ID to run on, if there are several available", default="0"
+)
+@click.option("--article_cache_dir", help="Where to cache articles", default=None)
+@click.option(
+    "--article_cache_size_gb",
+    help="Size limit for the article cache",
+    type=float,
+    default=DEFAULT_MAX_SIZE_GB,
+)
+@click.option(
+    "--section_heading_map",
+    help="JSON file of section headings learned across runs",
+    default=None,
+)
+@click.option("--host", help="Address to listen on", default="127.0.0.1")
+@click.option("--port", help="Port to listen on", type=int, default=8080)
+@click.option(
+    "--socket_path",
+    help="Listen on this Unix socket instead of a TCP port",
+    default=None,
+)
+@click.option(
+    "--max_queue",
+    help="Most jobs to hold in the queue, 0 for no limit",
+    type=int,
+    default=0,
+)
+@click.option(
+    "--offline",
+    help="Resolve the model from the local manifest and cache only, never contacting huggingface",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--stage_model_dir",
+    help="Copy the model files to this directory (e.g. node-local scratch) and load them from there",
+    default=None,
+)
+@click.option(
+    "--prompt_state_dir",
+    help="Where to keep the saved system prompt state, defaults to ~/.cache/go_flow_llm/prompt_state",
+    default=None,
+)
+@click.option(
+    "--no_prompt_state_cache",
+    help="Always evaluate the system prompt, rather than restoring a saved state",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--draft_model_path",
+    help="A small model sharing the main model's tokenizer, to speed up generation with speculative decoding",
+    default=None,
+)
+@click.option(
+    "--draft_quantization",
+    help="Quantization of the draft model, if it's a huggingface repo with several",
+    default=None,
+)
+@click.option(
+    "--n_draft",
+    help="How many tokens are proposed at a time when speculating",
+    type=int,
+    default=8,
+)
+@click.option(
+    "--prompt_lookup",
+    help="Speculate by looking up text already in the context, which speeds up copying evidence",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--backend",
+    help=(
+        "Run the model in this process (llama_cpp), on a shared model server started "
+        "with serve-model (server), or use a stub with made up replies, for running "
+        "without a GPU (stub)"
+    ),
+    type=click.Choice(["llama_cpp", "server", "stub"]),
+    default="llama_cpp",
+)
+@click.option(
+    "--server_url",
+    help="Address of the model server for --backend server, http://host:port or unix:///path/to.sock",
+    default=None,
+)
+@click.option(
+    "--stub_script",
+    help="JSON file with the replies, latency and seed for --backend stub",
+    default=None,
+)
+@mutually_exclusive_with_config()
+def serve(
+    config: Optional[str] = None,
+    model_path: Optional[str] = None,
+    flowchart: Optional[str] = None,
+    prompts: Optional[str] = None,
+    context_length: Optional[int] = 16384,
+    quantization: Optional[str] = None,
+    chat_template: Optional[str] = None,
+    evidence_type: Optional[str] = "single-sentence",
+    deepseek_mode: Optional[bool] = False,
+    prune_reasoning: Optional[bool] = False,
+    gpu: Optional[str] = None,
+    article_cache_dir: Optional[str] = None,
+    article_cache_size_gb: Optional[float] = DEFAULT_MAX_SIZE_GB,
+    section_heading_map: Optional[str] = None,
+    host: Optional[str] = "127.0.0.1",
+    port: Optional[int] = 8080,
+    socket_path: Optional[str] = None,
+    max_queue: Optional[int] = 0,
+    offline: Optional[bool] = False,
+    stage_model_dir: Optional[str] = None,
+    prompt_state_dir: Optional[str] = None,
+    no_prompt_state_cache: Optional[bool] = False,
+    draft_model_path: Optional[str] = None,
+    draft_quantization: Optional[str] = None,
+    n_draft: Optional[int] = 8,
+    prompt_lookup: Optional[bool] = False,
+    backend: Optional[str] = "llama_cpp",
+    server_url: Optional[str] = None,
+    stub_script: Optional[str] = None,
+    **unused_config,
+):
+    """
+    Load the model once, then curate (PMCID, rna_id) jobs sent over HTTP
+    """
+    curation_tracer.set_model_name(model_path)
+    try:
+        cf = curation.CurationFlowchart.model_validate_json(open(flowchart, "r").read())
+        prompt_data = flow_prompts.CurationPrompts.model_validate_json(
+            open(prompts, "r").read()
+        )
+    except ValidationError as e:
+        logger.fatal(e)
+        logger.fatal("Error loading flowchart or prompts, aborting")
+        return 1
+    try:
+        compile_plan(cf, prompt_data)
+    except FlowchartPlanError as e:
+        logger.fatal(e)
+        logger.fatal("Flowchart and prompts don't match, aborting")
+        return 1
+
+    from mirna_curator.apis.article_cache import ArticleCache
+    from mirna_curator.flowchart.computation_graph import ComputationGraph
+    from mirna_curator.flowchart.section_headings import (
+        DEFAULT_SECTION_HEADING_MAP,
+        SectionHeadingMap,
+    )
+    from mirna_curator.model.llm import get_model
+    from mirna_curator.model.prompt_state import PromptStateCache
+    from mirna_curator.runner import apply_system_prompt
+    from mirna_curator.utils.prefetch import fetch_and_parse
+
+    if gpu is not None:
+        logger.info("Selecting %s gpu for this process", gpu)
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpu
+    _model_load_start = time.time()
+    llm = get_model(
+        model_path,
+        chat_template=chat_template,
+        quantization=quantization,
+        context_length=int(context_length),
+        offline=offline or None,
+        staging_dir=stage_model_dir,
+        draft_model=draft_model_path,
+        draft_quantization=draft_quantization,
+        n_draft=int(n_draft),
+        prompt_lookup=prompt_lookup,
+        backend=backend,
+        server_url=server_url,
+        stub_script=stub_script,
+    )
+    llm = apply_system_prompt(
+        llm,
+        prompt_data,
+        state_cache=(
+            None
+            if no_prompt_state_cache or backend != "llama_cpp"
+            else PromptStateCache(prompt_state_dir)
+        ),
+    )
+    logger.info(
+        f"Loaded model from {model_path} in {time.time() - _model_load_start:.2f} seconds"
+    )
+
+    graph = ComputationGraph(
+        cf,
+        run_config={
+            "evidence_mode": evidence_type,
+            "deepseek_mode": deepseek_mode,
+            "prune_reasoning": prune_reasoning,
+        },
+        heading_map=SectionHeadingMap(section_heading_map or DEFAULT_SECTION_HEADING_MAP),
+        exit_on_error=False,
+    )
+    article_cache = ArticleCache(article_cache_dir, max_size_gb=article_cache_size_gb)
+    service = CurationService(
+        llm,
+        graph,
+        prompt_data,
+        partial(fetch_and_parse, cache=article_cache),
+        model_name=model_path,
+        max_queue=max_queue,
+    )
+    service.start()
+
+    server = make_server(service, host=host, port=port, socket_path=socket_path)
+    logger.info(
+        f"Serving curation requests on {socket_path or f'http://{host}:{port}'}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    serve()
@@ -12,7 +12,7 @@ import polars as pl
 from guidance import user, assistant, select, gen
 from functools import partial, wraps
 from tqdm import tqdm
-from epmc_xml import fetch
+from mirna_curator.apis.article_cache import get_article
 import sqlite3
 
 
@@ -25,7 +25,7 @@ def w_pbar(pbar, func):
 
 
 def run_one_paper(pmcid, prompts, llm, trace_connection):
-    article = fetch.article(pmcid)
+    article = get_article(pmcid)
     result_dict = {}
     for prompt in prompts:
         if prompt.type.startswith("terminal"):  ## for now
@@ -0,0 +1,100 @@
+"""
+Append-only checkpointing of curation results.
+
+Each flush writes the results gathered since the last one to a new small parquet
+shard, so the cost of a checkpoint doesn't grow with the length of the run and
+earlier checkpoints are never rewritten. Shards are written to a temporary name
+and renamed into place, so a crash mid-write can't corrupt anything already saved.
+
+For a checkpoint path of `results_checkpoint.parquet`, shards go in the directory
+`results_checkpoint.parquet.shards/`. A single file at the checkpoint path itself,
+as written by older versions, is still read when resuming.
+"""
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+SHARD_PATTERN = re.compile(r"^part-(\d+)\.parquet$")
+
+
+class ShardedCheckpoint:
+    def __init__(self, checkpoint_path: str):
+        self.checkpoint_path = Path(checkpoint_path)
+        self.shard_dir = Path(f"{checkpoint_path}.shards")
+        self._next_shard = self._find_next_shard()
+
+    def _find_next_shard(self) -> int:
+        if not self.shard_dir.exists():
+            return 0
+        shard_numbers = [
+            int(match.group(1))
+            for match in map(SHARD_PATTERN.match, os.listdir(self.shard_dir))
+            if match is not None
+        ]
+        return max(shard_numbers, default=-1) + 1
+
+    def shard_paths(self) -> List[Path]:
+        """
+        All the files making up this checkpoint, oldest first
+        """
+        paths = []
+        if self.checkpoint_path.is_file():
+            paths.append(self.checkpoint_path)
+        if self.shard_dir.exists():
+            paths.extend(
+                sorted(
+                    p
+                    for p in self.shard_dir.iterdir()
+                    if SHARD_PATTERN.match(p.name) is not None
+                )
+            )
+        return paths
+
+    def exists(self) -> bool:
+        return len(self.shard_paths()) > 0
+
+    def flush(self, records: List[Dict[str, Any]]) -> Optional[Path]:
+        """
+        Write the records to a new shard. The caller can drop the records after this.
+
+        Returns the path of the new shard, or None if there was nothing to write
+        """
+        if len(records) == 0:
+            return None
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        shard_path = self.shard_dir / f"part-{self._next_shard:06d}.parquet"
+        tmp_path = self.shard_dir / f".{shard_path.name}.{os.getpid()}.tmp"
+        pl.DataFrame(records).write_parquet(tmp_path)
+        os.replace(tmp_path, shard_path)
+        self._next_shard += 1
+        logger.info("Checkpointed %d results to %s", len(records), shard_path)
+        return shard_path
+
+    def scan_done(self, key: str = "PMCID") -> Optional[pl.LazyFrame]:
+        """
+        Lazily read the set of keys already curated, or None if there's no checkpoint.
+
+        Only the key column is read from each shard, and shards are scanned separately
+        since their schemas can differ (the curation result struct depends on which
+        nodes were visited)
+        """
+        paths = self.shard_paths()
+        if len(paths) == 0:
+            return None
+        return pl.concat([pl.scan_parquet(p).select(key) for p in paths]).unique()
+
+    def read_all(self) -> pl.DataFrame:
+        """
+        Read every result in the checkpoint into one frame
+        """
+        paths = self.shard_paths()
+        if len(paths) == 0:
+            return pl.DataFrame()
+        return pl.concat([pl.read_parquet(p) for p in paths], how="diagonal_relaxed")
@@ -0,0 +1,261 @@
+"""
+Estimate the cost of a curation run before spending any GPU time on it.
+
+Every input paper is fetched (through the article cache), the sections each prompt
+in the flowchart targets are resolved, and the text is counted with the model's
+tokenizer only - no weights are loaded. From that we predict the context used along
+the longest path through the flowchart, whether it will overflow the context
+length, and roughly how long the run will take.
+
+The numbers are an upper bound: every node is assumed to use its full reasoning
+budget (the prompt's max_reasoning_tokens, or the default), and sections we can't
+match without asking the LLM are assumed to be the largest in the paper.
+"""
+
+import logging
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from epmc_xml.article import Article
+
+from mirna_curator.flowchart.curation import CurationFlowchart
+from mirna_curator.flowchart.flow_prompts import CurationPrompts
+from mirna_curator.flowchart.section_headings import SectionHeadingMap, match_section_heading
+from mirna_curator.llm_functions.section_fitting import NODE_OVERHEAD_TOKENS
+from mirna_curator.utils.prefetch import ArticlePrefetcher
+
+logger = logging.getLogger(__name__)
+
+## Rough throughputs for a single GPU, override them with measured numbers
+DEFAULT_PREFILL_TOKENS_PER_SECOND = 2000.0
+DEFAULT_DECODE_TOKENS_PER_SECOND = 30.0
+
+
+@dataclass
+class PaperEstimate:
+    PMCID: str
+    rna_id: str
+    context_tokens: int = 0
+    prefill_tokens: int = 0
+    generated_tokens: int = 0
+    unresolved_sections: List[str] = field(default_factory=list)
+    overflow: bool = False
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def flowchart_paths(flowchart: CurationFlowchart) -> List[List[str]]:
+    """
+    Every path through the flowchart from the start node to a node with no
+    transitions out of it
+    """
+    paths = []
+
+    def walk(node_name: str, path: List[str]) -> None:
+        path = path + [node_name]
+        transitions = flowchart.nodes[node_name].transitions
+        next_nodes = []
+        if transitions is not None:
+            next_nodes = [
+                n
+                for n in (transitions.true, transitions.false, transitions.next)
+                if n is not None and n not in path
+            ]
+        if len(next_nodes) == 0:
+            paths.append(path)
+        for next_node in next_nodes:
+            walk(next_node, path)
+
+    walk(flowchart.startNode, [])
+    return paths
+
+
+def resolve_section_name(
+    target_section: str, article: Article, heading_map: Optional[SectionHeadingMap] = None
+) -> Optional[str]:
+    """
+    The same matching the computation graph does before asking the LLM, including
+    headings it has learned if given its heading_map. Returns None where the graph
+    would have to ask.
+    """
+    headings = list(article.sections.keys())
+    if heading_map is not None:
+        return heading_map.match(target_section, headings)
+    return match_section_heading(target_section, headings)
+
+
+def estimate_paper(
+    article: Article,
+    pmcid: str,
+    rna_id: str,
+    flowchart: CurationFlowchart,
+    prompts: CurationPrompts,
+    count_tokens: Callable[[str], int],
+    context_length: int,
+    prefill_tps: float = DEFAULT_PREFILL_TOKENS_PER_SECOND,
+    decode_tps: float = DEFAULT_DECODE_TOKENS_PER_SECOND,
+    heading_map: Optional[SectionHeadingMap] = None,
+) -> PaperEstimate:
+    """
+    Estimate the cost of curating one RNA in one paper, taking the path through
+    the flowchart that uses the most context
+    """
+    ## Imported here so main can read the defaults above without loading guidance
+    from mirna_curator.llm_functions.reasoning import (
+        DEFAULT_SECTION_CHOICE_TOKENS,
+        reasoning_budget,
+    )
+
+    section_choice_tokens = (
+        prompts.section_choice_max_reasoning_tokens or DEFAULT_SECTION_CHOICE_TOKENS
+    )
+    prompt_lookup = {p.name: p for p in prompts.prompts}
+    system_tokens = sum(
+        count_tokens(p.prompt) for p in prompts.prompts if p.type == "system"
+    )
+
+    section_tokens = {}
+    unresolved = []
+    largest_section = max(
+        article.sections.keys(),
+        key=lambda name: len(article.sections[name]),
+        default=None,
+    )
+
+    def section_cost(target_section: str) -> Dict[str, Any]:
+        section_name = resolve_section_name(target_section, article, heading_map)
+        choice_tokens = 0
+        if section_name is None:
+            if target_section not in unresolved:
+                unresolved.append(target_section)
+            section_name = largest_section
+            choice_tokens = section_choice_tokens
+        if section_name is None:
+            return {"name": None, "tokens": 0, "choice": choice_tokens}
+        if section_name not in section_tokens:
+            section_tokens[section_name] = count_tokens(
+                article.get_section(
+                    section_name, include_figures=True, figures_placement="end"
+                )
+            )
+        return {
+            "name": section_name,
+            "tokens": section_tokens[section_name],
+            "choice": choice_tokens,
+        }
+
+    estimate = PaperEstimate(PMCID=pmcid, rna_id=rna_id)
+    for path in flowchart_paths(flowchart):
+        loaded_sections = set()
+        prefill = system_tokens
+        generated = 0
+        for node_name in path:
+            node_data = flowchart.nodes[node_name].data
+            prompt_name = node_data.prompt_name or node_data.terminal_name
+            prompt = prompt_lookup.get(prompt_name)
+            if prompt is None:
+                continue
+            if isinstance(prompt.prompt, str):
+                prompt_text = prompt.prompt
+                generations = 1
+            else:
+                ## A conditional terminal reasons over each condition, then the detector
+                prompt_text = "\n".join(prompt.prompt)
+                generations = len(prompt.prompt) + 1
+            prefill += count_tokens(prompt_text) + NODE_OVERHEAD_TOKENS
+            generated += generations * reasoning_budget(
+                {"max_reasoning_tokens": prompt.max_reasoning_tokens}
+            )
+            if prompt.target_section is not None:
+                section = section_cost(prompt.target_section)
+                generated += section["choice"]
+                if section["name"] not in loaded_sections:
+                    loaded_sections.add(section["name"])
+                    prefill += section["tokens"]
+
+        if prefill + generated > estimate.context_tokens:
+            estimate.context_tokens = prefill + generated
+            estimate.prefill_tokens = prefill
+            estimate.generated_tokens = generated
+
+    estimate.unresolved_sections = unresolved
+    estimate.overflow = estimate.context_tokens > context_length
+    estimate.seconds = (
+        estimate.prefill_tokens / prefill_tps + estimate.generated_tokens / decode_tps
+    )
+    return estimate
+
+
+def estimate_run(
+    rows: Iterable[Dict[str, Any]],
+    fetch_function: Callable[[str], Article],
+    flowchart: CurationFlowchart,
+    prompts: CurationPrompts,
+    count_tokens: Callable[[str], int],
+    context_length: int,
+    prefill_tps: float = DEFAULT_PREFILL_TOKENS_PER_SECOND,
+    decode_tps: float = DEFAULT_DECODE_TOKENS_PER_SECOND,
+    prefetch_depth: int = 4,
+    heading_map: Optional[SectionHeadingMap] = None,
+) -> "pl.DataFrame":
+    """
+    Estimate every input row, logging a summary of the whole run.
+
+    Returns one row per input row, with the predicted context usage and time
+    """
+    ## Imported here so main can read the defaults above without loading polars
+    import polars as pl
+
+    estimates = []
+    for prefetched in ArticlePrefetcher(
+        rows, depth=prefetch_depth, fetch_function=fetch_function
+    ):
+        pmcid = prefetched.row["PMCID"]
+        rna_id = prefetched.row["rna_id"]
+        if prefetched.error is not None:
+            logger.error(f"Failed to fetch/parse {pmcid}: {prefetched.error}")
+            estimate = PaperEstimate(
+                PMCID=pmcid, rna_id=rna_id, error=str(prefetched.error)
+            )
+        else:
+            estimate = estimate_paper(
+                prefetched.article,
+                pmcid,
+                rna_id,
+                flowchart,
+                prompts,
+                count_tokens,
+                context_length,
+                prefill_tps=prefill_tps,
+                decode_tps=decode_tps,
+                heading_map=heading_map,
+            )
+        estimates.append(asdict(estimate))
+
+    estimate_df = pl.DataFrame(estimates)
+    if estimate_df.height == 0:
+        logger.info("Nothing to estimate")
+        return estimate_df
+
+    estimated = estimate_df.filter(pl.col("error").is_null())
+    logger.info(
+        f"Estimated {estimated.height} of {estimate_df.height} rows, "
+        f"{estimate_df.height - estimated.height} could not be fetched"
+    )
+    if estimated.height > 0:
+        logger.info(
+            f"Context tokens per paper: median {estimated['context_tokens'].median():.0f}, "
+            f"max {estimated['context_tokens'].max()} (limit {context_length})"
+        )
+        logger.info(
+            f"{estimated['overflow'].sum()} papers will overflow the context length"
+        )
+        logger.info(
+            f"{estimated.filter(pl.col('unresolved_sections').list.len() > 0).height} "
+            "papers need the LLM to choose a section heading"
+        )
+        logger.info(
+            f"Predicted total: {estimated['seconds'].sum() / 3600:.2f} GPU-hours "
+            f"at {prefill_tps:.0f} prefill and {decode_tps:.0f} decode tokens/s"
+        )
+    return estimate_df
@@ -0,0 +1,103 @@
+"""
+Reading the curation input (PMCID and RNA ID pairs).
+
+Everything is expressed as one lazy query: scan the input, anti-join the papers
+already done in the checkpoint, then apply any class restriction and paper limit.
+Polars can then push all of that down into the scan, and in streaming mode we
+only ever hold one batch of rows in memory, however big the input is.
+"""
+
+import logging
+from typing import Any, Dict, Iterator, Optional
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+
+def scan_curation_input(input_data: str) -> pl.LazyFrame:
+    """
+    Lazily scan the input data, which can be parquet or csv
+
+    Raises:
+        ValueError: If the input is not in a supported format
+    """
+    if input_data.endswith("parquet") or input_data.endswith("pq"):
+        return pl.scan_parquet(input_data)
+    elif input_data.endswith("csv"):
+        return pl.scan_csv(input_data)
+    raise ValueError(f"Unsupported input data format for {input_data}")
+
+
+def build_curation_query(
+    input_data: str,
+    done: Optional[pl.LazyFrame] = None,
+    annot_class: Optional[int] = None,
+    max_papers: Optional[int] = None,
+) -> pl.LazyFrame:
+    """
+    Build the lazy query giving the rows still to be curated
+
+    Args:
+        input_data: Path to the parquet/csv input
+        done: Lazy frame of PMCIDs already curated, from the checkpoint
+        annot_class: Restrict to one class of annotation
+        max_papers: Limit on the number of rows to return
+    """
+    query = scan_curation_input(input_data)
+    if done is not None:
+        query = query.join(done, on="PMCID", how="anti")
+    if annot_class is not None:
+        query = query.filter(pl.col("class") == annot_class)
+    if max_papers is not None:
+        query = query.head(int(max_papers))
+    return query
+
+
+def group_by_paper(query: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Collect the rows for each PMCID together, so a paper mentioning several RNAs is
+    only fetched and loaded into context once.
+
+    Each row of the result has the PMCID, and a list of the original rows for that paper.
+    Papers come in the order of their first row in the input.
+    """
+    ## The streaming engine doesn't keep group order even with maintain_order, so
+    ## sort on each paper's first row instead. The group key is dropped from the
+    ## aggregated columns, so put it back in the struct
+    columns = query.collect_schema().names()
+    return (
+        query.with_row_index("_input_row")
+        .group_by("PMCID")
+        .agg(
+            pl.col("_input_row").min(),
+            rows=pl.struct(*columns),
+        )
+        .sort("_input_row")
+        .drop("_input_row")
+    )
+
+
+def iter_batches(query: pl.LazyFrame, batch_size: int) -> Iterator[pl.DataFrame]:
+    """
+    Run the query with the streaming engine, yielding frames of at most batch_size rows
+    """
+    if hasattr(query, "collect_batches"):
+        for batch in query.collect_batches(chunk_size=batch_size, lazy=True):
+            ## Chunks are a buffering hint, so re-slice to keep batches bounded
+            yield from batch.iter_slices(batch_size)
+    else:
+        logger.warning(
+            "This version of polars can't collect in batches, the whole input will be loaded"
+        )
+        yield from query.collect(engine="streaming").iter_slices(batch_size)
+
+
+def iter_curation_rows(
+    query: pl.LazyFrame, batch_size: int = 10_000
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the rows of the query one by one, reading batch_size rows at a time
+    """
+    for batch in iter_batches(query, batch_size):
+        yield from batch.iter_rows(named=True)
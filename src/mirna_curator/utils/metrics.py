@@ -0,0 +1,155 @@
+"""
+Structured performance metrics for a curation run.
+
+Each node visit records its wall time, the tokens the engine read and generated
+while running it, the tokens of article text it loaded, and the context length
+when it finished. These get rolled up
+into a few numeric fields per paper, which go in every output row and into a
+separate metrics parquet, so throughput can be compared across runs with a polars
+query rather than by grepping the logs.
+
+The prefix reuse ratio says how much of each prompt was served from the KV cache
+rather than evaluated again: for every stretch of new prompt text sent to the model,
+the tokens reused from the cache over the whole context. If it drops, something
+in the prompt layout is breaking llama.cpp's prefix matching.
+"""
+
+import operator
+import time
+from itertools import takewhile
+from typing import Any, Dict, List, Optional
+
+
+def track_prefix_reuse(llm) -> None:
+    """
+    Count how many prompt tokens the engine behind a guidance model reuses from its
+    KV cache, and how many it has to evaluate. This wraps the engine's get_logits,
+    matching the prefix the same way it does, and does nothing for engines that
+    don't keep a token cache.
+    """
+    engine = getattr(llm, "engine", None)
+    if not hasattr(engine, "_cache_token_ids") or hasattr(engine, "prefix_reuse"):
+        return
+    engine.prefix_reuse = {"reused_tokens": 0, "prefill_tokens": 0, "context_tokens": 0}
+    get_logits = engine.get_logits
+
+    def counting_get_logits(token_ids):
+        reused = sum(
+            takewhile(operator.truth, map(operator.eq, token_ids, engine._cache_token_ids))
+        )
+        new_tokens = len(token_ids) - reused
+        ## One new token is just the last one generated, not a new stretch of prompt
+        if new_tokens > 1:
+            engine.prefix_reuse["reused_tokens"] += reused
+            engine.prefix_reuse["prefill_tokens"] += new_tokens
+        engine.prefix_reuse["context_tokens"] = len(token_ids)
+        return get_logits(token_ids)
+
+    engine.get_logits = counting_get_logits
+
+
+def engine_counters(llm) -> Dict[str, Optional[int]]:
+    """
+    Read the cumulative token counters from the engine behind a guidance model.
+
+    engine_input_tokens only counts tokens actually evaluated, so tokens reused from
+    the KV cache aren't included. The context length and reuse counts come from
+    track_prefix_reuse if it's been applied, and the context length otherwise from
+    the llama.cpp model; they are None for engines that don't expose them. Likewise
+    the draft counts are None unless the engine is speculating with a draft model.
+    section_tokens counts the article text loaded into the context (see
+    llm_functions.prompt_layout.record_section_load).
+    """
+    engine = getattr(llm, "engine", None)
+    engine_metrics = getattr(engine, "metrics", None)
+    model_obj = getattr(engine, "model_obj", None)
+    prefix_reuse = getattr(engine, "prefix_reuse", None)
+    if prefix_reuse is None:
+        prefix_reuse = {
+            "reused_tokens": None,
+            "prefill_tokens": None,
+            "context_tokens": getattr(model_obj, "n_tokens", None),
+        }
+    speculative = getattr(engine, "speculative", None)
+    return {
+        "input_tokens": getattr(engine_metrics, "engine_input_tokens", 0),
+        "output_tokens": getattr(engine_metrics, "engine_output_tokens", 0),
+        "section_tokens": getattr(engine, "section_tokens", 0),
+        **prefix_reuse,
+        "drafted_tokens": speculative.stats["drafted_tokens"] if speculative else None,
+        "accepted_tokens": speculative.stats["accepted_tokens"] if speculative else None,
+    }
+
+
+class NodeTimer:
+    """
+    Measure one node visit. Create it as the node starts, and call finish once the
+    node has run to get the record for it.
+    """
+
+    def __init__(self, llm, node_name: str):
+        self.node_name = node_name
+        self.start = time.time()
+        self.counters = engine_counters(llm)
+
+    def finish(self, llm) -> Dict[str, Any]:
+        counters = engine_counters(llm)
+        return {
+            "node": self.node_name,
+            "seconds": time.time() - self.start,
+            "input_tokens": counters["input_tokens"] - self.counters["input_tokens"],
+            "output_tokens": counters["output_tokens"]
+            - self.counters["output_tokens"],
+            "section_tokens": counters["section_tokens"]
+            - self.counters["section_tokens"],
+            "context_tokens": counters["context_tokens"],
+            "reused_tokens": _difference(
+                counters["reused_tokens"], self.counters["reused_tokens"]
+            ),
+            "prefill_tokens": _difference(
+                counters["prefill_tokens"], self.counters["prefill_tokens"]
+            ),
+            "drafted_tokens": _difference(
+                counters["drafted_tokens"], self.counters["drafted_tokens"]
+            ),
+            "accepted_tokens": _difference(
+                counters["accepted_tokens"], self.counters["accepted_tokens"]
+            ),
+        }
+
+
+def _difference(end: Optional[int], start: Optional[int]) -> Optional[int]:
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+def summarise_node_metrics(node_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Roll the per-node records for one paper up into totals
+    """
+    context_tokens = [
+        m["context_tokens"] for m in node_metrics if m["context_tokens"] is not None
+    ]
+    reused_tokens = sum(m.get("reused_tokens") or 0 for m in node_metrics)
+    prefill_tokens = sum(m.get("prefill_tokens") or 0 for m in node_metrics)
+    drafted_tokens = sum(m.get("drafted_tokens") or 0 for m in node_metrics)
+    accepted_tokens = sum(m.get("accepted_tokens") or 0 for m in node_metrics)
+    output_tokens = sum(m["output_tokens"] for m in node_metrics)
+    seconds = sum(m["seconds"] for m in node_metrics)
+    return {
+        "nodes_visited": len(node_metrics),
+        "input_tokens": sum(m["input_tokens"] for m in node_metrics),
+        "output_tokens": output_tokens,
+        "output_tokens_per_second": output_tokens / seconds if seconds > 0 else None,
+        "section_tokens": sum(m.get("section_tokens") or 0 for m in node_metrics),
+        "peak_context_tokens": max(context_tokens, default=None),
+        "prefix_reuse_ratio": (
+            reused_tokens / (reused_tokens + prefill_tokens)
+            if reused_tokens + prefill_tokens > 0
+            else None
+        ),
+        "draft_acceptance_rate": (
+            accepted_tokens / drafted_tokens if drafted_tokens > 0 else None
+        ),
+    }
@@ -0,0 +1,115 @@
+"""
+Background fetching and parsing of articles.
+
+The curation loop is GPU bound, but every paper has to be fetched from EuropePMC
+and parsed before it can go into the computation graph. Doing that inline leaves
+the GPU idle for the whole network round trip, so instead we keep a bounded
+window of upcoming papers being fetched by worker threads while the current one
+is curated.
+"""
+
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from epmc_xml.article import Article
+
+from mirna_curator.apis.article_cache import ArticleCache, get_article
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrefetchedArticle:
+    """The input row for one paper, along with the article or the error hit fetching it"""
+
+    row: Dict[str, Any]
+    article: Optional[Article]
+    error: Optional[Exception]
+    fetch_time: float
+
+
+def fetch_and_parse(pmcid: str, cache: Optional[ArticleCache] = None) -> Article:
+    """
+    Fetch an article (from the on-disk cache if we have it) and build its sections,
+    ready to go into the computation graph
+    """
+    article = get_article(pmcid, cache=cache)
+    article.add_figures_section()
+    return article
+
+
+def _fetch_row(
+    row: Dict[str, Any], fetch_function: Callable[[str], Article]
+) -> PrefetchedArticle:
+    """
+    Runs in a worker thread. Exceptions are caught and handed back with the row so
+    the curation loop can report them in the same way it always has.
+    """
+    _fetch_start = time.time()
+    try:
+        article = fetch_function(row["PMCID"])
+        error = None
+    except Exception as e:
+        article = None
+        error = e
+    return PrefetchedArticle(
+        row=row, article=article, error=error, fetch_time=time.time() - _fetch_start
+    )
+
+
+class ArticlePrefetcher:
+    """
+    Producer/consumer pipeline over the input rows.
+
+    Iterating yields a PrefetchedArticle per row, in input order. At most `depth`
+    articles are in flight or waiting to be consumed at any one time, so memory
+    use is bounded no matter how long the input is.
+
+    A depth of 0 disables prefetching, and each article is fetched only when the
+    loop asks for it.
+    """
+
+    def __init__(
+        self,
+        rows: Iterable[Dict[str, Any]],
+        depth: int = 4,
+        workers: Optional[int] = None,
+        fetch_function: Callable[[str], Article] = fetch_and_parse,
+    ):
+        self.rows = rows
+        self.depth = max(depth, 0)
+        self.workers = workers if workers is not None else max(min(self.depth, 4), 1)
+        self.fetch_function = fetch_function
+
+    def __iter__(self) -> Iterator[PrefetchedArticle]:
+        if self.depth == 0:
+            for row in self.rows:
+                yield _fetch_row(row, self.fetch_function)
+            return
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="article_prefetch"
+        )
+        pending: deque[Future] = deque()
+        rows = iter(self.rows)
+        try:
+            ## Fill the window, then top it up by one every time we hand an article out
+            for row in rows:
+                pending.append(executor.submit(_fetch_row, row, self.fetch_function))
+                if len(pending) >= self.depth:
+                    break
+            while pending:
+                prefetched = pending.popleft().result()
+                next_row = next(rows, None)
+                if next_row is not None:
+                    pending.append(
+                        executor.submit(_fetch_row, next_row, self.fetch_function)
+                    )
+                yield prefetched
+        finally:
+            ## If the consumer stops early, don't wait for fetches nobody will use
+            executor.shutdown(wait=False, cancel_futures=True)
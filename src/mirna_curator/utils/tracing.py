@@ -3,6 +3,7 @@ import logging
 import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional
+import threading
 import uuid
 
 
@@ -40,6 +41,10 @@ class EventLogger:
         # Create output directory if it doesn't exist
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+        ## Papers can be curated concurrently in threads, so each has its own paper ID
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
         ## Use a run instance uid
         self.run_id = None
         self.paper_id = None
@@ -57,6 +62,14 @@ class EventLogger:
     def initialize_run(self) -> None:
         self.run_id = str(uuid.uuid4())
 
+    @property
+    def paper_id(self) -> Optional[str]:
+        return getattr(self._local, "paper_id", None)
+
+    @paper_id.setter
+    def paper_id(self, paper_id: Optional[str]) -> None:
+        self._local.paper_id = paper_id
+
     def set_paper_id(self, paper_id: str) -> None:
         """
         Set the paper ID, which will be included alongside the run ID in all events.
@@ -82,9 +95,9 @@ class EventLogger:
             "date": datetime.datetime.now().strftime("%Y-%m-%d"),
             **event_data,
         }
-        with open(self._get_current_filename(), "a", encoding="utf-8") as f:
-            json.dump(event_dict, f)
-            f.write("\n")
+        with self._write_lock:
+            with open(self._get_current_filename(), "a", encoding="utf-8") as f:
+                f.write(json.dumps(event_dict) + "\n")
 
 
 # Create singleton object when this module is imported
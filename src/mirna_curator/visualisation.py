@@ -1,25 +1,26 @@
-import networkx as nx
-import matplotlib.pyplot as plt
-import polars as pl
-import numpy as np
+import typing as ty
+from functools import lru_cache
+
 import click
 
-import holoviews as hv
+from mirna_curator.flowchart import curation
 
-hv.extension("bokeh")
-from bokeh.plotting import show
+if ty.TYPE_CHECKING:
+    import polars as pl
 
-import plotly.graph_objects as go
+## The plotting libraries are slow to import, so they're only loaded by the functions
+## that draw something
+FLOWCHART_PATH = "mirna_curation_flowchart_author_intent.json"
 
-from mirna_curator.flowchart import curation
 
-cf = curation.CurationFlowchart.model_validate_json(
-    open("mirna_curation_flowchart_author_intent.json", "r").read()
-)
+@lru_cache(maxsize=None)
+def get_flowchart(path: str = FLOWCHART_PATH) -> curation.CurationFlowchart:
+    return curation.CurationFlowchart.model_validate_json(open(path, "r").read())
 
 
 # I hate this but it works for now
-def get_edges_count(recorded_df: pl.DataFrame, cf: curation.CurationFlowchart):
+def get_edges_count(recorded_df: "pl.DataFrame", cf: curation.CurationFlowchart):
+    import polars as pl
 
     cf_true_edges = []
     cf_false_edges = []
@@ -52,7 +53,7 @@ def get_edges_count(recorded_df: pl.DataFrame, cf: curation.CurationFlowchart):
 
 
 def create_miRNA_flowchart_viz(
-    recorded_df: pl.DataFrame, expected_df: pl.DataFrame, filter_class: int
+    recorded_df: "pl.DataFrame", expected_df: "pl.DataFrame", filter_class: int
 ):
     """
     Create a visualization of the miRNA flowchart with node statistics.
@@ -61,6 +62,11 @@ def create_miRNA_flowchart_viz(
     recorded_df: Polars DataFrame with columns for each node and the actual outcomes
     expected_df: Polars DataFrame with columns for each node and the expected outcomes
     """
+    import matplotlib.pyplot as plt
+    import networkx as nx
+    import polars as pl
+
+    cf = get_flowchart()
     # Create directed graph
     G = nx.DiGraph()
 
@@ -210,6 +216,10 @@ def create_miRNA_flowchart_viz(
 
 
 def create_sankey_df(raw_df):
+    import holoviews as hv
+    import polars as pl
+
+    cf = get_flowchart()
     node_label_lookup = {
         "experimental_evidence": "Has experimental evidence",
         "functional_interaction": "Has functional interaction",
@@ -298,6 +308,12 @@ def create_sankey_df(raw_df):
     type=int,
 )
 def main(recorded_df, expected_df, filter_class):
+    import holoviews as hv
+    import polars as pl
+    from bokeh.plotting import show
+
+    hv.extension("bokeh")
+
     recorded_df = pl.read_parquet(recorded_df).unnest("curation_result")
     expected_df = pl.read_parquet(expected_df)
 
@@ -0,0 +1,74 @@
+"""
+The pruned record of a node has to start with the user turn the node itself sent,
+or the next node's prompt doesn't share its prefix with the cached context.
+"""
+
+import pytest
+
+from mirna_curator.llm_functions.conditions import (
+    compact_node_record,
+    prompted_flowchart_step_bool,
+    prompted_flowchart_step_tool,
+)
+from mirna_curator.llm_functions.prompt_layout import (
+    tool_question_text,
+    yes_no_question_text,
+)
+from mirna_curator.model.llm import get_model
+
+SECTION = (
+    "We transfected HeLa cells with a miR-21 mimic. "
+    "Luciferase activity of the PTEN 3' UTR reporter fell by half. "
+    "Mutating the seed match abolished the effect."
+)
+PROMPT = "Does the paper show the miRNA binding the target directly?"
+RNA_ID = "hsa-miR-21-5p"
+CONFIG = {"deepseek_mode": False, "max_reasoning_tokens": 32}
+
+
+@pytest.fixture
+def llm():
+    return get_model("stub", chat_template="chatml", backend="stub")
+
+
+def user_turn(text: str) -> str:
+    """
+    Everything up to the end of the turn that asks the question
+    """
+    return text[: text.index("<|im_end|>", text.index("Question:"))]
+
+
+def compact(llm, node, question=None):
+    return llm + compact_node_record(
+        SECTION,
+        True,
+        PROMPT,
+        RNA_ID,
+        node["answer"],
+        node["evidence"],
+        node["reasoning"],
+        question=question,
+    )
+
+
+def test_bool_node_record_keeps_user_turn(llm):
+    node = llm + prompted_flowchart_step_bool(SECTION, True, PROMPT, RNA_ID, config=CONFIG)
+    record = compact(llm, node)
+
+    assert user_turn(str(record)) == user_turn(str(node))
+    assert record["answer"] == node["answer"]
+    assert record["reasoning"] == node["reasoning"]
+
+
+def test_tool_node_record_keeps_user_turn(llm):
+    node = llm + prompted_flowchart_step_tool(
+        SECTION, True, PROMPT, RNA_ID, config=CONFIG, tools=[]
+    )
+    record = compact(llm, node, question=tool_question_text(PROMPT))
+
+    assert user_turn(str(record)) == user_turn(str(node))
+    assert record["answer"] == node["answer"]
+    assert record["evidence"] == node["evidence"]
+    ## The yes/no question isn't what a tool node asks
+    assert user_turn(str(compact(llm, node))) != user_turn(str(node))
+    assert yes_no_question_text(PROMPT).render(RNA_ID) not in str(node)
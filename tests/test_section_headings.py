@@ -0,0 +1,63 @@
+"""
+Learned section headings shared between processes
+"""
+
+import json
+from multiprocessing import get_context
+
+from mirna_curator.flowchart.section_headings import MIN_LEARNED_COUNT, SectionHeadingMap
+
+LEARNS = 20
+
+
+def learn_headings(path: str, heading: str) -> None:
+    heading_map = SectionHeadingMap(path)
+    for _ in range(LEARNS):
+        heading_map.learn("methods", heading)
+
+
+def test_learn_keeps_other_processes_choices(tmp_path):
+    path = str(tmp_path / "section_headings.json")
+    headings = ["Study design", "Cohort", "Assays", "Statistics"]
+    context = get_context("spawn")
+    workers = [context.Process(target=learn_headings, args=(path, h)) for h in headings]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    learned = json.loads(open(path).read())
+    assert learned == {
+        "methods": {"study design": LEARNS, "cohort": LEARNS, "assay": LEARNS, "statistic": LEARNS}
+    }
+
+
+def test_learn_picks_up_saved_choices(tmp_path):
+    path = str(tmp_path / "section_headings.json")
+    first, second = SectionHeadingMap(path), SectionHeadingMap(path)
+    for _ in range(MIN_LEARNED_COUNT - 1):
+        first.learn("results", "Observations")
+    second.learn("results", "Observations")
+
+    assert second.learned_match("results", ["Observations"]) == "Observations"
+    assert SectionHeadingMap(path).learned == {"results": {"observation": MIN_LEARNED_COUNT}}
+
+
+def test_learned_heading_needs_several_choices():
+    heading_map = SectionHeadingMap()
+    for _ in range(MIN_LEARNED_COUNT - 1):
+        heading_map.learn("conclusions", "Closing thoughts")
+        assert heading_map.learned_match("conclusions", ["Closing thoughts"]) is None
+    heading_map.learn("conclusions", "Closing thoughts")
+
+    assert heading_map.learned_match("conclusions", ["Closing thoughts"]) == "Closing thoughts"
+
+
+def test_learn_skips_choices_that_cant_be_right():
+    heading_map = SectionHeadingMap()
+    for _ in range(MIN_LEARNED_COUNT):
+        heading_map.learn("conclusions", "1. Introduction")
+        heading_map.learn("methods", "Results")
+        heading_map.learn("results", "Observations", headings=["Findings", "Methods"])
+
+    assert heading_map.learned == {}